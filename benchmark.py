@@ -0,0 +1,55 @@
+import argparse
+import json
+from src.benchmark import BenchmarkConfig, SCENARIOS, run_benchmark
+from src.stubs import Latency
+from src.utils import image_writer
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmark using stub providers")
+    parser.add_argument("--scenario", type=str, action="append", choices=SCENARIOS, help="Scenario to run (repeatable; default: all)")
+    parser.add_argument("--mode", type=str, default="loop", choices=["direct", "loop", "speculative"], help="Evaluation mode for every case")
+    parser.add_argument("--cases", type=int, default=100, help="Number of cases per scenario")
+    parser.add_argument("--generate-latency", type=float, default=0.5, help="Median generate latency in seconds")
+    parser.add_argument("--edit-latency", type=float, default=0.5, help="Median edit latency in seconds")
+    parser.add_argument("--analyze-latency", type=float, default=0.2, help="Median analyze latency in seconds")
+    parser.add_argument("--latency-sigma", type=float, default=0.3, help="Log-normal sigma of every latency (0 for fixed)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Probability that a stub call fails")
+    parser.add_argument("--image-size", type=int, default=1024, help="Width and height of generated images in pixels")
+    parser.add_argument("--concurrency", type=int, default=8, help="Per-stage concurrency for batch scenarios")
+    parser.add_argument("--candidates", type=int, default=3, help="Candidates per case in speculative mode")
+    parser.add_argument("--save-images", action="store_true", help="Also persist images to output/ (measures disk writes)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--output", type=str, help="Write the JSON report to this file")
+
+    args = parser.parse_args()
+    image_writer.enabled = args.save_images
+
+    reports = []
+    for scenario in args.scenario or SCENARIOS:
+        config = BenchmarkConfig(
+            scenario=scenario,
+            mode=args.mode,
+            cases=args.cases,
+            generate_latency=Latency(args.generate_latency, args.latency_sigma),
+            edit_latency=Latency(args.edit_latency, args.latency_sigma),
+            analyze_latency=Latency(args.analyze_latency, args.latency_sigma),
+            failure_rate=args.failure_rate,
+            width=args.image_size,
+            height=args.image_size,
+            generate_concurrency=args.concurrency,
+            analyze_concurrency=args.concurrency,
+            edit_concurrency=args.concurrency,
+            candidates=args.candidates,
+            seed=args.seed,
+        )
+        report = run_benchmark(config)
+        print(json.dumps(report), flush=True)
+        reports.append(report)
+    image_writer.flush()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(reports, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,52 +1,140 @@
 import argparse
+import asyncio
+import json
+import multiprocessing
 import os
+import uuid
+from contextlib import nullcontext
+from datetime import datetime
 from dotenv import load_dotenv
-from src.generators import GeminiGenerator, OpenAIGenerator, FalGenerator
-from src.editors import GeminiEditor, OpenAIEditor, FalEditor
-from src.analyzers import QwenAnalyzer, GeminiAnalyzer
+from src.analyzers import EnsembleAnalyzer
 from src.evaluator import EvaluationLoop
+from src.batch import BatchRunner, load_suite
+from src.journal import Journal
+from src.cache import AnalysisCache, CachedAnalyzer
+from src.utils import image_writer
+from src.store import ContentStore, FlatStore
+from src.downloads import downloader
+from src.ratelimit import limiters
+from src.tracing import tracer
+from src.registry import BUILTINS, providers
+from src.preprocess import FORMATS, ImagePreprocessor
+from src.results import ResultsStore
+from src.sweep import AdaptiveSweep
+from src.jobqueue import open_queue
+from src.worker import Worker, enqueue_cases
 
 load_dotenv()
 
-def main():
-    parser = argparse.ArgumentParser(description="Image Generation and Analysis Evaluation")
-    parser.add_argument("--prompt", type=str, required=True, help="Prompt for generation")
-    parser.add_argument("--count", type=int, required=True, help="Target count of objects")
-    parser.add_argument("--object", type=str, help="Specific object name to count (overrides extraction from prompt)")
-    parser.add_argument("--generator", type=str, default="gemini", choices=["gemini", "openai", "fal"], help="Generator model")
-    parser.add_argument("--editor", type=str, default="openai", choices=["gemini", "openai", "fal"], help="Editor model")
-    parser.add_argument("--analyzer", type=str, default="qwen", choices=["qwen", "gemini"], help="Analyzer model")
-    parser.add_argument("--mode", type=str, default="direct", choices=["direct", "loop"], help="Evaluation mode")
-    
-    args = parser.parse_args()
-    
-    # Initialize Generator
-    if args.generator == "gemini":
-        generator = GeminiGenerator()
-    elif args.generator == "openai":
-        generator = OpenAIGenerator()
-    elif args.generator == "fal":
-        generator = FalGenerator() # Default Recraft
-        
-    # Initialize Editor
+def build_generator(name):
+    # Only the selected provider's module is imported.
+    return providers.create("generator", name)
+
+def build_analyzer(name, preprocessor=None, structured=False):
+    # Only pass options that were asked for, so analyzers without them (stubs, plugins) still build.
+    options, flags = {}, []
+    if preprocessor is not None:
+        options["preprocessor"] = preprocessor
+        flags.append("--analyze-max-dim/--analyze-format")
+    if structured:
+        options["structured"] = True
+        flags.append("--structured-analysis")
+    try:
+        return providers.create("analyzer", name, **options)
+    except TypeError as e:
+        if not options:
+            raise
+        # Reported as a usage error instead of a traceback.
+        raise ValueError(f"Analyzer {name!r} does not support {' or '.join(flags)} ({e})") from e
+
+def build_providers(args):
+    generator = build_generator(args.generator)
+
     if args.editor == "gemini":
         print("Warning: Gemini Editor is not fully implemented yet. Using OpenAI Editor as fallback.")
-        editor = OpenAIEditor()
-    elif args.editor == "openai":
-        editor = OpenAIEditor()
-    elif args.editor == "fal":
-        editor = FalEditor()
-        
-    # Initialize Analyzer
-    if args.analyzer == "qwen":
-        analyzer = QwenAnalyzer()
-    elif args.analyzer == "gemini":
-        analyzer = GeminiAnalyzer()
-        
-    loop = EvaluationLoop(generator, analyzer, editor if args.mode == "loop" else None)
+        editor = providers.create("editor", "openai")
+    else:
+        editor = providers.create("editor", args.editor)
+
+    # One preprocessor shared by every analyzer, so ensemble members reuse each derived image.
+    preprocessor = None
+    if args.analyze_max_dim or args.analyze_format:
+        preprocessor = ImagePreprocessor(args.analyze_max_dim, args.analyze_format, args.analyze_quality)
+
+    if args.ensemble_analyzer:
+        analyzer = EnsembleAnalyzer([build_analyzer(name, preprocessor, args.structured_analysis) for name in args.ensemble_analyzer], quorum=args.quorum)
+    else:
+        analyzer = build_analyzer(args.analyzer, preprocessor, args.structured_analysis)
+
+    if args.analysis_cache:
+        cache = AnalysisCache(args.analysis_cache, max_entries=args.cache_max_entries, bypass=args.cache_bypass)
+        analyzer = CachedAnalyzer(analyzer, cache)
+
+    return generator, editor, analyzer
+
+def configure_limits(args):
+    # Keys are a provider ("openai") or provider/model ("fal/fal-ai/recraft-v3").
+    for spec in args.rate_limit or []:
+        key, value = spec.split("=", 1)
+        limiters.configure(key, rate=float(value))
+    for spec in args.max_inflight or []:
+        key, value = spec.split("=", 1)
+        limiters.configure(key, max_concurrency=int(value))
+    # Only enforced by queue workers, which share the slots through the queue.
+    for spec in args.global_max_inflight or []:
+        key, value = spec.split("=", 1)
+        limiters.configure(key, global_max_inflight=int(value))
+
+def configure_process(args):
+    """Applies the image, download, limiter and pricing options to this process's shared singletons."""
+    image_writer.enabled = not args.no_save_images
+    if args.image_store == "flat":
+        image_writer.store = FlatStore()
+    downloader.configure(timeout=args.download_timeout, retries=args.download_retries)
+    configure_limits(args)
+    if args.prices:
+        with open(args.prices) as f:
+            tracer.set_prices(json.load(f))
+
+def build_candidate_generators(args, generator):
+    if not args.candidate_generator:
+        return None
+    # Reuse the main generator instance when it is listed again.
+    return [generator if name == args.generator else build_generator(name) for name in args.candidate_generator]
+
+def build_results_store(args):
+    """The columnar results store and the run labels written with every result, or (None, {})."""
+    if not args.results_store:
+        return None, {}
+    labels = {
+        "run_id": f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}",
+        "generator": "+".join(args.candidate_generator) if args.candidate_generator else args.generator,
+        "editor": args.editor,
+        "analyzer": "+".join(args.ensemble_analyzer) if args.ensemble_analyzer else args.analyzer,
+    }
+    return ResultsStore(args.results_store), labels
+
+def store_result(store, labels, result):
+    if store is not None:
+        # Direct-mode results never used the editor.
+        store.append(result, **{**labels, "editor": labels["editor"] if result.get("mode", "direct") != "direct" else ""})
+
+def run_single(args, generator, editor, analyzer, candidate_generators):
+    loop = EvaluationLoop(
+        generator,
+        analyzer,
+        editor if args.mode in ("loop", "speculative") else None,
+        candidates=args.candidates,
+        candidate_generators=candidate_generators,
+    )
     try:
         result = loop.run(args.prompt, args.count, args.mode, args.object)
-        
+        result.update(prompt=args.prompt, object=args.object, mode=args.mode)
+        store, labels = build_results_store(args)
+        store_result(store, labels, result)
+        if store is not None:
+            store.close()
+
         print("\n--- Result ---")
         print(f"Target Count: {result['target_count']}")
         print(f"Detected Count: {result['detected_count']}")
@@ -54,12 +142,243 @@ def main():
         print(f"Final Image: {result['image_path']}")
         print("Steps:")
         for step in result['steps']:
-            print(f"  - {step['action']}: {step['count']}")
-            
+            print(f"  - {step['action']}: {step['count']} (${step['cost_usd']:.4f}, timings: {step['timings']})")
+        print(f"Cost: ${result['cost_usd']:.4f}")
+
     except Exception as e:
         print(f"\nAn error occurred during execution: {e}")
         import traceback
         traceback.print_exc()
 
+def run_batch(args, generator, editor, analyzer, candidate_generators):
+    cases = load_suite(args.suite, default_mode=args.mode)
+    uses_loop = any(case.mode in ("loop", "speculative") for case in cases)
+
+    # One journal per suite unless a path is given.
+    journal_path = args.journal or os.path.join("output", "journals", os.path.splitext(os.path.basename(args.suite))[0] + ".jsonl")
+    journal = Journal(journal_path)
+    if args.resume:
+        journal.load()
+    else:
+        journal.start()
+    runner = BatchRunner(
+        generator,
+        analyzer,
+        editor if uses_loop else None,
+        generate_concurrency=args.generate_concurrency,
+        analyze_concurrency=args.analyze_concurrency,
+        edit_concurrency=args.edit_concurrency,
+        candidates=args.candidates,
+        candidate_generators=candidate_generators,
+        journal=journal,
+    )
+    resumed = runner.finished(cases)
+    if resumed:
+        print(f"Resuming: {len(resumed)} of {len(cases)} cases already finished in {journal_path}", flush=True)
+
+    results_file = open(args.results, "a") if args.results else None
+    store, labels = build_results_store(args)
+    matches = sum(bool(result.get("match")) for result in resumed)
+
+    def emit(result):
+        nonlocal matches
+        line = json.dumps(result)
+        print(line, flush=True)
+        if results_file:
+            results_file.write(line + "\n")
+            results_file.flush()
+        store_result(store, labels, result)
+        matches += int(bool(result.get("match")))
+
+    # With --sweep the suite lists buckets, sampled adaptively instead of run once each.
+    sweep = AdaptiveSweep(
+        cases,
+        tolerance=args.tolerance,
+        budget=args.budget,
+        min_samples=args.min_samples,
+        max_samples=args.max_samples,
+        confidence=args.confidence,
+    ) if args.sweep else None
+
+    async def emit_async():
+        async for result in (sweep.arun(runner) if sweep else runner.arun(cases)):
+            emit(result)
+
+    try:
+        if args.use_async:
+            asyncio.run(emit_async())
+        else:
+            for result in (sweep.run(runner) if sweep else runner.run(cases)):
+                emit(result)
+    finally:
+        if results_file:
+            results_file.close()
+        if store is not None:
+            store.close()
+        journal.close()
+
+    if sweep:
+        print("\n--- Sweep ---")
+        for row in sweep.report():
+            print(json.dumps(row))
+        print(f"Cases: {sweep.started} of budget {sweep.budget}; settled buckets: {sum(row['settled'] for row in sweep.report())} of {len(cases)}")
+
+    metrics = tracer.to_json()
+    # A sweep's suite lists buckets; count the samples it ran, like Matches does.
+    total = sweep.started + len(resumed) if sweep else len(cases)
+    print(f"\n--- Batch Summary ---\nCases: {total}\nResumed: {len(resumed)}\nMatches: {matches}\nCost: ${metrics['cost_usd']:.4f}")
+    if metrics["cost_per_correct_image_usd"] is not None:
+        print(f"Cost per correct image: ${metrics['cost_per_correct_image_usd']:.4f}")
+    for stats in limiters.stats():
+        print(f"Limiter {stats['name']}: {stats}")
+
+def build_queue(args):
+    return open_queue(args.queue, lease_seconds=args.lease_seconds, max_attempts=args.max_attempts)
+
+def run_worker(args):
+    """Entry point of one worker process: rebuilds providers from the CLI arguments and drains the queue."""
+    configure_process(args)
+    generator, editor, analyzer = build_providers(args)
+    runner = BatchRunner(
+        generator,
+        analyzer,
+        editor,
+        generate_concurrency=args.generate_concurrency,
+        analyze_concurrency=args.analyze_concurrency,
+        edit_concurrency=args.edit_concurrency,
+        candidates=args.candidates,
+        candidate_generators=build_candidate_generators(args, generator),
+    )
+    worker = Worker(build_queue(args), runner)
+    worker.use_global_limits()
+    store, labels = build_results_store(args)
+    try:
+        for result in worker.run():
+            print(json.dumps(result), flush=True)
+            store_result(store, labels, result)
+    finally:
+        if store is not None:
+            store.close()
+        image_writer.flush()
+    print(f"Worker {worker.worker_id}: {worker.completed} cases, {worker.retried} retried attempts, {worker.lost} lost leases", flush=True)
+
+def run_queue(args):
+    queue = build_queue(args)
+    if args.enqueue:
+        cases = load_suite(args.suite, default_mode=args.mode)
+        print(f"Enqueued {enqueue_cases(queue, cases)} of {len(cases)} cases into {args.queue}", flush=True)
+
+    if args.workers:
+        # Spawned, not forked: each worker builds its own SDK clients, connections and threads.
+        context = multiprocessing.get_context("spawn")
+        processes = [context.Process(target=run_worker, args=(args,), name=f"worker-{i}") for i in range(args.workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+    if args.collect:
+        results = list(queue.results())
+        with open(args.results, "w") if args.results else nullcontext() as results_file:
+            for result in results:
+                print(json.dumps(result))
+                if results_file:
+                    results_file.write(json.dumps(result) + "\n")
+        print(f"\n--- Queue Results ---\nCases: {len(results)}\nMatches: {sum(bool(result.get('match')) for result in results)}\nErrors: {sum('error' in result for result in results)}")
+        print(f"Cost: ${sum(result.get('cost_usd') or 0.0 for result in results):.4f}")
+    print(f"Queue: {queue.stats()}")
+    queue.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Image Generation and Analysis Evaluation")
+    parser.add_argument("--prompt", type=str, help="Prompt for generation")
+    parser.add_argument("--count", type=int, help="Target count of objects")
+    parser.add_argument("--object", type=str, help="Specific object name to count (overrides extraction from prompt)")
+    parser.add_argument("--generator", type=str, default="gemini", help=f"Generator model ({', '.join(BUILTINS['generator'])} or an installed plugin)")
+    parser.add_argument("--editor", type=str, default="openai", help=f"Editor model ({', '.join(BUILTINS['editor'])} or an installed plugin)")
+    parser.add_argument("--analyzer", type=str, default="qwen", help=f"Analyzer model ({', '.join(BUILTINS['analyzer'])} or an installed plugin)")
+    parser.add_argument("--ensemble-analyzer", action="append", help="Analyze with an ensemble of these analyzers (repeatable; overrides --analyzer)")
+    parser.add_argument("--quorum", type=int, help="Votes that must agree before the ensemble returns, from 1 to the number of analyzers (default: majority)")
+    parser.add_argument("--mode", type=str, default="direct", choices=["direct", "loop", "speculative"], help="Evaluation mode")
+    parser.add_argument("--candidates", type=int, default=3, help="Number of candidates generated concurrently in speculative mode")
+    parser.add_argument("--candidate-generator", action="append", help="Generator used for speculative candidates, round-robin (repeatable; defaults to --generator)")
+    parser.add_argument("--suite", type=str, help="JSONL or CSV file of cases to run in batch mode")
+    parser.add_argument("--results", type=str, help="Append batch results to this JSONL file")
+    parser.add_argument("--results-store", type=str, help="Also append results and steps to this columnar store directory (Parquet, or .npz without pyarrow) for results_report.py")
+    parser.add_argument("--journal", type=str, help="Append-only journal of finished steps (default: output/journals/<suite>.jsonl)")
+    parser.add_argument("--resume", action="store_true", help="Skip cases and steps already in the journal, reusing their images from output/")
+    parser.add_argument("--sweep", action="store_true", help="Treat suite rows as (prompt, count) buckets and sample them adaptively until each match rate is known to within --tolerance")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Stop sampling a bucket once its match-rate confidence interval is narrower than this")
+    parser.add_argument("--budget", type=int, default=1000, help="Maximum cases a sweep may run in total")
+    parser.add_argument("--min-samples", type=int, default=5, help="Cases every sweep bucket gets before adaptive sampling starts")
+    parser.add_argument("--max-samples", type=int, help="Stop sampling a sweep bucket after this many cases")
+    parser.add_argument("--confidence", type=float, default=0.95, help="Confidence level of sweep intervals")
+    parser.add_argument("--generate-concurrency", type=int, default=4, help="Max concurrent generate calls in batch mode")
+    parser.add_argument("--analyze-concurrency", type=int, default=4, help="Max concurrent analyze calls in batch mode")
+    parser.add_argument("--edit-concurrency", type=int, default=4, help="Max concurrent edit calls in batch mode")
+    parser.add_argument("--structured-analysis", action="store_true", help='Request schema-constrained {"count": N} answers and stop streaming as soon as the count is parsed')
+    parser.add_argument("--analyze-max-dim", type=int, help="Downscale images so neither side exceeds this many pixels before analysis")
+    parser.add_argument("--analyze-format", type=str, choices=list(FORMATS), help="Re-encode images in this format before analysis")
+    parser.add_argument("--analyze-quality", type=int, default=85, help="JPEG/WebP quality used with --analyze-format")
+    parser.add_argument("--analysis-cache", type=str, help="SQLite file caching analyzer counts by image hash, model and prompt")
+    parser.add_argument("--cache-max-entries", type=int, default=100_000, help="Evict least recently used cache entries beyond this size")
+    parser.add_argument("--cache-bypass", action="store_true", help="Skip cache lookups but still store fresh results")
+    parser.add_argument("--image-store", type=str, default="content", choices=["content", "flat"], help="Store images content-addressed with a SQLite index under output/images, or flat in output/")
+    parser.add_argument("--store-max-bytes", type=int, help="After the run, evict least recently used images until the content store fits in this many bytes")
+    parser.add_argument("--store-max-age-days", type=float, help="After the run, drop images the content store indexed more than this many days ago")
+    parser.add_argument("--no-save-images", action="store_true", help="Keep images in memory only; output paths are reported but not written")
+    parser.add_argument("--download-timeout", type=float, default=60.0, help="Read timeout in seconds for result image downloads")
+    parser.add_argument("--download-retries", type=int, default=3, help="Retries for failed result image downloads")
+    parser.add_argument("--rate-limit", action="append", metavar="PROVIDER[/MODEL]=RPS", help="Requests per second allowed for a provider or model (repeatable)")
+    parser.add_argument("--max-inflight", action="append", metavar="PROVIDER[/MODEL]=N", help="Upper bound on concurrent calls to a provider or model (repeatable)")
+    parser.add_argument("--metrics-json", type=str, help="Write stage latency histograms, token usage and cost to this JSON file")
+    parser.add_argument("--metrics-prom", type=str, help="Write the same metrics as a Prometheus textfile (node_exporter textfile collector)")
+    parser.add_argument("--prices", type=str, help='JSON file of per-model prices overriding the defaults, e.g. {"gpt-image-1": {"input": 5.0, "output": 40.0}}')
+    parser.add_argument("--queue", type=str, help="Shared job queue for worker mode: sqlite:PATH (one host) or file:DIRECTORY (shared storage, several hosts)")
+    parser.add_argument("--enqueue", action="store_true", help="Add the --suite cases to --queue; cases already in the queue are skipped")
+    parser.add_argument("--workers", type=int, default=0, help="Start this many worker processes that run cases from --queue until it is drained")
+    parser.add_argument("--collect", action="store_true", help="Print the results finished in --queue (and write them to --results)")
+    parser.add_argument("--lease-seconds", type=float, default=120.0, help="A claimed case returns to the queue if its worker sends no heartbeat for this long")
+    parser.add_argument("--max-attempts", type=int, default=3, help="Claims per case before an erroring or abandoned case is marked failed")
+    parser.add_argument("--global-max-inflight", action="append", metavar="PROVIDER[/MODEL]=N", help="Upper bound on concurrent calls to a provider or model across all queue workers (repeatable)")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Run the batch on one event loop using the async provider clients")
+
+    args = parser.parse_args()
+    if args.queue:
+        if not (args.enqueue or args.workers or args.collect):
+            parser.error("--queue needs --enqueue, --workers or --collect")
+        if args.enqueue and not args.suite:
+            parser.error("--enqueue requires --suite")
+        run_queue(args)
+        return
+    if not args.suite and (args.prompt is None or args.count is None):
+        parser.error("--prompt and --count are required unless --suite is given")
+
+    configure_process(args)
+    try:
+        generator, editor, analyzer = build_providers(args)
+        candidate_generators = build_candidate_generators(args, generator)
+    except (TypeError, ValueError) as e:
+        # Unknown providers, bad option values, or options a provider does not accept.
+        parser.error(str(e))
+
+    if args.suite:
+        run_batch(args, generator, editor, analyzer, candidate_generators)
+    else:
+        run_single(args, generator, editor, analyzer, candidate_generators)
+    image_writer.flush()
+
+    if isinstance(image_writer.store, ContentStore) and (args.store_max_bytes is not None or args.store_max_age_days is not None):
+        max_age = args.store_max_age_days * 86400 if args.store_max_age_days is not None else None
+        print(f"Image store gc: {image_writer.store.gc(max_bytes=args.store_max_bytes, max_age=max_age)}")
+
+    if args.metrics_json:
+        tracer.write_json(args.metrics_json)
+    if args.metrics_prom:
+        tracer.write_prometheus(args.metrics_prom)
+
+    if isinstance(analyzer, CachedAnalyzer):
+        print(f"Analysis cache: {analyzer.cache.stats()}")
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,61 @@
+import argparse
+import json
+from dotenv import load_dotenv
+from src.evaluator import count_prompt
+from src.models import ImageResult
+from src.preprocess import payload_report
+from src.registry import BUILTINS, providers
+
+load_dotenv()
+
+DEFAULT_SETTINGS = ["original", "1024:jpeg:85", "768:jpeg:80", "512:webp:80"]
+
+def load_samples(path: str, matched_only: bool, limit: int = 0) -> list[tuple[ImageResult, int, str]]:
+    """Reads labelled images from a JSONL file of {"image_path", "count" or "target_count", "object"/"prompt"}.
+
+    Batch results files work as-is; with matched_only, only images whose full-size analysis matched are used.
+    """
+    samples = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if matched_only and not row.get("match"):
+                continue
+            if not row.get("image_path"):
+                continue
+            target_object = row.get("object") or row.get("prompt", "objects").split()[-1]
+            count = row["count"] if "count" in row else row["target_count"]
+            samples.append((ImageResult(image_path=row["image_path"], metadata={}), int(count), count_prompt(target_object)))
+            if limit and len(samples) >= limit:
+                break
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare analyzer accuracy against upload payload size for preprocessing settings")
+    parser.add_argument("--samples", type=str, required=True, help="JSONL of labelled images (a batch --results file works)")
+    parser.add_argument("--matched-only", action="store_true", help="Only use results whose full-size analysis matched the target")
+    parser.add_argument("--analyzer", type=str, default="qwen", help=f"Analyzer model ({', '.join(BUILTINS['analyzer'])} or an installed plugin)")
+    parser.add_argument("--setting", action="append", metavar="original|MAX_DIM[:FORMAT[:QUALITY]]", help=f"Preprocessing setting to compare (repeatable; default: {' '.join(DEFAULT_SETTINGS)})")
+    parser.add_argument("--limit", type=int, default=0, help="Use at most this many samples")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent analyzer calls")
+    parser.add_argument("--output", type=str, help="Write the JSON report to this file")
+
+    args = parser.parse_args()
+    samples = load_samples(args.samples, args.matched_only, args.limit)
+    rows = payload_report(
+        lambda preprocessor: providers.create("analyzer", args.analyzer, preprocessor=preprocessor),
+        samples,
+        args.setting or DEFAULT_SETTINGS,
+        concurrency=args.concurrency,
+    )
+    for row in rows:
+        print(json.dumps(row), flush=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(rows, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import argparse
+import json
+import time
+from src.analytics import DIMENSIONS, accuracy, confusion_matrices, select
+from src.results import ResultsStore, np
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy, error and edit statistics over a columnar results store")
+    parser.add_argument("--store", type=str, default="output/results", help="Results store directory written with main.py --results-store")
+    parser.add_argument("--by", action="append", choices=DIMENSIONS, help="Group by this column (repeatable; default: overall)")
+    parser.add_argument("--run", action="append", help="Only include these run IDs (repeatable)")
+    parser.add_argument("--since-days", type=float, help="Only include results from the last N days")
+    parser.add_argument("--confusion", action="store_true", help="Also print target-by-detected confusion matrices per group")
+    parser.add_argument("--max-edits", type=int, default=5, help="Fold edits-to-match beyond this into one bucket")
+    parser.add_argument("--output", type=str, help="Write the JSON report to this file")
+
+    args = parser.parse_args()
+    started = time.perf_counter()
+    table = ResultsStore(args.store).load("results")
+    if args.run:
+        table = select(table, np.isin(table["run_id"], args.run))
+    if args.since_days is not None:
+        table = select(table, table["time"] >= time.time() - args.since_days * 86400)
+
+    by = args.by or []
+    report = {"rows": len(table["run_id"]), "by": by, "accuracy": accuracy(table, by, args.max_edits)}
+    if args.confusion:
+        report["confusion"] = confusion_matrices(table, by)
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    for row in report["accuracy"]:
+        print(json.dumps(row), flush=True)
+    for matrix in report.get("confusion", []):
+        print(json.dumps(matrix), flush=True)
+    print(f"{report['rows']} results in {report['seconds']}s")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
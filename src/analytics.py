@@ -0,0 +1,101 @@
+from typing import Optional, Sequence
+from .results import np
+
+# Columns results can be grouped by.
+DIMENSIONS = ("target_count", "object", "generator", "editor", "analyzer", "mode", "run_id")
+
+def select(table: dict, mask) -> dict:
+    """The rows of the table where mask is true, e.g. select(table, table["time"] >= since)."""
+    return {name: column[mask] for name, column in table.items()}
+
+def group_codes(table: dict, by: Sequence[str]) -> tuple:
+    """Integer group code per row for the combination of the by columns, and each group's key values."""
+    n = len(next(iter(table.values()))) if table else 0
+    if not by:
+        return np.zeros(n, dtype=np.int64), [()]
+    combined = np.zeros(n, dtype=np.int64)
+    for name in by:
+        values, codes = np.unique(table[name], return_inverse=True)
+        # Re-number after each column so the combined code stays below n * len(values).
+        _, combined = np.unique(combined * len(values) + codes, return_inverse=True)
+    # Codes follow the sorted order of the key tuples; read each group's key off its first row.
+    _, first = np.unique(combined, return_index=True)
+    return combined, [tuple(_scalar(table[name][i]) for name in by) for i in first]
+
+def accuracy(table: dict, by: Sequence[str] = (), max_edits: int = 5) -> list[dict]:
+    """Exact-match rate, MAE and signed bias of detected vs target counts per group.
+
+    Failed analyses (detected count -1) and errored cases count against the match rate but are left
+    out of MAE and bias. edits_to_match[k] is the number of cases that first matched after k edits,
+    with cases needing more than max_edits folded into the last bucket and "never" for no match.
+    """
+    codes, keys = group_codes(table, by)
+    groups = len(keys)
+    target = table["target_count"]
+    detected = table["detected_count"]
+    valid = (detected >= 0) & ~table["error"]
+    error = (detected - target).astype(np.float64)
+
+    n = np.bincount(codes, minlength=groups)
+    matches = np.bincount(codes, weights=table["match"], minlength=groups)
+    n_valid = np.bincount(codes, weights=valid, minlength=groups)
+    abs_error = np.bincount(codes, weights=np.where(valid, np.abs(error), 0.0), minlength=groups)
+    signed_error = np.bincount(codes, weights=np.where(valid, error, 0.0), minlength=groups)
+    cost = np.bincount(codes, weights=table["cost_usd"], minlength=groups)
+
+    edits = table["edits_to_match"]
+    # Bucket max_edits + 1 holds cases that never matched.
+    buckets = np.where(edits < 0, max_edits + 1, np.minimum(edits, max_edits))
+    edit_counts = np.bincount(codes * (max_edits + 2) + buckets, minlength=groups * (max_edits + 2)).reshape(groups, max_edits + 2)
+
+    rows = []
+    for i, key in enumerate(keys):
+        rows.append({
+            **dict(zip(by, key)),
+            "n": int(n[i]),
+            "exact_match_rate": _ratio(matches[i], n[i]),
+            "mae": _ratio(abs_error[i], n_valid[i]),
+            "bias": _ratio(signed_error[i], n_valid[i]),
+            "failed": int(n[i] - n_valid[i]),
+            "cost_usd": round(float(cost[i]), 6),
+            "cost_per_match_usd": _ratio(cost[i], matches[i]),
+            "edits_to_match": {
+                **{str(k) if k < max_edits else f"{max_edits}+": int(edit_counts[i, k]) for k in range(max_edits + 1)},
+                "never": int(edit_counts[i, max_edits + 1]),
+            },
+        })
+    return rows
+
+def confusion_matrices(table: dict, by: Sequence[str] = (), counts: Optional[Sequence[int]] = None) -> list[dict]:
+    """Target-by-detected count matrices per group.
+
+    labels are the counts on both axes (target rows, detected columns); detected counts outside the
+    labels, including failed analyses, land in the extra last "other" column.
+    """
+    codes, keys = group_codes(table, by)
+    target = table["target_count"]
+    detected = table["detected_count"]
+    labels = np.asarray(sorted(counts) if counts is not None else np.unique(target), dtype=np.int64)
+    size = len(labels)
+    if size == 0:
+        return []
+
+    rows = np.searchsorted(labels, target)
+    rows_ok = (rows < size) & (labels[np.minimum(rows, size - 1)] == target)
+    columns = np.searchsorted(labels, detected)
+    columns_ok = (columns < size) & (labels[np.minimum(columns, size - 1)] == detected)
+    columns = np.where(columns_ok, columns, size)
+
+    cells = (codes[rows_ok] * size + rows[rows_ok]) * (size + 1) + columns[rows_ok]
+    matrices = np.bincount(cells, minlength=len(keys) * size * (size + 1)).reshape(len(keys), size, size + 1)
+    return [
+        {**dict(zip(by, key)), "labels": labels.tolist(), "matrix": matrices[i].tolist()}
+        for i, key in enumerate(keys)
+    ]
+
+def _ratio(numerator, denominator) -> Optional[float]:
+    return round(float(numerator) / float(denominator), 6) if denominator else None
+
+def _scalar(value):
+    # numpy scalars -> plain Python values for JSON.
+    return value.item() if hasattr(value, "item") else value
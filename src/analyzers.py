@@ -1,99 +1,338 @@
 import os
+import asyncio
 import base64
-import requests
-from .models import ImageAnalyzer
-from google import genai
-from google.genai import types
-from openai import OpenAI
+import contextvars
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import cached_property
+from typing import Optional
+from .models import ImageAnalyzer, ImageInput, as_image_result
+from .utils import CountStream, lazy_module, parse_count, record_step
+from .ratelimit import RateLimitError, limiters
+from .tracing import token_usage, tracer
+from .preprocess import ImagePreprocessor
+
+genai = lazy_module("google.genai")
+types = lazy_module("google.genai.types")
+openai = lazy_module("openai")
+
+# Schema for structured analysis: the answer is exactly {"count": <int>}.
+COUNT_SCHEMA = {
+    "type": "object",
+    "properties": {"count": {"type": "integer"}},
+    "required": ["count"],
+    "additionalProperties": False,
+}
+
+def _finish_stream(model: str, parser: CountStream, started: float, count: Optional[int], usage: Optional[tuple[int, int]]):
+    """Records how a structured stream ended: time to the count, chunks read, and token usage."""
+    tracer.observe("time_to_count", time.perf_counter() - started, model)
+    record_step(stream_chunks=parser.chunks, early_exit=count is not None)
+    # Usage only arrives with the final chunk; when we stop early, count the chunks read instead.
+    input_tokens, output_tokens = usage if usage else (0, parser.chunks)
+    tracer.usage(model, input_tokens, output_tokens)
 
 class QwenAnalyzer(ImageAnalyzer):
-    def __init__(self):
-        self.client = OpenAI(
+    def __init__(self, preprocessor: Optional[ImagePreprocessor] = None, structured: bool = False):
+        self.model = "qwen/qwen3-vl-235b-a22b-instruct"
+        # Default: upload the original bytes, labelled with their real MIME type.
+        self.preprocessor = preprocessor or ImagePreprocessor()
+        # Ask for schema-constrained JSON and stop the stream as soon as the count is parsed.
+        self.structured = structured
+
+    @cached_property
+    def client(self):
+        return openai.OpenAI(
+            base_url="https://openrouter.ai/api/v1",
+            api_key=os.environ.get("OPENROUTER_API_KEY"),
+        )
+
+    @cached_property
+    def async_client(self):
+        return openai.AsyncOpenAI(
             base_url="https://openrouter.ai/api/v1",
             api_key=os.environ.get("OPENROUTER_API_KEY"),
         )
-        self.model = "qwen/qwen3-vl-235b-a22b-instruct"
 
-    def analyze(self, image_path: str, prompt: str) -> int:
+    def analyze(self, image: ImageInput, prompt: str) -> int:
         try:
-            with open(image_path, "rb") as f:
-                base64_image = base64.b64encode(f.read()).decode('utf-8')
+            if self.structured:
+                return limiters.get("openrouter", self.model).call(self._stream_count, self._messages(image, prompt))
+            response = limiters.get("openrouter", self.model).call(
+                self.client.chat.completions.create,
+                model=self.model,
+                messages=self._messages(image, prompt),
+            )
+            tracer.usage(self.model, *token_usage(response))
+            # The prompt asks for a JSON object with the count; parse_count falls back to the first number.
+            return parse_count(response.choices[0].message.content)
+        except RateLimitError:
+            # Throttling is not a miscount; let the caller see it instead of -1.
+            raise
+        except Exception:
+            return -1
 
-            response = self.client.chat.completions.create(
+    async def aanalyze(self, image: ImageInput, prompt: str) -> int:
+        try:
+            if self.structured:
+                messages = await asyncio.to_thread(self._messages, image, prompt)
+                return await limiters.get("openrouter", self.model).acall(self._astream_count, messages)
+            response = await limiters.get("openrouter", self.model).acall(
+                self.async_client.chat.completions.create,
                 model=self.model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/png;base64,{base64_image}"
-                                },
-                            },
-                        ],
-                    }
-                ],
+                # Resizing and encoding are CPU work; keep them off the event loop.
+                messages=await asyncio.to_thread(self._messages, image, prompt),
             )
-            
-            content = response.choices[0].message.content
-            # Simple parsing for now, assuming the model returns a number or we extract it
-            # The prompt should ask for a single number.
-            
-            # Try to parse JSON if present
-            import json
-            import re
-            
-            # Check for JSON block
-            json_match = re.search(r'\{.*\}', content, re.DOTALL)
-            if json_match:
-                try:
-                    data = json.loads(json_match.group(0))
-                    if 'count' in data:
-                        return int(data['count'])
-                except:
-                    pass
-
-            # Fallback to simple number extraction
-            numbers = re.findall(r'\d+', content)
-            if numbers:
-                return int(numbers[0])
-            return -1 # Error code
+            tracer.usage(self.model, *token_usage(response))
+            return parse_count(response.choices[0].message.content)
+        except RateLimitError:
+            raise
         except Exception:
             return -1
 
+    def _stream_count(self, messages: list[dict]) -> int:
+        started = time.perf_counter()
+        parser, count, usage = CountStream(), None, None
+        stream = self.client.chat.completions.create(model=self.model, messages=messages, **self._structured_arguments())
+        try:
+            for chunk in stream:
+                if chunk.usage:
+                    usage = token_usage(chunk)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    count = parser.feed(chunk.choices[0].delta.content)
+                    if count is not None:
+                        break
+        finally:
+            # Closing the connection stops the provider generating tokens we no longer need.
+            stream.close()
+        _finish_stream(self.model, parser, started, count, usage)
+        return count if count is not None else parser.result()
+
+    async def _astream_count(self, messages: list[dict]) -> int:
+        started = time.perf_counter()
+        parser, count, usage = CountStream(), None, None
+        stream = await self.async_client.chat.completions.create(model=self.model, messages=messages, **self._structured_arguments())
+        try:
+            async for chunk in stream:
+                if chunk.usage:
+                    usage = token_usage(chunk)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    count = parser.feed(chunk.choices[0].delta.content)
+                    if count is not None:
+                        break
+        finally:
+            await stream.close()
+        _finish_stream(self.model, parser, started, count, usage)
+        return count if count is not None else parser.result()
+
+    def _structured_arguments(self) -> dict:
+        return {
+            "response_format": {"type": "json_schema", "json_schema": {"name": "count", "strict": True, "schema": COUNT_SCHEMA}},
+            # {"count": N} is a handful of tokens; the cap bounds a model that ignores the schema.
+            "max_tokens": 32,
+            "stream": True,
+            "stream_options": {"include_usage": True},
+        }
+
+    def _messages(self, image: ImageInput, prompt: str) -> list[dict]:
+        payload, mime = self.preprocessor.prepare(image)
+        with tracer.span("encode", self.model):
+            base64_image = base64.b64encode(payload).decode('utf-8')
+
+        return [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt},
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:{mime};base64,{base64_image}"
+                        },
+                    },
+                ],
+            }
+        ]
+
 class GeminiAnalyzer(ImageAnalyzer):
-    def __init__(self):
-        self.client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"), http_options={'api_version': 'v1beta'})
+    def __init__(self, preprocessor: Optional[ImagePreprocessor] = None, structured: bool = False):
+        self.model = 'gemini-3-pro' # Updated to Gemini 3 Pro
+        self.preprocessor = preprocessor or ImagePreprocessor()
+        self.structured = structured
+
+    @cached_property
+    def client(self):
+        return genai.Client(api_key=os.environ.get("GEMINI_API_KEY"), http_options={'api_version': 'v1beta'})
 
-    def analyze(self, image_path: str, prompt: str) -> int:
+    def analyze(self, image: ImageInput, prompt: str) -> int:
         try:
-            with open(image_path, "rb") as f:
-                image_bytes = f.read()
-                
-            response = self.client.models.generate_content(
-                model='gemini-3-pro', # Updated to Gemini 3 Pro
-                contents=[prompt, types.Part.from_bytes(data=image_bytes, mime_type="image/png")]
+            if self.structured:
+                return limiters.get("gemini", self.model).call(self._stream_count, self._contents(image, prompt))
+            response = limiters.get("gemini", self.model).call(
+                self.client.models.generate_content,
+                model=self.model,
+                contents=self._contents(image, prompt)
             )
-            
-            content = response.text
-            import json
-            import re
-
-            # Check for JSON block
-            json_match = re.search(r'\{.*\}', content, re.DOTALL)
-            if json_match:
-                try:
-                    data = json.loads(json_match.group(0))
-                    if 'count' in data:
-                        return int(data['count'])
-                except:
-                    pass
-            
-            numbers = re.findall(r'\d+', content)
-            if numbers:
-                return int(numbers[0])
+            tracer.usage(self.model, *token_usage(response))
+            return parse_count(response.text)
+        except RateLimitError:
+            raise
+        except Exception:
             return -1
+
+    async def aanalyze(self, image: ImageInput, prompt: str) -> int:
+        try:
+            if self.structured:
+                contents = await asyncio.to_thread(self._contents, image, prompt)
+                return await limiters.get("gemini", self.model).acall(self._astream_count, contents)
+            response = await limiters.get("gemini", self.model).acall(
+                self.client.aio.models.generate_content,
+                model=self.model,
+                contents=await asyncio.to_thread(self._contents, image, prompt)
+            )
+            tracer.usage(self.model, *token_usage(response))
+            return parse_count(response.text)
+        except RateLimitError:
+            raise
         except Exception:
             return -1
+
+    def _stream_count(self, contents: list) -> int:
+        started = time.perf_counter()
+        parser, count, usage = CountStream(), None, None
+        stream = self.client.models.generate_content_stream(model=self.model, contents=contents, config=self._structured_config())
+        try:
+            for chunk in stream:
+                if chunk.usage_metadata:
+                    usage = token_usage(chunk)
+                if chunk.text:
+                    count = parser.feed(chunk.text)
+                    if count is not None:
+                        break
+        finally:
+            stream.close()
+        _finish_stream(self.model, parser, started, count, usage)
+        return count if count is not None else parser.result()
+
+    async def _astream_count(self, contents: list) -> int:
+        started = time.perf_counter()
+        parser, count, usage = CountStream(), None, None
+        stream = await self.client.aio.models.generate_content_stream(model=self.model, contents=contents, config=self._structured_config())
+        try:
+            async for chunk in stream:
+                if chunk.usage_metadata:
+                    usage = token_usage(chunk)
+                if chunk.text:
+                    count = parser.feed(chunk.text)
+                    if count is not None:
+                        break
+        finally:
+            await stream.aclose()
+        _finish_stream(self.model, parser, started, count, usage)
+        return count if count is not None else parser.result()
+
+    def _structured_config(self):
+        return types.GenerateContentConfig(response_mime_type="application/json", response_json_schema=COUNT_SCHEMA)
+
+    def _contents(self, image: ImageInput, prompt: str) -> list:
+        payload, mime = self.preprocessor.prepare(image)
+        return [prompt, types.Part.from_bytes(data=payload, mime_type=mime)]
+
+class EnsembleAnalyzer(ImageAnalyzer):
+    """Asks several analyzers at once and returns as soon as a quorum of them agrees on the count."""
+
+    def __init__(self, analyzers: list[ImageAnalyzer], quorum: Optional[int] = None):
+        self.analyzers = analyzers
+        # Default to a simple majority.
+        self.quorum = len(analyzers) // 2 + 1 if quorum is None else quorum
+        if not 1 <= self.quorum <= len(analyzers):
+            raise ValueError(f"Quorum must be between 1 and the number of analyzers ({len(analyzers)}), got {self.quorum}")
+        self.model = "ensemble(" + ",".join(self._name(a) for a in analyzers) + ")"
+
+    def analyze(self, image: ImageInput, prompt: str) -> int:
+        image = as_image_result(image)
+        image.read_bytes() # Load once before the members read it concurrently
+        votes = _Votes(self.quorum)
+        executor = ThreadPoolExecutor(max_workers=len(self.analyzers))
+        # Each member runs in a copy of this context so its spans and usage land on the current step.
+        futures = {
+            executor.submit(contextvars.copy_context().run, analyzer.analyze, image, prompt): analyzer
+            for analyzer in self.analyzers
+        }
+        try:
+            for future in as_completed(futures):
+                if votes.add(self._name(futures[future]), future):
+                    break
+        finally:
+            # Stragglers cannot be interrupted mid-request; their results are ignored.
+            executor.shutdown(wait=False, cancel_futures=True)
+        return votes.decide()
+
+    async def aanalyze(self, image: ImageInput, prompt: str) -> int:
+        image = as_image_result(image)
+        image.read_bytes()
+        votes = _Votes(self.quorum)
+        tasks = {asyncio.create_task(analyzer.aanalyze(image, prompt)): analyzer for analyzer in self.analyzers}
+        try:
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                if any(votes.add(self._name(tasks[task]), task) for task in done):
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+        return votes.decide()
+
+    @property
+    def signature(self) -> str:
+        """The members' preprocessing and structured-answer settings, in member order, so caches keyed by model tell them apart."""
+        signatures = [
+            getattr(getattr(analyzer, "preprocessor", None), "signature", "") + ("+structured" if getattr(analyzer, "structured", False) else "")
+            for analyzer in self.analyzers
+        ]
+        return ";".join(signatures) if any(signatures) else ""
+
+    @staticmethod
+    def _name(analyzer: ImageAnalyzer) -> str:
+        return getattr(analyzer, "model", type(analyzer).__name__)
+
+class _Votes:
+    """Tallies ensemble votes and records them on the current evaluation step."""
+
+    def __init__(self, quorum: int):
+        self.quorum = quorum
+        self.votes: list[dict] = []
+        self.errors: list[Exception] = []
+
+    def add(self, name: str, finished) -> bool:
+        """Adds the vote from a finished future or task. Returns True once a quorum agrees."""
+        try:
+            count = finished.result()
+        except Exception as e:
+            self.errors.append(e)
+            count = -1
+        self.votes.append({"analyzer": name, "count": count})
+        return count >= 0 and self._tally()[count] >= self.quorum
+
+    def decide(self) -> int:
+        tally = self._tally()
+        if not tally:
+            # Nothing usable came back; surface throttling rather than a silent -1.
+            for error in self.errors:
+                if isinstance(error, RateLimitError):
+                    raise error
+            count = -1
+        else:
+            # Quorum count if reached, otherwise the plurality (earliest vote wins ties).
+            count = max(tally, key=tally.get)
+        record_step(
+            votes=self.votes,
+            agreement=tally.get(count, 0) / len(self.votes) if self.votes else 0.0,
+            quorum_reached=tally.get(count, 0) >= self.quorum,
+        )
+        return count
+
+    def _tally(self) -> Counter:
+        return Counter(vote["count"] for vote in self.votes if vote["count"] >= 0)
@@ -0,0 +1,245 @@
+import asyncio
+import csv
+import hashlib
+import json
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from dataclasses import dataclass
+from typing import AsyncIterator, Iterable, Iterator, Optional
+from .models import ImageGenerator, ImageEditor, ImageAnalyzer, ImageResult, ImageInput
+from .evaluator import EvaluationLoop
+from .cache import CachedAnalyzer
+from .journal import Journal, JournaledGenerator, JournaledEditor, JournaledAnalyzer
+from .tracing import tracer
+from .utils import image_labels
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class BatchCase:
+    case_id: str
+    prompt: str
+    count: int
+    object_name: Optional[str] = None
+    mode: str = "direct"
+
+    def key(self) -> str:
+        """Journal key: the case ID plus a digest of the case, so an edited suite never resumes stale work."""
+        digest = hashlib.sha256(json.dumps([self.prompt, self.count, self.object_name, self.mode]).encode()).hexdigest()
+        return f"{self.case_id}:{digest[:12]}"
+
+def load_suite(path: str, default_mode: str = "direct") -> list[BatchCase]:
+    """Loads evaluation cases from a JSONL or CSV file."""
+    if path.endswith(".csv"):
+        with open(path, newline="") as f:
+            rows = [row for row in csv.DictReader(f)]
+    else:
+        with open(path) as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+
+    cases = []
+    for index, row in enumerate(rows):
+        cases.append(BatchCase(
+            case_id=str(row.get("id") or index),
+            prompt=row["prompt"],
+            count=int(row["count"]),
+            object_name=row.get("object") or None,
+            mode=row.get("mode") or default_mode,
+        ))
+    return cases
+
+class _StageLimit:
+    """Caps concurrent calls into one stage, for both threads and coroutines."""
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.sync = threading.Semaphore(limit)
+        self.async_ = asyncio.Semaphore(limit)
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        with tracer.span("queue_wait", f"batch/{self.name}"):
+            self.sync.acquire()
+        try:
+            yield
+        finally:
+            self.sync.release()
+
+    @asynccontextmanager
+    async def aslot(self) -> AsyncIterator[None]:
+        with tracer.span("queue_wait", f"batch/{self.name}"):
+            await self.async_.acquire()
+        try:
+            yield
+        finally:
+            self.async_.release()
+
+class _LimitedGenerator(ImageGenerator):
+    def __init__(self, generator: ImageGenerator, limit: _StageLimit):
+        self.generator = generator
+        self.limit = limit
+
+    def generate(self, prompt: str) -> ImageResult:
+        with self.limit.slot():
+            return self.generator.generate(prompt)
+
+    async def agenerate(self, prompt: str) -> ImageResult:
+        async with self.limit.aslot():
+            return await self.generator.agenerate(prompt)
+
+class _LimitedEditor(ImageEditor):
+    def __init__(self, editor: ImageEditor, limit: _StageLimit):
+        self.editor = editor
+        self.limit = limit
+
+    def edit(self, image: ImageInput, prompt: str) -> ImageResult:
+        with self.limit.slot():
+            return self.editor.edit(image, prompt)
+
+    async def aedit(self, image: ImageInput, prompt: str) -> ImageResult:
+        async with self.limit.aslot():
+            return await self.editor.aedit(image, prompt)
+
+class _LimitedAnalyzer(ImageAnalyzer):
+    def __init__(self, analyzer: ImageAnalyzer, limit: _StageLimit):
+        self.analyzer = analyzer
+        self.limit = limit
+
+    def analyze(self, image: ImageInput, prompt: str) -> int:
+        with self.limit.slot():
+            return self.analyzer.analyze(image, prompt)
+
+    async def aanalyze(self, image: ImageInput, prompt: str) -> int:
+        async with self.limit.aslot():
+            return await self.analyzer.aanalyze(image, prompt)
+
+class BatchRunner:
+    """Runs many EvaluationLoop cases concurrently with a concurrency cap per stage."""
+
+    def __init__(
+        self,
+        generator: ImageGenerator,
+        analyzer: ImageAnalyzer,
+        editor: Optional[ImageEditor] = None,
+        max_retries: int = 2,
+        generate_concurrency: int = 4,
+        analyze_concurrency: int = 4,
+        edit_concurrency: int = 4,
+        candidates: int = 3,
+        candidate_generators: Optional[list[ImageGenerator]] = None,
+        journal: Optional[Journal] = None,
+    ):
+        self.generate_concurrency = generate_concurrency
+        self.analyze_concurrency = analyze_concurrency
+        self.edit_concurrency = edit_concurrency if editor else 0
+        self.journal = journal
+        generate_limit = _StageLimit("generate", generate_concurrency)
+        generator = _LimitedGenerator(generator, generate_limit)
+        analyze_limit = _StageLimit("analyze", analyze_concurrency)
+        if isinstance(analyzer, CachedAnalyzer):
+            # Cache hits are served before taking an analyze slot; only misses wait for the VLM.
+            analyzer = analyzer.wrapping(_LimitedAnalyzer(analyzer.analyzer, analyze_limit))
+        else:
+            analyzer = _LimitedAnalyzer(analyzer, analyze_limit)
+        editor = _LimitedEditor(editor, _StageLimit("edit", edit_concurrency)) if editor else None
+        candidate_generators = [_LimitedGenerator(g, generate_limit) for g in candidate_generators] if candidate_generators else None
+        if journal:
+            # Outside the stage limits, so replayed steps never wait for a slot.
+            generator = JournaledGenerator(generator, journal)
+            analyzer = JournaledAnalyzer(analyzer, journal)
+            editor = JournaledEditor(editor, journal) if editor else None
+            candidate_generators = [JournaledGenerator(g, journal) for g in candidate_generators] if candidate_generators else None
+        self.loop = EvaluationLoop(
+            generator,
+            analyzer,
+            editor,
+            max_retries=max_retries,
+            candidates=candidates,
+            candidate_generators=candidate_generators,
+        )
+
+    def run_case(self, case: BatchCase) -> dict:
+        started = time.perf_counter()
+        with self._case_scope(case):
+            try:
+                result = self.loop.run(case.prompt, case.count, case.mode, case.object_name)
+            except Exception as e:
+                logger.error(f"Case {case.case_id} failed: {e}")
+                result = {"error": str(e), "target_count": case.count, "match": False, "steps": []}
+            result = self._tag(result, case, started)
+            if self.journal and "error" not in result:
+                # Failed cases stay unfinished so a resume retries them.
+                self.journal.record("result", result=result)
+            return result
+
+    async def arun_case(self, case: BatchCase) -> dict:
+        started = time.perf_counter()
+        with self._case_scope(case):
+            try:
+                result = await self.loop.arun(case.prompt, case.count, case.mode, case.object_name)
+            except Exception as e:
+                logger.error(f"Case {case.case_id} failed: {e}")
+                result = {"error": str(e), "target_count": case.count, "match": False, "steps": []}
+            result = self._tag(result, case, started)
+            if self.journal and "error" not in result:
+                await self.journal.arecord("result", result=result)
+            return result
+
+    def finished(self, cases: Iterable[BatchCase]) -> list[dict]:
+        """Results the journal already holds for these cases; run and arun skip them."""
+        if not self.journal:
+            return []
+        return [result for result in (self.journal.result(case.key()) for case in cases) if result is not None]
+
+    def _pending(self, cases: Iterable[BatchCase]) -> list[BatchCase]:
+        if not self.journal:
+            return list(cases)
+        return [case for case in cases if self.journal.result(case.key()) is None]
+
+    @contextmanager
+    def _case_scope(self, case: BatchCase) -> Iterator[None]:
+        # Images saved for the case are labelled with it in the image store index.
+        with image_labels(case=case.case_id), (self.journal.case(case.key()) if self.journal else nullcontext()):
+            yield
+
+    def _tag(self, result: dict, case: BatchCase, started: float) -> dict:
+        result["elapsed_seconds"] = time.perf_counter() - started
+        result["case_id"] = case.case_id
+        result["prompt"] = case.prompt
+        result["object"] = case.object_name
+        result["mode"] = case.mode
+        return result
+
+    def run(self, cases: Iterable[BatchCase]) -> Iterator[dict]:
+        """Runs all cases and yields each result as soon as it finishes."""
+        # Enough cases in flight to keep every stage saturated at its own limit.
+        max_workers = self.generate_concurrency + self.analyze_concurrency + self.edit_concurrency
+        pending = iter(self._pending(cases))
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            # Only a window of cases is submitted, so stopping early never leaves the whole suite queued.
+            running = {executor.submit(self.run_case, case) for case in islice(pending, max_workers)}
+            while running:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    case = next(pending, None)
+                    if case is not None:
+                        running.add(executor.submit(self.run_case, case))
+                    yield future.result()
+        finally:
+            # On early exit, cases already running finish but nothing new starts.
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    async def arun(self, cases: Iterable[BatchCase]) -> AsyncIterator[dict]:
+        """Async variant of run: all cases share one event loop, bounded only by the stage limits."""
+        tasks = [asyncio.create_task(self.arun_case(case)) for case in self._pending(cases)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import math
+import random
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from .batch import BatchCase, BatchRunner
+from .evaluator import EvaluationLoop
+from .stubs import Latency, StubGenerator, StubEditor, StubAnalyzer
+
+SCENARIOS = ["sequential", "batch", "async"]
+
+@dataclass
+class BenchmarkConfig:
+    scenario: str = "async"
+    mode: str = "loop"
+    cases: int = 100
+    generate_latency: Latency = field(default_factory=lambda: Latency(0.5, 0.3))
+    edit_latency: Latency = field(default_factory=lambda: Latency(0.5, 0.3))
+    analyze_latency: Latency = field(default_factory=lambda: Latency(0.2, 0.3))
+    failure_rate: float = 0.0
+    width: int = 1024
+    height: int = 1024
+    generate_concurrency: int = 8
+    analyze_concurrency: int = 8
+    edit_concurrency: int = 8
+    candidates: int = 3
+    seed: int = 0
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile of values, q in [0, 100]."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+def make_cases(n: int, mode: str, seed: int = 0) -> list[BatchCase]:
+    rng = random.Random(seed)
+    cases = []
+    for i in range(n):
+        count = rng.randint(1, 10)
+        cases.append(BatchCase(str(i), f"{count} apples on a table", count, "apples", mode))
+    return cases
+
+def run_benchmark(config: BenchmarkConfig) -> dict:
+    """Drives the pipeline through stub providers and reports throughput, latency percentiles and peak memory."""
+    if config.scenario not in SCENARIOS:
+        raise ValueError(f"Unknown scenario {config.scenario!r}, expected one of {SCENARIOS}")
+
+    generator = StubGenerator(config.generate_latency, config.failure_rate, width=config.width, height=config.height, seed=config.seed)
+    editor = StubEditor(config.edit_latency, config.failure_rate, seed=config.seed + 1)
+    analyzer = StubAnalyzer(config.analyze_latency, config.failure_rate, seed=config.seed + 2)
+    cases = make_cases(config.cases, config.mode, config.seed)
+
+    # Per-case log lines would dominate the measurement.
+    logging.getLogger("src").setLevel(logging.WARNING)
+    tracemalloc.start()
+    started = time.perf_counter()
+    if config.scenario == "sequential":
+        loop = EvaluationLoop(generator, analyzer, editor, candidates=config.candidates)
+        results = []
+        for case in cases:
+            case_started = time.perf_counter()
+            try:
+                result = loop.run(case.prompt, case.count, case.mode, case.object_name)
+            except Exception as e:
+                result = {"error": str(e), "match": False}
+            result["elapsed_seconds"] = time.perf_counter() - case_started
+            results.append(result)
+    else:
+        runner = BatchRunner(
+            generator,
+            analyzer,
+            editor,
+            generate_concurrency=config.generate_concurrency,
+            analyze_concurrency=config.analyze_concurrency,
+            edit_concurrency=config.edit_concurrency,
+            candidates=config.candidates,
+        )
+        if config.scenario == "batch":
+            results = list(runner.run(cases))
+        else:
+            async def collect():
+                return [result async for result in runner.arun(cases)]
+            results = asyncio.run(collect())
+    wall_seconds = time.perf_counter() - started
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = [result["elapsed_seconds"] for result in results]
+    return {
+        "scenario": config.scenario,
+        "mode": config.mode,
+        "cases": len(results),
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_cases_per_second": round(len(results) / wall_seconds, 3) if wall_seconds else 0.0,
+        "latency_p50": round(percentile(latencies, 50), 4),
+        "latency_p95": round(percentile(latencies, 95), 4),
+        "latency_p99": round(percentile(latencies, 99), 4),
+        "match_rate": round(sum(bool(result.get("match")) for result in results) / len(results), 4) if results else 0.0,
+        "errors": sum("error" in result for result in results),
+        "provider_calls": {"generate": generator.calls, "edit": editor.calls, "analyze": analyzer.calls},
+        "peak_memory_mb": round(peak_bytes / (1024 * 1024), 2),
+    }
@@ -0,0 +1,152 @@
+import asyncio
+import copy
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+from .models import ImageAnalyzer, ImageInput, as_image_result
+
+logger = logging.getLogger(__name__)
+
+class AnalysisCache:
+    """Persistent SQLite cache of analyzer counts keyed by image hash, analyzer model and prompt."""
+
+    def __init__(self, path: str = "output/.cache/analysis.sqlite", max_entries: int = 100_000, bypass: bool = False):
+        self.path = path
+        self.max_entries = max_entries
+        # When bypassed, lookups always miss but fresh results are still stored.
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS analysis ("
+            "key TEXT PRIMARY KEY, count INTEGER NOT NULL, model TEXT NOT NULL, "
+            "created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS analysis_last_used ON analysis (last_used)")
+        self._conn.commit()
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM analysis").fetchone()[0]
+
+    @staticmethod
+    def key(image_hash: str, model: str, prompt: str) -> str:
+        return hashlib.sha256("\0".join((image_hash, model, prompt)).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[int]:
+        if self.bypass:
+            self.misses += 1
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT count FROM analysis WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE analysis SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, count: int, model: str):
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO analysis (key, count, model, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, count, model, now, now),
+            )
+            if cursor.rowcount:
+                self._entries += 1
+            else:
+                self._conn.execute("UPDATE analysis SET count = ?, last_used = ? WHERE key = ?", (count, now, key))
+            if self._entries > self.max_entries:
+                self._evict(self._entries - self.max_entries)
+            self._conn.commit()
+
+    def _evict(self, n: int):
+        # Least recently used entries go first.
+        self._conn.execute(
+            "DELETE FROM analysis WHERE key IN (SELECT key FROM analysis ORDER BY last_used, rowid LIMIT ?)", (n,)
+        )
+        self._entries -= n
+        self.evictions += n
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "entries": self._entries,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM analysis")
+            self._conn.commit()
+            self._entries = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class CachedAnalyzer(ImageAnalyzer):
+    """Wraps an analyzer so repeated (image, model, prompt) analyses are served from an AnalysisCache."""
+
+    def __init__(self, analyzer: ImageAnalyzer, cache: AnalysisCache):
+        self.analyzer = analyzer
+        self.cache = cache
+        self.model = getattr(analyzer, "model", type(analyzer).__name__)
+        # Counts from downscaled or re-encoded uploads, or from schema-constrained answers, are cached
+        # separately from full-size free-text ones. Ensembles report their members' settings as their own signature.
+        signature = getattr(analyzer, "signature", None)
+        if signature is None:
+            signature = _signature(analyzer)
+        self.cache_model = f"{self.model}@{signature}" if signature else self.model
+
+    def analyze(self, image: ImageInput, prompt: str) -> int:
+        key = self._key(image, prompt)
+        count = self.cache.get(key)
+        if count is not None:
+            return count
+        count = self.analyzer.analyze(image, prompt)
+        self._store(key, count)
+        return count
+
+    async def aanalyze(self, image: ImageInput, prompt: str) -> int:
+        key = self._key(image, prompt)
+        # SQLite reads and writes commit to disk, so they run off the event loop.
+        count = await asyncio.to_thread(self.cache.get, key)
+        if count is not None:
+            return count
+        count = await self.analyzer.aanalyze(image, prompt)
+        await asyncio.to_thread(self._store, key, count)
+        return count
+
+    def wrapping(self, analyzer: ImageAnalyzer) -> "CachedAnalyzer":
+        """The same cache and keys in front of another analyzer, e.g. the wrapped one behind a concurrency limit."""
+        cached = copy.copy(self)
+        cached.analyzer = analyzer
+        return cached
+
+    def _key(self, image: ImageInput, prompt: str) -> str:
+        return self.cache.key(as_image_result(image).content_hash(), self.cache_model, prompt)
+
+    def _store(self, key: str, count: int):
+        # -1 means the analysis failed; never cache failures.
+        if count >= 0:
+            self.cache.put(key, count, self.model)
+
+def _signature(analyzer: ImageAnalyzer) -> str:
+    signature = getattr(getattr(analyzer, "preprocessor", None), "signature", "")
+    if getattr(analyzer, "structured", False):
+        signature = f"{signature}+structured" if signature else "structured"
+    return signature
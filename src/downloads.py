@@ -0,0 +1,106 @@
+import asyncio
+import threading
+from typing import Optional
+from .tracing import tracer
+from .utils import lazy_module
+
+# requests is imported when the first download starts, not when a provider module is loaded.
+requests = lazy_module("requests")
+adapters = lazy_module("requests.adapters")
+retry = lazy_module("urllib3.util.retry")
+
+class Downloader:
+    """Fetches provider result images over a shared keep-alive connection pool."""
+
+    def __init__(
+        self,
+        timeout: float = 60.0,
+        connect_timeout: float = 10.0,
+        retries: int = 3,
+        backoff_factor: float = 0.5,
+        pool_maxsize: int = 32,
+        chunk_size: int = 64 * 1024,
+        max_bytes: int = 50 * 1024 * 1024,
+    ):
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+        self.pool_maxsize = pool_maxsize
+        self._session = None
+        self._lock = threading.Lock()
+        self.configure(timeout=timeout, connect_timeout=connect_timeout, retries=retries, backoff_factor=backoff_factor)
+
+    def configure(
+        self,
+        timeout: Optional[float] = None,
+        connect_timeout: Optional[float] = None,
+        retries: Optional[int] = None,
+        backoff_factor: Optional[float] = None,
+    ):
+        """Updates timeouts and retry policy. The connection pool is rebuilt on the next download."""
+        if timeout is not None:
+            self.timeout = timeout
+        if connect_timeout is not None:
+            self.connect_timeout = connect_timeout
+        if retries is not None:
+            self.retries = retries
+        if backoff_factor is not None:
+            self.backoff_factor = backoff_factor
+
+        with self._lock:
+            old_session, self._session = self._session, None
+        if old_session is not None:
+            old_session.close()
+
+    @property
+    def session(self) -> "requests.Session":
+        """The pooled session, built on first use."""
+        with self._lock:
+            if self._session is None:
+                self._session = self._build_session()
+            return self._session
+
+    def _build_session(self) -> "requests.Session":
+        policy = retry.Retry(
+            total=self.retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET"],
+            respect_retry_after_header=True,
+        )
+        adapter = adapters.HTTPAdapter(pool_connections=self.pool_maxsize, pool_maxsize=self.pool_maxsize, max_retries=policy)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def fetch(self, url: str) -> bytes:
+        """Downloads url into memory in chunks, refusing bodies larger than max_bytes."""
+        with tracer.span("download"), self._get(url) as response:
+            buffer = bytearray()
+            for chunk in response.iter_content(chunk_size=self.chunk_size):
+                buffer += chunk
+                if len(buffer) > self.max_bytes:
+                    raise ValueError(f"Download from {url} exceeds {self.max_bytes} bytes")
+            return bytes(buffer)
+
+    async def afetch(self, url: str) -> bytes:
+        """Async variant of fetch. The pooled session runs in a worker thread."""
+        return await asyncio.to_thread(self.fetch, url)
+
+    def _get(self, url: str) -> "requests.Response":
+        response = self.session.get(url, stream=True, timeout=(self.connect_timeout, self.timeout))
+        try:
+            response.raise_for_status()
+        except Exception:
+            response.close()
+            raise
+        return response
+
+    def close(self):
+        with self._lock:
+            session, self._session = self._session, None
+        if session is not None:
+            session.close()
+
+# Shared by every provider so repeated downloads from the same CDN hosts reuse connections.
+downloader = Downloader()
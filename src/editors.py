@@ -1,18 +1,26 @@
 import os
+import asyncio
 import base64
-import requests
-from .models import ImageEditor, ImageResult
-from google import genai
-from google.genai import types
-from openai import OpenAI
-import fal_client
-from .utils import get_output_path
+from functools import cached_property
+from typing import AsyncIterator, Callable, Iterator, Optional, Union
+from .models import ImageEditor, ImageResult, ImageInput, as_image_result
+from .fal_queue import FalBatch
+from .utils import image_writer, lazy_module
+from .downloads import downloader
+from .preprocess import detect_mime
+from .ratelimit import RateLimitError, limiters
+from .tracing import token_usage, tracer
+
+genai = lazy_module("google.genai")
+openai = lazy_module("openai")
+fal_client = lazy_module("fal_client")
 
 class GeminiEditor(ImageEditor):
-    def __init__(self):
-        self.client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"), http_options={'api_version': 'v1beta'})
+    @cached_property
+    def client(self):
+        return genai.Client(api_key=os.environ.get("GEMINI_API_KEY"), http_options={'api_version': 'v1beta'})
 
-    def edit(self, image_path: str, prompt: str) -> ImageResult:
+    def edit(self, image: ImageInput, prompt: str) -> ImageResult:
         # Placeholder for Gemini editing if available. 
         # Currently Gemini API primarily supports generation. 
         # We might need to use a specific endpoint or wait for support.
@@ -20,8 +28,7 @@ class GeminiEditor(ImageEditor):
         # Assuming 'gemini-3-pro-image-preview' might support image-to-image or we use a different approach.
         
         # Reading the image
-        with open(image_path, "rb") as f:
-            image_bytes = f.read()
+        image_bytes = as_image_result(image).read_bytes()
             
         # TODO: Check actual Gemini Edit API support for gemini-3-pro-image-preview. 
         # For now, returning a dummy result to allow flow testing if needed, 
@@ -29,69 +36,199 @@ class GeminiEditor(ImageEditor):
         raise NotImplementedError("Gemini Editing not yet fully implemented/verified.")
 
 class OpenAIEditor(ImageEditor):
-    def __init__(self):
-        self.client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+    @cached_property
+    def client(self):
+        return openai.OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+
+    @cached_property
+    def async_client(self):
+        return openai.AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
 
-    def edit(self, image_path: str, prompt: str) -> ImageResult:
+    def edit(self, image: ImageInput, prompt: str) -> ImageResult:
         try:
+            image = as_image_result(image)
             # OpenAI Edit uses GPT Image 1
-            response = self.client.images.edit(
+            response = limiters.get("openai", "gpt-image-1").call(
+                self.client.images.edit,
                 model="gpt-image-1",
-                image=open(image_path, "rb"),
+                image=self._upload(image),
                 prompt=prompt,
                 n=1,
                 size="1024x1024",
                 # response_format="b64_json"
             )
-            
-            if hasattr(response.data[0], 'b64_json') and response.data[0].b64_json:
-                image_data = base64.b64decode(response.data[0].b64_json)
-            elif hasattr(response.data[0], 'url') and response.data[0].url:
-                image_data = requests.get(response.data[0].url).content
-            else:
-                 raise ValueError("No image data found in response")
-                 
-            new_image_path = get_output_path(f"edited_openai_{os.path.basename(image_path).split('.')[0]}")
-            with open(new_image_path, "wb") as f:
-                f.write(image_data)
-                
-            return ImageResult(image_path=new_image_path, metadata={"model": "gpt-image-1"})
+            return self._save(response, image.image_path)
+        except RateLimitError:
+            raise
         except Exception as e:
             raise RuntimeError(f"OpenAI edit failed: {e}")
 
+    async def aedit(self, image: ImageInput, prompt: str) -> ImageResult:
+        try:
+            image = as_image_result(image)
+            response = await limiters.get("openai", "gpt-image-1").acall(
+                self.async_client.images.edit,
+                model="gpt-image-1",
+                image=self._upload(image),
+                prompt=prompt,
+                n=1,
+                size="1024x1024",
+            )
+            return await asyncio.to_thread(self._save, response, image.image_path)
+        except RateLimitError:
+            raise
+        except Exception as e:
+            raise RuntimeError(f"OpenAI edit failed: {e}")
+
+    def _upload(self, image: ImageResult) -> tuple:
+        # Send the in-memory bytes as a (filename, content, mime type) file tuple.
+        data = image.read_bytes()
+        return (os.path.basename(image.image_path), data, detect_mime(data))
+
+    def _save(self, response, image_path: str) -> ImageResult:
+        tracer.usage("gpt-image-1", *token_usage(response), images=1)
+        if hasattr(response.data[0], 'b64_json') and response.data[0].b64_json:
+            with tracer.span("decode", "gpt-image-1"):
+                image_data = base64.b64decode(response.data[0].b64_json)
+        elif hasattr(response.data[0], 'url') and response.data[0].url:
+            image_data = downloader.fetch(response.data[0].url)
+        else:
+             raise ValueError("No image data found in response")
+
+        new_image_path = image_writer.save(f"edited_openai_{os.path.basename(image_path).split('.')[0]}", image_data, model="gpt-image-1")
+        return ImageResult(image_path=new_image_path, metadata={"model": "gpt-image-1"}, data=image_data)
+
 class FalEditor(ImageEditor):
     def __init__(self, model_id: str = "fal-ai/recraft-v3"):
         self.model_id = model_id
+        # Content hash -> Fal storage URL of images this editor already uploaded.
+        self.upload_cache: dict[str, str] = {}
 
-    def edit(self, image_path: str, prompt: str) -> ImageResult:
+    def edit(self, image: ImageInput, prompt: str) -> ImageResult:
         try:
-            # Upload image to Fal storage first (or use data URI if supported, but Fal usually likes URLs)
-            url = fal_client.upload_file(image_path)
-            
-            # Recraft V3 Edit arguments might differ, checking generic structure
-            # Usually takes 'image_url' and 'prompt'
-            arguments = {
-                "prompt": prompt,
-                "image_url": url
-            }
-            
-            # Adjust arguments based on specific model requirements if needed
-            if "recraft" in self.model_id:
-                 # Recraft might need specific style or other params
-                 pass
-
-            handler = fal_client.submit(
-                self.model_id,
-                arguments=arguments
-            )
-            result = handler.get()
-            
-            image_url = result['images'][0]['url']
-            image_data = requests.get(image_url).content
-            new_image_path = get_output_path(f"edited_fal_{os.path.basename(image_path).split('.')[0]}")
-            with open(new_image_path, "wb") as f:
-                f.write(image_data)
-                
-            return ImageResult(image_path=new_image_path, metadata={"model": self.model_id})
+            image = as_image_result(image)
+            url = self._upload(image)
+            result = limiters.get("fal", self.model_id).call(self._run, self._arguments(url, prompt))
+            return self._save(result, image.image_path)
+        except RateLimitError:
+            raise
         except Exception as e:
             raise RuntimeError(f"Fal edit failed: {e}")
+
+    async def aedit(self, image: ImageInput, prompt: str) -> ImageResult:
+        try:
+            image = as_image_result(image)
+            url = await self._aupload(image)
+            result = await limiters.get("fal", self.model_id).acall(self._arun, self._arguments(url, prompt))
+            return await asyncio.to_thread(self._save, result, image.image_path)
+        except RateLimitError:
+            raise
+        except Exception as e:
+            raise RuntimeError(f"Fal edit failed: {e}")
+
+    def submit_many(self, edits: list[tuple[ImageInput, str]], poll_interval: float = 1.0) -> FalBatch:
+        """Uploads (where needed) and enqueues every (image, prompt) edit without waiting for results."""
+        batch = FalBatch(self.model_id, "edit", poll_interval)
+        for image, prompt in edits:
+            try:
+                image = as_image_result(image)
+                url = self._upload(image)
+            except Exception as e:
+                batch.fail(e)
+                continue
+            batch.submit(self._arguments(url, prompt), lambda result, path=image.image_path: self._save(result, path))
+        return batch
+
+    async def asubmit_many(self, edits: list[tuple[ImageInput, str]], poll_interval: float = 1.0) -> FalBatch:
+        batch = FalBatch(self.model_id, "edit", poll_interval)
+
+        async def prepare(image: ImageInput, prompt: str) -> tuple[dict, Callable[[dict], ImageResult]]:
+            image = as_image_result(image)
+            url = await self._aupload(image)
+            return self._arguments(url, prompt), lambda result, path=image.image_path: self._save(result, path)
+
+        async def fail(error: Exception):
+            batch.fail(error)
+
+        # Uploads run concurrently first. Each submit then claims its index before its first await,
+        # so indices follow edit order.
+        prepared = await asyncio.gather(*(prepare(image, prompt) for image, prompt in edits), return_exceptions=True)
+        await asyncio.gather(*(fail(item) if isinstance(item, BaseException) else batch.asubmit(*item) for item in prepared))
+        return batch
+
+    def edit_many(self, edits: list[tuple[ImageInput, str]], poll_interval: float = 1.0) -> Iterator[tuple[int, Union[ImageResult, Exception]]]:
+        """Submits all edits, then yields (edit index, image or error) as each finishes.
+
+        Stopping early cancels the requests still waiting in Fal's queue.
+        """
+        batch = self.submit_many(edits, poll_interval)
+        try:
+            yield from batch.results()
+        finally:
+            batch.cancel()
+
+    async def aedit_many(self, edits: list[tuple[ImageInput, str]], poll_interval: float = 1.0) -> AsyncIterator[tuple[int, Union[ImageResult, Exception]]]:
+        batch = await self.asubmit_many(edits, poll_interval)
+        try:
+            async for item in batch.aresults():
+                yield item
+        finally:
+            await batch.acancel()
+
+    def _upload(self, image: ImageResult) -> str:
+        url = self._hosted_url(image)
+        if url is None:
+            # Upload image to Fal storage first (or use data URI if supported, but Fal usually likes URLs)
+            data = image.read_bytes()
+            url = limiters.get("fal", "storage").call(fal_client.upload, data, detect_mime(data))
+            self.upload_cache[image.content_hash()] = url
+        return url
+
+    async def _aupload(self, image: ImageResult) -> str:
+        url = self._hosted_url(image)
+        if url is None:
+            data = image.read_bytes()
+            url = await limiters.get("fal", "storage").acall(fal_client.upload_async, data, detect_mime(data))
+            self.upload_cache[image.content_hash()] = url
+        return url
+
+    def _run(self, arguments: dict) -> dict:
+        handler = fal_client.submit(
+            self.model_id,
+            arguments=arguments
+        )
+        return handler.get()
+
+    async def _arun(self, arguments: dict) -> dict:
+        handler = await fal_client.submit_async(
+            self.model_id,
+            arguments=arguments
+        )
+        return await handler.get()
+
+    def _hosted_url(self, image: ImageResult) -> Optional[str]:
+        # Images produced by Fal are already hosted on its CDN, and anything we uploaded before can be reused.
+        if image.metadata.get("url"):
+            return image.metadata["url"]
+        return self.upload_cache.get(image.content_hash())
+
+    def _arguments(self, url: str, prompt: str) -> dict:
+        # Recraft V3 Edit arguments might differ, checking generic structure
+        # Usually takes 'image_url' and 'prompt'
+        arguments = {
+            "prompt": prompt,
+            "image_url": url
+        }
+
+        # Adjust arguments based on specific model requirements if needed
+        if "recraft" in self.model_id:
+             # Recraft might need specific style or other params
+             pass
+        return arguments
+
+    def _save(self, result: dict, image_path: str) -> ImageResult:
+        tracer.usage(self.model_id, images=1)
+        image_url = result['images'][0]['url']
+        image_data = downloader.fetch(image_url)
+        new_image_path = image_writer.save(f"edited_fal_{os.path.basename(image_path).split('.')[0]}", image_data, model=self.model_id)
+        return ImageResult(image_path=new_image_path, metadata={"model": self.model_id, "url": image_url}, data=image_data)
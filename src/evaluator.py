@@ -1,79 +1,266 @@
+import asyncio
+import contextvars
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Optional
-from .models import ImageGenerator, ImageEditor, ImageAnalyzer
+from .models import ImageGenerator, ImageEditor, ImageAnalyzer, ImageResult
+from .ratelimit import RateLimitError
+from .tracing import tracer
+from .utils import image_labels, step_details
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def count_prompt(target_object: str) -> str:
+    """The prompt every analyzer is asked, for the object being counted."""
+    return f"Count the number of {target_object} in this image. Return a JSON object with a single key 'count' and the integer value."
+
 class EvaluationLoop:
     def __init__(
-        self, 
-        generator: ImageGenerator, 
-        analyzer: ImageAnalyzer, 
+        self,
+        generator: ImageGenerator,
+        analyzer: ImageAnalyzer,
         editor: Optional[ImageEditor] = None,
-        max_retries: int = 2
+        max_retries: int = 2,
+        candidates: int = 3,
+        candidate_generators: Optional[list[ImageGenerator]] = None
     ):
         self.generator = generator
         self.analyzer = analyzer
         self.editor = editor
         self.max_retries = max_retries
+        # Speculative mode: how many candidates to race, spread round-robin over these generators.
+        self.candidates = candidates
+        self.candidate_generators = candidate_generators or [generator]
 
     def run(self, prompt: str, target_count: int, mode: str = "direct", object_name: Optional[str] = None):
         logger.info(f"Starting evaluation with mode={mode}, target_count={target_count}, object_name={object_name}")
-        
+
         target_object = object_name if object_name else prompt.split()[-1]
+        count_prompt = self._count_prompt(target_object)
+
+        if mode == "speculative":
+            # Step 1+2: Generate and analyze several candidates at once, keep the first match
+            result, count, steps = self._generate_candidates(prompt, target_count, count_prompt)
+        else:
+            with step_details() as details:
+                # Step 1: Generate
+                logger.info("Generating initial image...")
+                with tracer.span("generate"), image_labels(prompt=prompt, step=0):
+                    result = self.generator.generate(prompt)
+                logger.info(f"Image generated at {result.image_path}")
+
+                # Step 2: Analyze
+                with tracer.span("analyze"):
+                    count = self.analyzer.analyze(result, count_prompt)
+                logger.info(f"Analysis result: {count}")
+            steps = [{"action": "generate", "count": count, **details}]
 
-        # Step 1: Generate
-        logger.info("Generating initial image...")
-        result = self.generator.generate(prompt)
-        logger.info(f"Image generated at {result.image_path}")
-        
-        # Step 2: Analyze
-        count_prompt = f"Count the number of {target_object} in this image. Return a JSON object with a single key 'count' and the integer value."
-        count = self.analyzer.analyze(result.image_path, count_prompt)
-        logger.info(f"Analysis result: {count}")
-        
         if mode == "direct":
-            return {
-                "image_path": result.image_path,
-                "target_count": target_count,
-                "detected_count": count,
-                "match": count == target_count,
-                "steps": [{"action": "generate", "count": count}]
-            }
-            
-        # Step 3: Loop (if mode is loop or two-pass)
-        steps = [{"action": "generate", "count": count}]
-        current_image_path = result.image_path
-        
+            return self._result(result, target_count, count, steps)
+
+        # Step 3: Loop (if mode is loop, or speculative with no matching candidate)
+        current_image = result
+
         retries = 0
         while count != target_count and retries < self.max_retries:
             if not self.editor:
                 logger.warning("Editor not provided, cannot fix image.")
                 break
-                
+
             logger.info(f"Count mismatch ({count} != {target_count}). Attempting edit {retries + 1}/{self.max_retries}...")
-            
+
             # Construct edit prompt
-            edit_prompt = f"Make sure there are exactly {target_count} {target_object} in the image."
-            
+            edit_prompt = self._edit_prompt(target_count, target_object)
+
+            try:
+                with step_details() as details:
+                    with tracer.span("edit"), image_labels(prompt=edit_prompt, step=retries + 1):
+                        current_image = self.editor.edit(current_image, edit_prompt)
+
+                    with tracer.span("analyze"):
+                        count = self.analyzer.analyze(current_image, count_prompt)
+                    logger.info(f"Analysis after edit: {count}")
+
+                steps.append({"action": "edit", "count": count, **details})
+                retries += 1
+            except RateLimitError:
+                raise
+            except Exception as e:
+                logger.error(f"Edit failed: {e}")
+                break
+
+        return self._result(current_image, target_count, count, steps)
+
+    async def arun(self, prompt: str, target_count: int, mode: str = "direct", object_name: Optional[str] = None):
+        """Async variant of run using the providers' agenerate/aedit/aanalyze."""
+        logger.info(f"Starting evaluation with mode={mode}, target_count={target_count}, object_name={object_name}")
+
+        target_object = object_name if object_name else prompt.split()[-1]
+        count_prompt = self._count_prompt(target_object)
+
+        if mode == "speculative":
+            result, count, steps = await self._agenerate_candidates(prompt, target_count, count_prompt)
+        else:
+            with step_details() as details:
+                logger.info("Generating initial image...")
+                with tracer.span("generate"), image_labels(prompt=prompt, step=0):
+                    result = await self.generator.agenerate(prompt)
+                logger.info(f"Image generated at {result.image_path}")
+
+                with tracer.span("analyze"):
+                    count = await self.analyzer.aanalyze(result, count_prompt)
+                logger.info(f"Analysis result: {count}")
+            steps = [{"action": "generate", "count": count, **details}]
+
+        current_image = result
+        if mode == "direct":
+            return self._result(current_image, target_count, count, steps)
+
+        retries = 0
+        while count != target_count and retries < self.max_retries:
+            if not self.editor:
+                logger.warning("Editor not provided, cannot fix image.")
+                break
+
+            logger.info(f"Count mismatch ({count} != {target_count}). Attempting edit {retries + 1}/{self.max_retries}...")
+            edit_prompt = self._edit_prompt(target_count, target_object)
+
             try:
-                edit_result = self.editor.edit(current_image_path, edit_prompt)
-                current_image_path = edit_result.image_path
-                
-                count = self.analyzer.analyze(current_image_path, count_prompt)
-                logger.info(f"Analysis after edit: {count}")
-                
-                steps.append({"action": "edit", "count": count})
+                with step_details() as details:
+                    with tracer.span("edit"), image_labels(prompt=edit_prompt, step=retries + 1):
+                        current_image = await self.editor.aedit(current_image, edit_prompt)
+
+                    with tracer.span("analyze"):
+                        count = await self.analyzer.aanalyze(current_image, count_prompt)
+                    logger.info(f"Analysis after edit: {count}")
+
+                steps.append({"action": "edit", "count": count, **details})
                 retries += 1
+            except RateLimitError:
+                raise
             except Exception as e:
                 logger.error(f"Edit failed: {e}")
                 break
-            
+
+        return self._result(current_image, target_count, count, steps)
+
+    def _generate_candidates(self, prompt: str, target_count: int, count_prompt: str) -> tuple[ImageResult, int, list[dict]]:
+        """Races generate+analyze for several candidates on threads. Returns the first match, else the closest."""
+        decided = threading.Event()
+
+        def candidate(generator: ImageGenerator) -> Optional[tuple[ImageResult, int, dict]]:
+            with step_details() as details:
+                with tracer.span("generate"), image_labels(prompt=prompt, step=0):
+                    result = generator.generate(prompt)
+                # A generate call cannot be interrupted, but a loser need not be analyzed.
+                if decided.is_set():
+                    return None
+                with tracer.span("analyze"):
+                    count = self.analyzer.analyze(result, count_prompt)
+            return result, count, details
+
+        logger.info(f"Generating {self.candidates} candidates...")
+        executor = ThreadPoolExecutor(max_workers=self.candidates)
+        # Candidates run in copies of this context so tracing and journaling still see the current case.
+        futures = [
+            executor.submit(contextvars.copy_context().run, candidate, self._candidate_generator(i))
+            for i in range(self.candidates)
+        ]
+        tracker = _CandidateTracker(target_count)
+        try:
+            for future in as_completed(futures):
+                try:
+                    outcome = future.result()
+                except RateLimitError:
+                    raise
+                except Exception as e:
+                    tracker.failed(e)
+                    continue
+                if tracker.accept(*outcome):
+                    break
+        finally:
+            # Running threads cannot be interrupted: candidates still generating skip analysis and their results are ignored.
+            decided.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+        return tracker.best()
+
+    async def _agenerate_candidates(self, prompt: str, target_count: int, count_prompt: str) -> tuple[ImageResult, int, list[dict]]:
+        """Async variant of _generate_candidates that cancels outstanding candidates on the first match."""
+        async def candidate(generator: ImageGenerator) -> tuple[ImageResult, int, dict]:
+            with step_details() as details:
+                with tracer.span("generate"), image_labels(prompt=prompt, step=0):
+                    result = await generator.agenerate(prompt)
+                with tracer.span("analyze"):
+                    count = await self.analyzer.aanalyze(result, count_prompt)
+            return result, count, details
+
+        logger.info(f"Generating {self.candidates} candidates...")
+        tasks = [asyncio.create_task(candidate(self._candidate_generator(i))) for i in range(self.candidates)]
+        tracker = _CandidateTracker(target_count)
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    outcome = await next_done
+                except RateLimitError:
+                    raise
+                except Exception as e:
+                    tracker.failed(e)
+                    continue
+                if tracker.accept(*outcome):
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+        return tracker.best()
+
+    def _candidate_generator(self, index: int) -> ImageGenerator:
+        return self.candidate_generators[index % len(self.candidate_generators)]
+
+    def _count_prompt(self, target_object: str) -> str:
+        return count_prompt(target_object)
+
+    def _edit_prompt(self, target_count: int, target_object: str) -> str:
+        return f"Make sure there are exactly {target_count} {target_object} in the image."
+
+    def _result(self, image: ImageResult, target_count: int, count: int, steps: list[dict]) -> dict:
+        tracer.result(count == target_count)
         return {
-            "image_path": current_image_path,
+            "image_path": image.image_path,
             "target_count": target_count,
             "detected_count": count,
             "match": count == target_count,
+            "cost_usd": round(sum(step.get("cost_usd", 0.0) for step in steps), 6),
             "steps": steps
         }
+
+class _CandidateTracker:
+    """Collects speculative candidates as they finish and keeps the one closest to the target."""
+
+    def __init__(self, target_count: int):
+        self.target_count = target_count
+        self.steps: list[dict] = []
+        self._best: Optional[tuple[ImageResult, int]] = None
+        self._errors: list[Exception] = []
+
+    def accept(self, result: ImageResult, count: int, details: dict) -> bool:
+        """Records a finished candidate. Returns True if it matches the target."""
+        logger.info(f"Candidate analysis result: {count}")
+        self.steps.append({"action": "candidate", "count": count, "model": result.metadata.get("model"), **details})
+        if self._best is None or self._distance(count) < self._distance(self._best[1]):
+            self._best = (result, count)
+        return count == self.target_count
+
+    def failed(self, error: Exception):
+        logger.error(f"Candidate failed: {error}")
+        self._errors.append(error)
+
+    def best(self) -> tuple[ImageResult, int, list[dict]]:
+        if self._best is None:
+            raise RuntimeError(f"All candidates failed: {self._errors[0] if self._errors else 'no candidates'}")
+        return self._best[0], self._best[1], self.steps
+
+    def _distance(self, count: int) -> float:
+        # Failed analyses (-1) rank below every real count.
+        return abs(count - self.target_count) if count >= 0 else float("inf")
@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Iterator, Optional, Union
+from .models import ImageResult
+from .ratelimit import RateLimitError, limiters
+from .utils import lazy_module
+
+logger = logging.getLogger(__name__)
+
+fal_client = lazy_module("fal_client")
+
+@dataclass
+class _Request:
+    index: int
+    save: Callable[[dict], ImageResult]
+    handle: Any = None
+    error: Optional[Exception] = None
+
+class FalBatch:
+    """Requests submitted to Fal's queue up front, gathered together as they complete.
+
+    submit() only enqueues the job, so the provider limiter bounds how fast we submit rather than how many
+    jobs Fal works on at once. results() then polls every handle on the shared "fal/queue" limiter and
+    downloads each image as soon as its request completes, yielding (index, ImageResult or exception)
+    in completion order. cancel() withdraws whatever has not finished yet.
+
+    The sync path checks statuses on poll_workers threads, so one polling round over N requests takes
+    about N / poll_workers round trips; the async path polls every request concurrently.
+    """
+
+    def __init__(self, model_id: str, label: str, poll_interval: float = 1.0, download_workers: int = 8, poll_workers: int = 8):
+        self.model_id = model_id
+        self.label = label
+        self.poll_interval = poll_interval
+        self.download_workers = download_workers
+        self.poll_workers = poll_workers
+        self.requests: list[_Request] = []
+        self._finished: set[int] = set()
+        self._cancelled: set[int] = set()
+        self._lock = threading.Lock()
+
+    def submit(self, arguments: dict, save: Callable[[dict], ImageResult]) -> int:
+        """Enqueues one request and returns its index. Failures are reported by results(), not raised."""
+        request = self._add(save)
+        try:
+            request.handle = limiters.get("fal", self.model_id).call(fal_client.submit, self.model_id, arguments=arguments)
+        except Exception as e:
+            request.error = self._wrap(e)
+        return request.index
+
+    async def asubmit(self, arguments: dict, save: Callable[[dict], ImageResult]) -> int:
+        request = self._add(save)
+        try:
+            request.handle = await limiters.get("fal", self.model_id).acall(fal_client.submit_async, self.model_id, arguments=arguments)
+        except Exception as e:
+            request.error = self._wrap(e)
+        return request.index
+
+    def fail(self, error: Exception) -> int:
+        """Adds a request that failed before it could be submitted, e.g. on upload, so indices stay aligned."""
+        request = self._add(lambda result: None)
+        request.error = self._wrap(error)
+        return request.index
+
+    def results(self) -> Iterator[tuple[int, Union[ImageResult, Exception]]]:
+        queue = limiters.get("fal", "queue")
+        pending = []
+        for request in self._unfinished():
+            if request.error is not None:
+                self._finish(request)
+                yield request.index, request.error
+            else:
+                pending.append(request)
+
+        poller = ThreadPoolExecutor(max_workers=self.poll_workers)
+        try:
+            with ThreadPoolExecutor(max_workers=self.download_workers) as executor:
+                downloads = {}
+                while pending or downloads:
+                    # Statuses are checked concurrently, so a round does not take one round trip per request.
+                    statuses = [
+                        (request, poller.submit(queue.call, request.handle.status))
+                        for request in pending if request.index not in self._cancelled
+                    ]
+                    waiting = []
+                    for request, status in statuses:
+                        try:
+                            completed = isinstance(status.result(), fal_client.Completed)
+                        except Exception as e:
+                            self._finish(request)
+                            yield request.index, self._wrap(e)
+                            continue
+                        if completed:
+                            downloads[executor.submit(self._fetch, request, queue)] = request
+                        else:
+                            waiting.append(request)
+                    pending = waiting
+
+                    if downloads:
+                        done, _ = wait(downloads, timeout=self.poll_interval if pending else None, return_when=FIRST_COMPLETED)
+                    elif pending:
+                        time.sleep(self.poll_interval)
+                        done = set()
+                    else:
+                        done = set()
+                    for future in done:
+                        request = downloads.pop(future)
+                        self._finish(request)
+                        error = future.exception()
+                        yield request.index, self._wrap(error) if error else future.result()
+        finally:
+            # Stopping early leaves status checks of the current round unstarted.
+            poller.shutdown(wait=False, cancel_futures=True)
+
+    async def aresults(self) -> AsyncIterator[tuple[int, Union[ImageResult, Exception]]]:
+        queue = limiters.get("fal", "queue")
+
+        async def finish(request: _Request) -> Optional[ImageResult]:
+            if request.error is not None:
+                raise request.error
+            while not isinstance(await queue.acall(request.handle.status), fal_client.Completed):
+                if request.index in self._cancelled:
+                    return None
+                await asyncio.sleep(self.poll_interval)
+            result = await queue.acall(request.handle.get)
+            return await asyncio.to_thread(request.save, result)
+
+        tasks = {asyncio.create_task(finish(request)): request for request in self._unfinished()}
+        try:
+            while tasks:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    request = tasks.pop(task)
+                    self._finish(request)
+                    if task.cancelled():
+                        continue
+                    error = task.exception()
+                    if error is None and task.result() is None:
+                        # Cancelled while still in Fal's queue.
+                        continue
+                    yield request.index, self._wrap(error) if error else task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def cancel(self) -> int:
+        """Cancels every request that has not finished yet and returns how many Fal accepted.
+
+        Fal only cancels requests that are still queued; ones already running finish server-side and are
+        simply no longer polled or downloaded.
+        """
+        cancelled = 0
+        for request in self._to_cancel():
+            try:
+                limiters.get("fal", "queue").call(request.handle.cancel)
+                cancelled += 1
+            except Exception as e:
+                logger.debug(f"Could not cancel Fal request {request.handle.request_id}: {e}")
+        return cancelled
+
+    async def acancel(self) -> int:
+        cancelled = 0
+        for request in self._to_cancel():
+            try:
+                await limiters.get("fal", "queue").acall(request.handle.cancel)
+                cancelled += 1
+            except Exception as e:
+                logger.debug(f"Could not cancel Fal request {request.handle.request_id}: {e}")
+        return cancelled
+
+    def _add(self, save: Callable[[dict], ImageResult]) -> _Request:
+        with self._lock:
+            request = _Request(len(self.requests), save)
+            self.requests.append(request)
+        return request
+
+    def _unfinished(self) -> list[_Request]:
+        with self._lock:
+            return [r for r in self.requests if r.index not in self._finished and r.index not in self._cancelled]
+
+    def _finish(self, request: _Request):
+        with self._lock:
+            self._finished.add(request.index)
+
+    def _to_cancel(self) -> list[_Request]:
+        with self._lock:
+            requests = [r for r in self.requests if r.handle is not None and r.index not in self._finished and r.index not in self._cancelled]
+            self._cancelled.update(r.index for r in requests)
+        return requests
+
+    def _fetch(self, request: _Request, queue) -> ImageResult:
+        return request.save(queue.call(request.handle.get))
+
+    def _wrap(self, error: BaseException) -> Exception:
+        if isinstance(error, (RateLimitError, RuntimeError)):
+            return error
+        return RuntimeError(f"Fal {self.label} failed: {error}")
@@ -1,104 +1,203 @@
 import os
+import asyncio
 import base64
-import requests
+from functools import cached_property
+from typing import AsyncIterator, Iterator, Union
 from .models import ImageGenerator, ImageResult
-from google import genai
-from google.genai import types
-from openai import OpenAI
-import fal_client
-from .utils import get_output_path
+from .fal_queue import FalBatch
+from .utils import image_writer, lazy_module
+from .downloads import downloader
+from .ratelimit import RateLimitError, limiters
+from .tracing import token_usage, tracer
+
+genai = lazy_module("google.genai")
+types = lazy_module("google.genai.types")
+openai = lazy_module("openai")
+fal_client = lazy_module("fal_client")
 
 class GeminiGenerator(ImageGenerator):
     def __init__(self):
-        self.client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"), http_options={'api_version': 'v1beta'})
+        self.model = 'gemini-3-pro-image-preview'
+
+    @cached_property
+    def client(self):
+        return genai.Client(api_key=os.environ.get("GEMINI_API_KEY"), http_options={'api_version': 'v1beta'})
 
     def generate(self, prompt: str) -> ImageResult:
         try:
-            response = self.client.models.generate_content(
-                model='gemini-3-pro-image-preview',
+            response = limiters.get("gemini", self.model).call(
+                self.client.models.generate_content,
+                model=self.model,
                 contents=[prompt],
                 config=types.GenerateContentConfig(
                     response_modalities=["IMAGE"]
                 )
             )
-            
-            # Save image
-            image_path = get_output_path("generated_gemini")
-            
-            # Search for inline data
-            image_saved = False
-            if response.candidates and response.candidates[0].content.parts:
-                for part in response.candidates[0].content.parts:
-                    if part.inline_data:
-                        try:
-                            # Attempt to save using SDK helper if available
-                            part.as_image().save(image_path)
-                            image_saved = True
-                            break
-                        except:
-                            # Fallback to manual decode
-                            import base64
-                            with open(image_path, "wb") as f:
-                                f.write(base64.b64decode(part.inline_data.data))
-                            image_saved = True
-                            break
-            
-            if not image_saved:
-                 raise ValueError("No image part found in Gemini response")
-            
-            return ImageResult(image_path=image_path, metadata={"model": "gemini-3-pro-image-preview"})
+            return self._save(response)
+        except RateLimitError:
+            raise
         except Exception as e:
             # Fallback logic or detailed error
             raise RuntimeError(f"Gemini generation failed: {e}")
 
+    async def agenerate(self, prompt: str) -> ImageResult:
+        try:
+            response = await limiters.get("gemini", self.model).acall(
+                self.client.aio.models.generate_content,
+                model=self.model,
+                contents=[prompt],
+                config=types.GenerateContentConfig(
+                    response_modalities=["IMAGE"]
+                )
+            )
+            return self._save(response)
+        except RateLimitError:
+            raise
+        except Exception as e:
+            raise RuntimeError(f"Gemini generation failed: {e}")
+
+    def _save(self, response) -> ImageResult:
+        tracer.usage(self.model, *token_usage(response), images=1)
+        # Search for inline data
+        if response.candidates and response.candidates[0].content.parts:
+            for part in response.candidates[0].content.parts:
+                if part.inline_data:
+                    image_data = part.inline_data.data
+                    if isinstance(image_data, str):
+                        with tracer.span("decode", self.model):
+                            image_data = base64.b64decode(image_data)
+                    extension = (part.inline_data.mime_type or "image/png").split("/")[-1]
+                    image_path = image_writer.save("generated_gemini", image_data, extension, model=self.model)
+                    return ImageResult(image_path=image_path, metadata={"model": self.model}, data=image_data)
+
+        raise ValueError("No image part found in Gemini response")
+
 class OpenAIGenerator(ImageGenerator):
-    def __init__(self):
-        self.client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+    @cached_property
+    def client(self):
+        return openai.OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+
+    @cached_property
+    def async_client(self):
+        return openai.AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
 
     def generate(self, prompt: str) -> ImageResult:
         try:
-            response = self.client.images.generate(
+            response = limiters.get("openai", "gpt-image-1").call(
+                self.client.images.generate,
                 model="gpt-image-1",
                 prompt=prompt,
                 n=1,
                 size="1024x1024",
                 # response_format="b64_json" # Removed as it might not be supported for this model yet or defaults differently
             )
-            
-            # Handle response if it's a URL (common default) or b64
-            if hasattr(response.data[0], 'b64_json') and response.data[0].b64_json:
-                image_data = base64.b64decode(response.data[0].b64_json)
-            elif hasattr(response.data[0], 'url') and response.data[0].url:
-                image_data = requests.get(response.data[0].url).content
-            else:
-                raise ValueError("No image data found in response")
-
-            image_path = get_output_path("generated_openai")
-            with open(image_path, "wb") as f:
-                f.write(image_data)
-                
-            return ImageResult(image_path=image_path, metadata={"model": "gpt-image-1"})
+            return self._save(response)
+        except RateLimitError:
+            raise
         except Exception as e:
             raise RuntimeError(f"OpenAI generation failed: {e}")
 
+    async def agenerate(self, prompt: str) -> ImageResult:
+        try:
+            response = await limiters.get("openai", "gpt-image-1").acall(
+                self.async_client.images.generate,
+                model="gpt-image-1",
+                prompt=prompt,
+                n=1,
+                size="1024x1024",
+            )
+            return await asyncio.to_thread(self._save, response)
+        except RateLimitError:
+            raise
+        except Exception as e:
+            raise RuntimeError(f"OpenAI generation failed: {e}")
+
+    def _save(self, response) -> ImageResult:
+        tracer.usage("gpt-image-1", *token_usage(response), images=1)
+        # Handle response if it's a URL (common default) or b64
+        if hasattr(response.data[0], 'b64_json') and response.data[0].b64_json:
+            with tracer.span("decode", "gpt-image-1"):
+                image_data = base64.b64decode(response.data[0].b64_json)
+        elif hasattr(response.data[0], 'url') and response.data[0].url:
+            image_data = downloader.fetch(response.data[0].url)
+        else:
+            raise ValueError("No image data found in response")
+
+        image_path = image_writer.save("generated_openai", image_data, model="gpt-image-1")
+        return ImageResult(image_path=image_path, metadata={"model": "gpt-image-1"}, data=image_data)
+
 class FalGenerator(ImageGenerator):
     def __init__(self, model_id: str = "fal-ai/recraft-v3"):
         self.model_id = model_id
 
     def generate(self, prompt: str) -> ImageResult:
         try:
-            handler = fal_client.submit(
-                self.model_id,
-                arguments={"prompt": prompt}
-            )
-            result = handler.get()
-            
-            image_url = result['images'][0]['url']
-            image_data = requests.get(image_url).content
-            image_path = get_output_path(f"generated_fal_{self.model_id.replace('/', '_')}")
-            with open(image_path, "wb") as f:
-                f.write(image_data)
-                
-            return ImageResult(image_path=image_path, metadata={"model": self.model_id})
+            result = limiters.get("fal", self.model_id).call(self._run, {"prompt": prompt})
+            return self._save(result)
+        except RateLimitError:
+            raise
+        except Exception as e:
+             raise RuntimeError(f"Fal generation failed: {e}")
+
+    async def agenerate(self, prompt: str) -> ImageResult:
+        try:
+            result = await limiters.get("fal", self.model_id).acall(self._arun, {"prompt": prompt})
+            return await asyncio.to_thread(self._save, result)
+        except RateLimitError:
+            raise
         except Exception as e:
              raise RuntimeError(f"Fal generation failed: {e}")
+
+    def submit_many(self, prompts: list[str], poll_interval: float = 1.0) -> FalBatch:
+        """Enqueues every prompt on Fal without waiting; gather them with FalBatch.results()."""
+        batch = FalBatch(self.model_id, "generation", poll_interval)
+        for prompt in prompts:
+            batch.submit({"prompt": prompt}, self._save)
+        return batch
+
+    async def asubmit_many(self, prompts: list[str], poll_interval: float = 1.0) -> FalBatch:
+        batch = FalBatch(self.model_id, "generation", poll_interval)
+        # Each submit claims its index before its first await, so indices still follow prompt order.
+        await asyncio.gather(*(batch.asubmit({"prompt": prompt}, self._save) for prompt in prompts))
+        return batch
+
+    def generate_many(self, prompts: list[str], poll_interval: float = 1.0) -> Iterator[tuple[int, Union[ImageResult, Exception]]]:
+        """Submits all prompts, then yields (prompt index, image or error) as each finishes.
+
+        Stopping early cancels the requests still waiting in Fal's queue.
+        """
+        batch = self.submit_many(prompts, poll_interval)
+        try:
+            yield from batch.results()
+        finally:
+            batch.cancel()
+
+    async def agenerate_many(self, prompts: list[str], poll_interval: float = 1.0) -> AsyncIterator[tuple[int, Union[ImageResult, Exception]]]:
+        batch = await self.asubmit_many(prompts, poll_interval)
+        try:
+            async for item in batch.aresults():
+                yield item
+        finally:
+            await batch.acancel()
+
+    def _run(self, arguments: dict) -> dict:
+        handler = fal_client.submit(
+            self.model_id,
+            arguments=arguments
+        )
+        return handler.get()
+
+    async def _arun(self, arguments: dict) -> dict:
+        handler = await fal_client.submit_async(
+            self.model_id,
+            arguments=arguments
+        )
+        return await handler.get()
+
+    def _save(self, result: dict) -> ImageResult:
+        tracer.usage(self.model_id, images=1)
+        image_url = result['images'][0]['url']
+        image_data = downloader.fetch(image_url)
+        image_path = image_writer.save(f"generated_fal_{self.model_id.replace('/', '_')}", image_data, model=self.model_id)
+        # Keep the Fal-hosted URL so a FalEditor can reuse it without re-uploading.
+        return ImageResult(image_path=image_path, metadata={"model": self.model_id, "url": image_url}, data=image_data)
@@ -0,0 +1,466 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Iterator, Optional
+from urllib.parse import quote
+from .ratelimit import SlotPool
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class Job:
+    """A claimed case. token identifies this lease, so a worker whose lease expired cannot finish it."""
+    id: str
+    payload: dict
+    attempts: int
+    token: str
+
+class JobQueue(ABC):
+    """Shared queue of batch cases for worker processes, plus global per-provider concurrency slots.
+
+    Jobs move queued -> leased -> done/failed. A lease lasts lease_seconds unless heartbeat() renews it;
+    claim() puts jobs whose lease expired back in the queue, or fails them after max_attempts claims.
+    Slots bound concurrent calls to one provider across every worker that shares the queue.
+    """
+
+    def __init__(self, lease_seconds: float = 60.0, max_attempts: int = 3, slot_ttl: float = 300.0):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # Slots of a worker that died are freed after slot_ttl without a refresh.
+        self.slot_ttl = slot_ttl
+
+    @abstractmethod
+    def enqueue(self, jobs: list[tuple[str, dict]]) -> int:
+        """Adds (id, payload) jobs, skipping ids already in the queue. Returns how many were added."""
+        pass
+
+    @abstractmethod
+    def claim(self, worker: str) -> Optional[Job]:
+        pass
+
+    @abstractmethod
+    def heartbeat(self, job: Job) -> bool:
+        """Extends the lease. False means it was lost and the job may be running elsewhere."""
+        pass
+
+    @abstractmethod
+    def complete(self, job: Job, result: dict) -> bool:
+        """Stores the result. False if the lease was lost and another claim owns the job now."""
+        pass
+
+    @abstractmethod
+    def fail(self, job: Job, error: str, result: Optional[dict] = None) -> bool:
+        """Gives up this attempt: the job is queued again, or failed for good after max_attempts."""
+        pass
+
+    @abstractmethod
+    def results(self) -> Iterator[dict]:
+        """Results of finished jobs, and the last result or error of failed ones."""
+        pass
+
+    @abstractmethod
+    def stats(self) -> dict:
+        pass
+
+    @abstractmethod
+    def try_acquire_slot(self, key: str, limit: int, holder: str) -> Optional[str]:
+        """Takes one of limit global slots for key, returning its token, or None if all are taken."""
+        pass
+
+    @abstractmethod
+    def release_slot(self, key: str, token: str):
+        pass
+
+    @abstractmethod
+    def refresh_slots(self, holder: str):
+        """Keeps the holder's slots from expiring while its calls are still running."""
+        pass
+
+    @abstractmethod
+    def close(self):
+        pass
+
+class SQLiteJobQueue(JobQueue):
+    """Queue in one SQLite file. Claims are single write transactions, so any number of local processes can share it.
+
+    SQLite locking is unreliable on most network filesystems; use FileJobQueue for workers on several hosts.
+    """
+
+    def __init__(self, path: str, **options):
+        super().__init__(**options)
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30.0, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, payload TEXT NOT NULL, state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+            "token TEXT, worker TEXT, lease_until REAL, result TEXT, error TEXT, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, lease_until)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS slots ("
+            "key TEXT NOT NULL, slot INTEGER NOT NULL, token TEXT NOT NULL, holder TEXT NOT NULL, expires REAL NOT NULL, "
+            "PRIMARY KEY (key, slot))"
+        )
+
+    def _transaction(self):
+        return _Transaction(self._conn, self._lock)
+
+    def enqueue(self, jobs: list[tuple[str, dict]]) -> int:
+        now = time.time()
+        with self._transaction() as conn:
+            added = 0
+            for job_id, payload in jobs:
+                added += conn.execute(
+                    "INSERT OR IGNORE INTO jobs (id, payload, state, updated_at) VALUES (?, ?, 'queued', ?)",
+                    (job_id, json.dumps(payload), now),
+                ).rowcount
+        return added
+
+    def claim(self, worker: str) -> Optional[Job]:
+        now = time.time()
+        with self._transaction() as conn:
+            # Expired leases: out of attempts -> failed, otherwise back in the queue.
+            conn.execute(
+                "UPDATE jobs SET state = 'failed', error = 'lease expired', updated_at = ? "
+                "WHERE state = 'leased' AND lease_until < ? AND attempts >= ?",
+                (now, now, self.max_attempts),
+            )
+            conn.execute(
+                "UPDATE jobs SET state = 'queued', token = NULL, updated_at = ? WHERE state = 'leased' AND lease_until < ?",
+                (now, now),
+            )
+            row = conn.execute("SELECT id, payload, attempts FROM jobs WHERE state = 'queued' ORDER BY rowid LIMIT 1").fetchone()
+            if row is None:
+                return None
+            token = uuid.uuid4().hex
+            conn.execute(
+                "UPDATE jobs SET state = 'leased', attempts = attempts + 1, token = ?, worker = ?, lease_until = ?, updated_at = ? WHERE id = ?",
+                (token, worker, now + self.lease_seconds, now, row[0]),
+            )
+        return Job(row[0], json.loads(row[1]), row[2] + 1, token)
+
+    def heartbeat(self, job: Job) -> bool:
+        now = time.time()
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE id = ? AND token = ? AND state = 'leased'",
+                (now + self.lease_seconds, now, job.id, job.token),
+            ).rowcount == 1
+
+    def complete(self, job: Job, result: dict) -> bool:
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE jobs SET state = 'done', result = ?, error = NULL, updated_at = ? WHERE id = ? AND token = ? AND state = 'leased'",
+                (json.dumps(result), time.time(), job.id, job.token),
+            ).rowcount == 1
+
+    def fail(self, job: Job, error: str, result: Optional[dict] = None) -> bool:
+        state = "failed" if job.attempts >= self.max_attempts else "queued"
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE jobs SET state = ?, token = NULL, error = ?, result = ?, updated_at = ? WHERE id = ? AND token = ? AND state = 'leased'",
+                (state, error, json.dumps(result) if result is not None else None, time.time(), job.id, job.token),
+            ).rowcount == 1
+
+    def results(self) -> Iterator[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, state, result, error FROM jobs WHERE state IN ('done', 'failed') ORDER BY rowid"
+            ).fetchall()
+        for job_id, state, result, error in rows:
+            yield _result(job_id, state, json.loads(result) if result else None, error)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+        return {state: counts.get(state, 0) for state in ("queued", "leased", "done", "failed")}
+
+    def try_acquire_slot(self, key: str, limit: int, holder: str) -> Optional[str]:
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM slots WHERE key = ? AND expires < ?", (key, now))
+            taken = {row[0] for row in conn.execute("SELECT slot FROM slots WHERE key = ?", (key,))}
+            free = next((slot for slot in range(limit) if slot not in taken), None)
+            if free is None:
+                return None
+            token = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO slots (key, slot, token, holder, expires) VALUES (?, ?, ?, ?, ?)",
+                (key, free, token, holder, now + self.slot_ttl),
+            )
+        return token
+
+    def release_slot(self, key: str, token: str):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM slots WHERE key = ? AND token = ?", (key, token))
+
+    def refresh_slots(self, holder: str):
+        with self._transaction() as conn:
+            conn.execute("UPDATE slots SET expires = ? WHERE holder = ?", (time.time() + self.slot_ttl, holder))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT, so a claim's read and update happen under one write lock across processes."""
+
+    def __init__(self, conn: sqlite3.Connection, lock: threading.Lock):
+        self.conn = conn
+        self.lock = lock
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.lock.acquire()
+        try:
+            self.conn.execute("BEGIN IMMEDIATE")
+        except BaseException:
+            self.lock.release()
+            raise
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.lock.release()
+
+class FileJobQueue(JobQueue):
+    """Queue of one JSON file per job under a directory, for workers on several hosts sharing storage.
+
+    Every state change is an atomic rename between queued/, leased/, done/ and failed/. A leased file is
+    named <id>@<token>.json, so whoever holds the name holds the lease, and its mtime is the heartbeat.
+    Finishing renames it to <id>@<token>.finishing first, so a lease reclaimed mid-finish is never completed.
+    Slots are lock files created with O_EXCL under slots/<key>/.
+    """
+
+    STATES = ("queued", "leased", "done", "failed")
+
+    def __init__(self, directory: str, **options):
+        super().__init__(**options)
+        self.directory = directory
+        for state in self.STATES + ("slots",):
+            os.makedirs(os.path.join(directory, state), exist_ok=True)
+
+    def _path(self, state: str, name: str) -> str:
+        return os.path.join(self.directory, state, name)
+
+    def enqueue(self, jobs: list[tuple[str, dict]]) -> int:
+        existing = {name.split("@")[0].removesuffix(".json") for state in self.STATES for name in os.listdir(os.path.join(self.directory, state))}
+        added = 0
+        for job_id, payload in jobs:
+            if _file_name(job_id) in existing:
+                continue
+            _write_json(self._path("queued", f"{_file_name(job_id)}.json"), {"id": job_id, "payload": payload, "attempts": 0})
+            existing.add(_file_name(job_id))
+            added += 1
+        return added
+
+    def claim(self, worker: str) -> Optional[Job]:
+        self._reclaim_expired()
+        for name in sorted(os.listdir(os.path.join(self.directory, "queued"))):
+            if not name.endswith(".json"):
+                continue
+            token = uuid.uuid4().hex
+            leased = self._path("leased", f"{name.removesuffix('.json')}@{token}.json")
+            try:
+                # Renames keep the mtime, so freshen it first or the new lease would look expired.
+                os.utime(self._path("queued", name))
+                os.rename(self._path("queued", name), leased)
+            except FileNotFoundError:
+                # Another worker claimed it first.
+                continue
+            record = _read_json(leased)
+            record["attempts"] += 1
+            record["worker"] = worker
+            _write_json(leased, record)
+            return Job(record["id"], record["payload"], record["attempts"], token)
+        return None
+
+    def _reclaim_expired(self):
+        now = time.time()
+        for name in os.listdir(os.path.join(self.directory, "leased")):
+            if not name.endswith((".json", ".finishing")):
+                continue
+            path = self._path("leased", name)
+            try:
+                if os.path.getmtime(path) + self.lease_seconds >= now:
+                    continue
+                record = _read_json(path)
+            except (FileNotFoundError, ValueError):
+                continue
+            name = name.split("@")[0]
+            if record["attempts"] >= self.max_attempts:
+                target = self._path("failed", f"{name}.json")
+                record["error"] = "lease expired"
+            else:
+                target = self._path("queued", f"{name}.json")
+            try:
+                # Only one reclaimer wins the rename.
+                os.rename(path, target)
+            except FileNotFoundError:
+                continue
+            if "error" in record:
+                # Nothing moves jobs out of failed/, so rewriting there cannot race a claim.
+                _write_json(target, record)
+
+    def _leased(self, job: Job) -> str:
+        return self._path("leased", f"{_file_name(job.id)}@{job.token}.json")
+
+    def heartbeat(self, job: Job) -> bool:
+        try:
+            os.utime(self._leased(job))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def complete(self, job: Job, result: dict) -> bool:
+        return self._finish(job, "done", {"result": result})
+
+    def fail(self, job: Job, error: str, result: Optional[dict] = None) -> bool:
+        state = "failed" if job.attempts >= self.max_attempts else "queued"
+        return self._finish(job, state, {"error": error, "result": result})
+
+    def _finish(self, job: Job, state: str, fields: dict) -> bool:
+        leased = self._leased(job)
+        # Move the file off the lease's name before touching it. If a reclaimer already took it, this fails,
+        # and nobody else writes a .finishing file. Freshen it first so it does not look like an expired lease.
+        finishing = leased.removesuffix(".json") + ".finishing"
+        try:
+            os.utime(leased)
+            os.rename(leased, finishing)
+        except FileNotFoundError:
+            return False
+        try:
+            record = _read_json(finishing)
+            record.update(fields)
+            _rewrite_json(finishing, record)
+            # A requeued job may be claimed the moment it lands, so the record is complete before the move.
+            os.rename(finishing, self._path(state, f"{_file_name(job.id)}.json"))
+        except FileNotFoundError:
+            # Stalled past lease_seconds mid-finish, and a reclaimer moved the job on.
+            return False
+        return True
+
+    def results(self) -> Iterator[dict]:
+        for state in ("done", "failed"):
+            for name in sorted(os.listdir(os.path.join(self.directory, state))):
+                if name.endswith(".json"):
+                    record = _read_json(self._path(state, name))
+                    yield _result(record["id"], state, record.get("result"), record.get("error"))
+
+    def stats(self) -> dict:
+        return {
+            state: sum(name.endswith(".json") for name in os.listdir(os.path.join(self.directory, state)))
+            for state in self.STATES
+        }
+
+    def _slot_dir(self, key: str) -> str:
+        return self._path("slots", _file_name(key))
+
+    def try_acquire_slot(self, key: str, limit: int, holder: str) -> Optional[str]:
+        directory = self._slot_dir(key)
+        os.makedirs(directory, exist_ok=True)
+        now = time.time()
+        for slot in range(limit):
+            path = os.path.join(directory, f"{slot}.lock")
+            try:
+                if os.path.getmtime(path) + self.slot_ttl < now:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                continue
+            token = f"{slot}:{holder}:{uuid.uuid4().hex}"
+            with os.fdopen(fd, "w") as f:
+                f.write(token)
+            return token
+        return None
+
+    def release_slot(self, key: str, token: str):
+        path = os.path.join(self._slot_dir(key), f"{token.split(':')[0]}.lock")
+        try:
+            with open(path) as f:
+                if f.read() != token:
+                    # Expired and taken over by someone else.
+                    return
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def refresh_slots(self, holder: str):
+        for key in os.listdir(self._path("slots", "")):
+            directory = self._path("slots", key)
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                try:
+                    with open(path) as f:
+                        if f.read().split(":")[1] == holder:
+                            os.utime(path)
+                except (FileNotFoundError, IndexError):
+                    continue
+
+    def close(self):
+        pass
+
+class QueueSlots(SlotPool):
+    """The queue's slots as a SlotPool for limiters.use_slots, held under one worker's name."""
+
+    def __init__(self, queue: JobQueue, holder: str):
+        self.queue = queue
+        self.holder = holder
+
+    def acquire(self, key: str, limit: int) -> Optional[str]:
+        return self.queue.try_acquire_slot(key, limit, self.holder)
+
+    def release(self, key: str, token: str):
+        self.queue.release_slot(key, token)
+
+def open_queue(spec: str, **options) -> JobQueue:
+    """Opens "sqlite:PATH", "file:DIRECTORY", or a bare path (.sqlite/.db files are SQLite, anything else a directory)."""
+    kind, _, target = spec.partition(":")
+    if kind == "sqlite" and target:
+        return SQLiteJobQueue(target, **options)
+    if kind == "file" and target:
+        return FileJobQueue(target, **options)
+    if spec.endswith((".sqlite", ".db")):
+        return SQLiteJobQueue(spec, **options)
+    return FileJobQueue(spec, **options)
+
+def _result(job_id: str, state: str, result: Optional[dict], error: Optional[str]) -> dict:
+    if state == "done" and result is not None:
+        return result
+    # Failed for good: keep the last attempt's result if there was one, with the queue's reason.
+    return {**(result or {"case_id": job_id, "match": False, "steps": []}), "error": (result or {}).get("error") or error, "job_id": job_id}
+
+def _file_name(name: str) -> str:
+    # Case keys and provider/model keys may hold "/", ":" or "@"; percent-encode them for file names.
+    return quote(name, safe="")
+
+def _read_json(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+def _rewrite_json(path: str, record: dict):
+    # In place, unlike _write_json, so a file another worker moved away is not recreated here.
+    with open(path, "r+") as f:
+        f.truncate()
+        json.dump(record, f)
+
+def _write_json(path: str, record: dict):
+    # Write then rename so readers on other hosts never see a partial file.
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(record, f)
+    os.replace(tmp_path, path)
@@ -0,0 +1,237 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+from .models import ImageGenerator, ImageEditor, ImageAnalyzer, ImageResult, ImageInput, as_image_result
+
+logger = logging.getLogger(__name__)
+
+class _CaseRecords:
+    """Everything the journal holds for one case, indexed for replay."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.generates: list[dict] = []
+        self.edits: dict[tuple[str, str], dict] = {}
+        self.analyses: dict[tuple[str, str], int] = {}
+        self.result: Optional[dict] = None
+        self._lock = threading.Lock()
+
+    def add(self, record: dict):
+        stage = record["stage"]
+        if stage == "generate":
+            self.generates.append(record)
+        elif stage == "edit":
+            self.edits[(record["source"], record["prompt"])] = record
+        elif stage == "analyze":
+            self.analyses[(record["image_path"], record["prompt"])] = record["count"]
+        elif stage == "result":
+            self.result = record["result"]
+
+    def next_generate(self, prompt: str) -> Optional[ImageResult]:
+        """Hands out recorded images in order, skipping any whose file never made it to disk."""
+        with self._lock:
+            while self.generates:
+                record = self.generates.pop(0)
+                if record["prompt"] == prompt and os.path.exists(record["image_path"]):
+                    return ImageResult(image_path=record["image_path"], metadata=record["metadata"])
+        return None
+
+    def edit(self, source: str, prompt: str) -> Optional[ImageResult]:
+        record = self.edits.get((source, prompt))
+        if record is not None and os.path.exists(record["image_path"]):
+            return ImageResult(image_path=record["image_path"], metadata=record["metadata"])
+        return None
+
+_current_case: ContextVar[Optional[_CaseRecords]] = ContextVar("current_case", default=None)
+
+class Journal:
+    """Append-only JSONL log of completed generate/edit/analyze steps and case results.
+
+    Each record is a single appended line, flushed (and by default fsynced) before the step returns,
+    so after a crash the journal holds every step that finished and at worst one truncated line.
+    """
+
+    def __init__(self, path: str, fsync: bool = True):
+        self.path = path
+        self.fsync = fsync
+        self._cases: dict[str, _CaseRecords] = {}
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def load(self) -> int:
+        """Indexes the records written since the last start(), for resuming. Returns the record count."""
+        cases: dict[str, _CaseRecords] = {}
+        loaded = 0
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A crash mid-write leaves at most a truncated last line.
+                    continue
+                if record.get("stage") == "start":
+                    cases.clear()
+                    loaded = 0
+                    continue
+                cases.setdefault(record["case"], _CaseRecords(record["case"])).add(record)
+                loaded += 1
+        with self._lock:
+            self._cases = cases
+        logger.info(f"Loaded {loaded} journal records for {len(cases)} cases from {self.path}")
+        return loaded
+
+    def start(self):
+        """Marks the beginning of a fresh run; earlier records are ignored by later resumes."""
+        with self._lock:
+            self._cases = {}
+        self._append({"stage": "start"})
+
+    def result(self, key: str) -> Optional[dict]:
+        """The journaled result of a finished case, if any."""
+        case = self._cases.get(key)
+        return case.result if case else None
+
+    @contextmanager
+    def case(self, key: str) -> Iterator[None]:
+        """Scopes provider calls in the block to one case, so journaled wrappers know what to record and replay."""
+        with self._lock:
+            records = self._cases.get(key) or _CaseRecords(key)
+        token = _current_case.set(records)
+        try:
+            yield
+        finally:
+            _current_case.reset(token)
+
+    def record(self, stage: str, **fields):
+        """Appends a record for the current case. Outside a case scope this is a no-op."""
+        case = _current_case.get()
+        if case is not None:
+            self._append({"case": case.key, "stage": stage, "time": time.time(), **fields})
+
+    async def arecord(self, stage: str, **fields):
+        """Async variant of record: the write and fsync run in a worker thread, off the event loop."""
+        case = _current_case.get()
+        if case is not None:
+            await asyncio.to_thread(self._append, {"case": case.key, "stage": stage, "time": time.time(), **fields})
+
+    def _append(self, record: dict):
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+class JournaledGenerator(ImageGenerator):
+    """Records generated images in the journal and, when resuming, reuses the ones already on disk."""
+
+    def __init__(self, generator: ImageGenerator, journal: Journal):
+        self.generator = generator
+        self.journal = journal
+
+    def generate(self, prompt: str) -> ImageResult:
+        result = self._replay(prompt)
+        if result is None:
+            result = self.generator.generate(prompt)
+            self._record(prompt, result)
+        return result
+
+    async def agenerate(self, prompt: str) -> ImageResult:
+        result = self._replay(prompt)
+        if result is None:
+            result = await self.generator.agenerate(prompt)
+            await self._arecord(prompt, result)
+        return result
+
+    def _replay(self, prompt: str) -> Optional[ImageResult]:
+        case = _current_case.get()
+        return case.next_generate(prompt) if case else None
+
+    def _record(self, prompt: str, result: ImageResult):
+        self.journal.record("generate", prompt=prompt, image_path=result.image_path, metadata=result.metadata)
+
+    async def _arecord(self, prompt: str, result: ImageResult):
+        await self.journal.arecord("generate", prompt=prompt, image_path=result.image_path, metadata=result.metadata)
+
+class JournaledEditor(ImageEditor):
+    """Records edits keyed by source image and prompt, replaying them when resuming."""
+
+    def __init__(self, editor: ImageEditor, journal: Journal):
+        self.editor = editor
+        self.journal = journal
+
+    def edit(self, image: ImageInput, prompt: str) -> ImageResult:
+        image = as_image_result(image)
+        result = self._replay(image, prompt)
+        if result is None:
+            result = self.editor.edit(image, prompt)
+            self._record(image, prompt, result)
+        return result
+
+    async def aedit(self, image: ImageInput, prompt: str) -> ImageResult:
+        image = as_image_result(image)
+        result = self._replay(image, prompt)
+        if result is None:
+            result = await self.editor.aedit(image, prompt)
+            await self._arecord(image, prompt, result)
+        return result
+
+    def _replay(self, image: ImageResult, prompt: str) -> Optional[ImageResult]:
+        case = _current_case.get()
+        return case.edit(image.image_path, prompt) if case else None
+
+    def _record(self, image: ImageResult, prompt: str, result: ImageResult):
+        self.journal.record("edit", source=image.image_path, prompt=prompt, image_path=result.image_path, metadata=result.metadata)
+
+    async def _arecord(self, image: ImageResult, prompt: str, result: ImageResult):
+        await self.journal.arecord("edit", source=image.image_path, prompt=prompt, image_path=result.image_path, metadata=result.metadata)
+
+class JournaledAnalyzer(ImageAnalyzer):
+    """Records counts keyed by image path and prompt, replaying them when resuming."""
+
+    def __init__(self, analyzer: ImageAnalyzer, journal: Journal):
+        self.analyzer = analyzer
+        self.journal = journal
+        self.model = getattr(analyzer, "model", type(analyzer).__name__)
+
+    def analyze(self, image: ImageInput, prompt: str) -> int:
+        image = as_image_result(image)
+        count = self._replay(image, prompt)
+        if count is None:
+            count = self.analyzer.analyze(image, prompt)
+            self._record(image, prompt, count)
+        return count
+
+    async def aanalyze(self, image: ImageInput, prompt: str) -> int:
+        image = as_image_result(image)
+        count = self._replay(image, prompt)
+        if count is None:
+            count = await self.analyzer.aanalyze(image, prompt)
+            await self._arecord(image, prompt, count)
+        return count
+
+    def _replay(self, image: ImageResult, prompt: str) -> Optional[int]:
+        case = _current_case.get()
+        return case.analyses.get((image.image_path, prompt)) if case else None
+
+    def _record(self, image: ImageResult, prompt: str, count: int):
+        # -1 is a failed analysis; leave it to be retried on resume.
+        if count >= 0:
+            self.journal.record("analyze", image_path=image.image_path, prompt=prompt, count=count)
+
+    async def _arecord(self, image: ImageResult, prompt: str, count: int):
+        if count >= 0:
+            await self.journal.arecord("analyze", image_path=image.image_path, prompt=prompt, count=count)
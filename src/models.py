@@ -1,11 +1,37 @@
+import asyncio
+import hashlib
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
-from typing import Optional, Any
+from dataclasses import dataclass, field
+from typing import Optional, Any, Union
 
 @dataclass
 class ImageResult:
     image_path: str
     metadata: dict[str, Any]
+    data: Optional[bytes] = None
+    _content_hash: Optional[str] = field(default=None, init=False, repr=False, compare=False)
+
+    def read_bytes(self) -> bytes:
+        """Returns the image bytes, reading image_path only if they are not already in memory."""
+        if self.data is None:
+            with open(self.image_path, "rb") as f:
+                self.data = f.read()
+        return self.data
+
+    def content_hash(self) -> str:
+        """Returns the sha256 hex digest of the image bytes, computed once."""
+        if self._content_hash is None:
+            self._content_hash = hashlib.sha256(self.read_bytes()).hexdigest()
+        return self._content_hash
+
+# Editors and analyzers accept either a path on disk or an in-memory ImageResult.
+ImageInput = Union[str, ImageResult]
+
+def as_image_result(image: ImageInput) -> ImageResult:
+    """Wraps a plain path in an ImageResult whose bytes are read lazily."""
+    if isinstance(image, ImageResult):
+        return image
+    return ImageResult(image_path=image, metadata={})
 
 class ImageGenerator(ABC):
     @abstractmethod
@@ -13,14 +39,26 @@ class ImageGenerator(ABC):
         """Generates an image based on the prompt."""
         pass
 
+    async def agenerate(self, prompt: str) -> ImageResult:
+        """Async variant of generate. Runs generate in a worker thread unless overridden."""
+        return await asyncio.to_thread(self.generate, prompt)
+
 class ImageEditor(ABC):
     @abstractmethod
-    def edit(self, image_path: str, prompt: str) -> ImageResult:
+    def edit(self, image: ImageInput, prompt: str) -> ImageResult:
         """Edits an existing image based on the prompt."""
         pass
 
+    async def aedit(self, image: ImageInput, prompt: str) -> ImageResult:
+        """Async variant of edit. Runs edit in a worker thread unless overridden."""
+        return await asyncio.to_thread(self.edit, image, prompt)
+
 class ImageAnalyzer(ABC):
     @abstractmethod
-    def analyze(self, image_path: str, prompt: str) -> int:
+    def analyze(self, image: ImageInput, prompt: str) -> int:
         """Analyzes an image and returns the count of objects."""
         pass
+
+    async def aanalyze(self, image: ImageInput, prompt: str) -> int:
+        """Async variant of analyze. Runs analyze in a worker thread unless overridden."""
+        return await asyncio.to_thread(self.analyze, image, prompt)
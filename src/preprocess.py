@@ -0,0 +1,154 @@
+import importlib.util
+import io
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+from .models import ImageAnalyzer, ImageResult, ImageInput, as_image_result
+from .tracing import tracer
+from .utils import lazy_module, record_step
+
+# Pillow is only needed once an image is actually resized or re-encoded.
+PIL_Image = lazy_module("PIL.Image")
+
+FORMATS = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+def detect_mime(data: bytes) -> str:
+    """Returns the MIME type from the image's magic bytes, defaulting to image/png for unknown data."""
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return "image/png"
+
+class ImagePreprocessor:
+    """Shrinks images before they are uploaded to an analyzer: downscale, re-encode, and cache the result.
+
+    With no options set it passes the bytes through and only detects their real MIME type.
+    """
+
+    def __init__(self, max_dimension: Optional[int] = None, format: Optional[str] = None, quality: int = 85, cache_size: int = 256):
+        if format is not None and format not in FORMATS:
+            raise ValueError(f"Unknown format {format!r}, expected one of {list(FORMATS)}")
+        self.max_dimension = max_dimension
+        self.format = format
+        self.quality = quality
+        self.cache_size = cache_size
+        if self.active and importlib.util.find_spec("PIL") is None:
+            raise ImportError("Resizing or re-encoding images needs Pillow (uv sync --extra preprocess)")
+        # Content hash -> (payload, mime) of derived images, least recently used first.
+        self._cache: OrderedDict[str, tuple[bytes, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return self.max_dimension is not None or self.format is not None
+
+    @property
+    def signature(self) -> str:
+        """Identifies the settings, so caches of analyzer results can tell preprocessed inputs apart."""
+        if not self.active:
+            return ""
+        return f"max={self.max_dimension},format={self.format},quality={self.quality}"
+
+    def prepare(self, image: ImageInput) -> tuple[bytes, str]:
+        """Returns the bytes to upload and their MIME type, recording both sizes on the current step."""
+        image = as_image_result(image)
+        original = image.read_bytes()
+        if not self.active:
+            payload, mime = original, detect_mime(original)
+        else:
+            key = image.content_hash()
+            with self._lock:
+                cached = self._cache.get(key)
+                if cached is not None:
+                    self._cache.move_to_end(key)
+            if cached is None:
+                with tracer.span("preprocess"):
+                    cached = self._derive(original)
+                with self._lock:
+                    self._cache[key] = cached
+                    while len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+            payload, mime = cached
+        record_step(original_bytes=len(original), upload_bytes=len(payload), upload_mime=mime)
+        return payload, mime
+
+    def _derive(self, original: bytes) -> tuple[bytes, str]:
+        image = PIL_Image.open(io.BytesIO(original))
+        resized = False
+        if self.max_dimension and max(image.size) > self.max_dimension:
+            # thumbnail keeps the aspect ratio and never upscales.
+            image.thumbnail((self.max_dimension, self.max_dimension), PIL_Image.Resampling.LANCZOS)
+            resized = True
+        format = self.format or (image.format or "png").lower()
+        if format not in FORMATS:
+            format = "png"
+        if format == "jpeg" and image.mode not in ("RGB", "L"):
+            # JPEG has no alpha channel; flatten onto white like a viewer would.
+            image = image.convert("RGBA")
+            background = PIL_Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+
+        buffer = io.BytesIO()
+        if format == "png":
+            image.save(buffer, format="PNG", optimize=True)
+        else:
+            image.save(buffer, format=format.upper(), quality=self.quality)
+        payload = buffer.getvalue()
+        if not resized and len(payload) >= len(original):
+            # Re-encoding did not help; upload the original.
+            return original, detect_mime(original)
+        return payload, FORMATS[format]
+
+def parse_setting(spec: str) -> ImagePreprocessor:
+    """Parses "original" or "MAX_DIMENSION[:FORMAT[:QUALITY]]", e.g. "768:jpeg:80"."""
+    if spec == "original":
+        return ImagePreprocessor()
+    parts = spec.split(":")
+    max_dimension = int(parts[0]) if parts[0] else None
+    format = parts[1] if len(parts) > 1 and parts[1] else None
+    quality = int(parts[2]) if len(parts) > 2 else 85
+    return ImagePreprocessor(max_dimension, format, quality)
+
+def payload_report(
+    analyzer_factory: Callable[[ImagePreprocessor], ImageAnalyzer],
+    samples: list[tuple[ImageResult, int, str]],
+    settings: list[str],
+    concurrency: int = 4,
+) -> list[dict]:
+    """Analyzes labelled (image, count, prompt) samples under each setting, reporting accuracy against upload size and latency."""
+    rows = []
+    for spec in settings:
+        preprocessor = parse_setting(spec)
+        analyzer = analyzer_factory(preprocessor)
+
+        def analyze(sample: tuple[ImageResult, int, str]) -> tuple[bool, int, int, float]:
+            image, expected, prompt = sample
+            original = len(image.read_bytes())
+            upload = len(preprocessor.prepare(image)[0])
+            started = time.perf_counter()
+            count = analyzer.analyze(image, prompt)
+            return count == expected, original, upload, time.perf_counter() - started
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(analyze, samples))
+        latencies = sorted(outcome[3] for outcome in outcomes)
+        n = len(outcomes) or 1
+        rows.append({
+            "setting": spec,
+            "samples": len(outcomes),
+            "accuracy": round(sum(outcome[0] for outcome in outcomes) / n, 4),
+            "mean_original_bytes": round(sum(outcome[1] for outcome in outcomes) / n),
+            "mean_upload_bytes": round(sum(outcome[2] for outcome in outcomes) / n),
+            "payload_ratio": round(sum(outcome[2] for outcome in outcomes) / max(1, sum(outcome[1] for outcome in outcomes)), 4),
+            "latency_p50": round(latencies[len(latencies) // 2], 4) if latencies else 0.0,
+            "latency_mean": round(sum(latencies) / n, 4),
+        })
+    return rows
@@ -0,0 +1,312 @@
+import asyncio
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Optional
+from .tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+class RateLimitError(RuntimeError):
+    """Raised when a provider keeps throttling a call after every retry."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def throttle_info(exc: BaseException) -> tuple[bool, Optional[float]]:
+    """Returns (is_throttle, retry_after_seconds) for an SDK exception."""
+    status = getattr(exc, "status_code", None) or getattr(exc, "code", None)
+    response = getattr(exc, "response", None)
+    if status is None and response is not None:
+        status = getattr(response, "status_code", None)
+    if status != 429 and type(exc).__name__ not in ("RateLimitError", "ResourceExhausted"):
+        return False, None
+
+    retry_after = None
+    headers = getattr(exc, "response_headers", None) or getattr(response, "headers", None) or {}
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    if value is not None:
+        try:
+            retry_after = float(value)
+        except ValueError:
+            retry_after = None
+    return True, retry_after
+
+class SlotPool(ABC):
+    """Counted slots shared between processes, e.g. through a job queue. acquire returns a token or None when all are taken."""
+
+    poll_interval = 0.1
+
+    @abstractmethod
+    def acquire(self, key: str, limit: int) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    def release(self, key: str, token: str):
+        pass
+
+class ProviderLimiter:
+    """Token bucket on request rate plus an AIMD concurrency limit for one provider/model."""
+
+    def __init__(
+        self,
+        name: str,
+        rate: Optional[float] = None,
+        burst: Optional[int] = None,
+        max_concurrency: int = 16,
+        min_concurrency: int = 1,
+        max_attempts: int = 5,
+        backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        global_max_inflight: Optional[int] = None,
+        global_key: Optional[str] = None,
+        slots: Optional[SlotPool] = None,
+    ):
+        self.name = name
+        # Requests per second; None means unlimited.
+        self.rate = rate
+        self.burst = burst or max(1, int(rate or 1))
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # Cap on concurrent calls across every process sharing the slot pool, counted under global_key.
+        self.global_max_inflight = global_max_inflight
+        self.global_key = global_key or name
+        self.slots = slots if global_max_inflight else None
+
+        self.concurrency = float(max_concurrency)
+        self.in_flight = 0
+        self.queued = 0
+        self.calls = 0
+        self.throttle_events = 0
+        self.wait_seconds = 0.0
+        self._tokens = float(self.burst)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._decreased_at = 0.0
+        self._cond = threading.Condition()
+
+    def call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Runs fn under the limiter, retrying throttled calls with backoff."""
+        attempt = 0
+        while True:
+            attempt += 1
+            with tracer.span("queue_wait", self.name):
+                self.acquire()
+                slot = self._global_acquire()
+            try:
+                try:
+                    with tracer.span("network", self.name):
+                        result = fn(*args, **kwargs)
+                finally:
+                    self._global_release(slot)
+            except Exception as e:
+                delay = self._failed(e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            except BaseException:
+                self.release()
+                raise
+            self.release()
+            return result
+
+    async def acall(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Async variant of call for coroutine functions."""
+        attempt = 0
+        while True:
+            attempt += 1
+            with tracer.span("queue_wait", self.name):
+                await self.aacquire()
+                slot = await self._aglobal_acquire()
+            try:
+                try:
+                    with tracer.span("network", self.name):
+                        result = await fn(*args, **kwargs)
+                finally:
+                    if slot is not None:
+                        await asyncio.to_thread(self._global_release, slot)
+            except Exception as e:
+                delay = self._failed(e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                self.release()
+                raise
+            self.release()
+            return result
+
+    def acquire(self):
+        started = time.monotonic()
+        with self._cond:
+            self.queued += 1
+            try:
+                while True:
+                    wait = self._reserve()
+                    if wait == 0:
+                        break
+                    self._cond.wait(wait)
+            finally:
+                self.queued -= 1
+                self.wait_seconds += time.monotonic() - started
+
+    async def aacquire(self):
+        started = time.monotonic()
+        with self._cond:
+            self.queued += 1
+        try:
+            while True:
+                with self._cond:
+                    wait = self._reserve()
+                if wait == 0:
+                    break
+                # Slot releases happen on other threads too, so poll rather than wait on an asyncio event.
+                await asyncio.sleep(min(wait, 0.05))
+        finally:
+            with self._cond:
+                self.queued -= 1
+                self.wait_seconds += time.monotonic() - started
+
+    def release(self, throttled: bool = False):
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                # Multiplicative decrease, at most once per second so a burst of 429s counts once.
+                if now - self._decreased_at > 1.0:
+                    self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+                    self._decreased_at = now
+            else:
+                # Additive increase: roughly +1 slot per window of successful calls.
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+            self._cond.notify_all()
+
+    def _global_acquire(self) -> Optional[str]:
+        """Waits for a slot in the shared pool. Returns its token, or None without a global cap."""
+        if self.slots is None:
+            return None
+        try:
+            while True:
+                token = self.slots.acquire(self.global_key, self.global_max_inflight)
+                if token is not None:
+                    return token
+                time.sleep(self.slots.poll_interval)
+        except BaseException:
+            self.release()
+            raise
+
+    async def _aglobal_acquire(self) -> Optional[str]:
+        if self.slots is None:
+            return None
+        try:
+            while True:
+                # The pool does file or SQLite I/O, so keep it off the event loop.
+                token = await asyncio.to_thread(self.slots.acquire, self.global_key, self.global_max_inflight)
+                if token is not None:
+                    return token
+                await asyncio.sleep(self.slots.poll_interval)
+        except BaseException:
+            # Cancelled while waiting: give back the local slot taken before.
+            self.release()
+            raise
+
+    def _global_release(self, token: Optional[str]):
+        if token is not None:
+            self.slots.release(self.global_key, token)
+
+    def _reserve(self) -> float:
+        """Takes a slot and a token if both are available. Otherwise returns how long to wait."""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self.in_flight >= int(self.concurrency):
+            return 0.05
+        if self.rate:
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+            self._refilled_at = now
+            if self._tokens < 1:
+                return (1 - self._tokens) / self.rate
+            self._tokens -= 1
+        self.in_flight += 1
+        self.calls += 1
+        return 0
+
+    def _failed(self, exc: Exception, attempt: int) -> Optional[float]:
+        """Releases the slot for a failed call. Returns the retry delay, or None to re-raise."""
+        throttled, retry_after = throttle_info(exc)
+        self.release(throttled=throttled)
+        if not throttled:
+            return None
+
+        with self._cond:
+            self.throttle_events += 1
+        if attempt >= self.max_attempts:
+            raise RateLimitError(f"{self.name} throttled after {attempt} attempts: {exc}", retry_after) from exc
+
+        delay = retry_after if retry_after is not None else min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        with self._cond:
+            # Every caller of this provider waits out Retry-After, not just the one that was throttled.
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        logger.warning(f"{self.name} throttled (attempt {attempt}/{self.max_attempts}), retrying in {delay:.1f}s")
+        return delay
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "name": self.name,
+                "concurrency_limit": int(self.concurrency),
+                "in_flight": self.in_flight,
+                "queue_depth": self.queued,
+                "calls": self.calls,
+                "throttle_events": self.throttle_events,
+                "wait_seconds": round(self.wait_seconds, 3),
+            }
+
+class RateLimiterRegistry:
+    """Hands out one shared ProviderLimiter per provider/model."""
+
+    def __init__(self):
+        self._limiters: dict[str, ProviderLimiter] = {}
+        self._settings: dict[str, dict] = {}
+        self._slots: Optional[SlotPool] = None
+        self._lock = threading.Lock()
+
+    def configure(self, key: str, **settings):
+        """Sets limiter options for a provider ("openai") or a single model ("openai/gpt-image-1")."""
+        with self._lock:
+            self._settings.setdefault(key, {}).update(settings)
+            for name in list(self._limiters):
+                if name == key or name.startswith(f"{key}/"):
+                    del self._limiters[name]
+
+    def use_slots(self, slots: Optional[SlotPool]):
+        """Enforces global_max_inflight settings through this pool of slots shared with other processes."""
+        with self._lock:
+            self._slots = slots
+            self._limiters.clear()
+
+    def get(self, provider: str, model: str) -> ProviderLimiter:
+        name = f"{provider}/{model}"
+        with self._lock:
+            limiter = self._limiters.get(name)
+            if limiter is None:
+                settings = {**self._settings.get(provider, {}), **self._settings.get(name, {})}
+                if "global_max_inflight" in settings:
+                    # A provider-wide cap is shared by all of the provider's models.
+                    settings["global_key"] = name if "global_max_inflight" in self._settings.get(name, {}) else provider
+                limiter = self._limiters[name] = ProviderLimiter(name, slots=self._slots, **settings)
+            return limiter
+
+    def stats(self) -> list[dict]:
+        with self._lock:
+            limiters = list(self._limiters.values())
+        return [limiter.stats() for limiter in limiters]
+
+limiters = RateLimiterRegistry()
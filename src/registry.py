@@ -0,0 +1,96 @@
+import importlib
+import threading
+from typing import Any
+
+KINDS = ("generator", "editor", "analyzer")
+
+# Built-in providers as "module:attribute" references, resolved relative to this package only when selected.
+BUILTINS: dict[str, dict[str, str]] = {
+    "generator": {
+        "gemini": ".generators:GeminiGenerator",
+        "openai": ".generators:OpenAIGenerator",
+        "fal": ".generators:FalGenerator",
+        "stub": ".stubs:StubGenerator",
+    },
+    "editor": {
+        "gemini": ".editors:GeminiEditor",
+        "openai": ".editors:OpenAIEditor",
+        "fal": ".editors:FalEditor",
+        "stub": ".stubs:StubEditor",
+    },
+    "analyzer": {
+        "qwen": ".analyzers:QwenAnalyzer",
+        "gemini": ".analyzers:GeminiAnalyzer",
+        "stub": ".stubs:StubAnalyzer",
+    },
+}
+
+# Installed packages can add providers under these entry point groups.
+ENTRY_POINT_GROUPS = {kind: f"imgcount.{kind}s" for kind in KINDS}
+
+class ProviderRegistry:
+    """Maps provider names to classes that are imported only when a provider is actually built."""
+
+    def __init__(self):
+        self._targets: dict[str, dict[str, Any]] = {kind: dict(targets) for kind, targets in BUILTINS.items()}
+        self._scanned = False
+        self._lock = threading.Lock()
+
+    def register(self, kind: str, name: str, target: Any):
+        """Adds a provider as a "module:attribute" reference or as a class/factory."""
+        self._check_kind(kind)
+        with self._lock:
+            self._targets[kind][name] = target
+
+    def names(self, kind: str) -> list[str]:
+        """Returns every registered name for kind, including installed entry points."""
+        self._check_kind(kind)
+        self._scan_entry_points()
+        return sorted(self._targets[kind])
+
+    def load(self, kind: str, name: str) -> Any:
+        """Imports and returns the provider class (or factory) registered as name."""
+        self._check_kind(kind)
+        target = self._targets[kind].get(name)
+        if target is None:
+            # Only pay for the entry point scan when a name is not built in.
+            self._scan_entry_points()
+            target = self._targets[kind].get(name)
+        if target is None:
+            raise ValueError(f"Unknown {kind} {name!r}, expected one of {self.names(kind)}")
+        if isinstance(target, str):
+            target = self._resolve(target)
+            with self._lock:
+                self._targets[kind][name] = target
+        return target
+
+    def create(self, kind: str, name: str, **kwargs) -> Any:
+        """Builds the provider registered as name. SDK clients are still created on first use."""
+        return self.load(kind, name)(**kwargs)
+
+    def _scan_entry_points(self):
+        with self._lock:
+            if self._scanned:
+                return
+            self._scanned = True
+        from importlib.metadata import entry_points
+        for kind, group in ENTRY_POINT_GROUPS.items():
+            for entry_point in entry_points(group=group):
+                with self._lock:
+                    # Built-ins win so an installed plugin cannot silently replace them.
+                    self._targets[kind].setdefault(entry_point.name, entry_point.value)
+
+    @staticmethod
+    def _resolve(target: str) -> Any:
+        module_name, _, attribute = target.partition(":")
+        module = importlib.import_module(module_name, __package__)
+        for part in attribute.split("."):
+            module = getattr(module, part)
+        return module
+
+    @staticmethod
+    def _check_kind(kind: str):
+        if kind not in KINDS:
+            raise ValueError(f"Unknown provider kind {kind!r}, expected one of {list(KINDS)}")
+
+providers = ProviderRegistry()
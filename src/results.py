@@ -0,0 +1,160 @@
+import glob
+import importlib.util
+import os
+import threading
+import time
+from typing import Optional
+from .utils import lazy_module
+
+# numpy (and pyarrow for Parquet) are only needed once results are actually stored or loaded.
+np = lazy_module("numpy")
+pa = lazy_module("pyarrow")
+pq = lazy_module("pyarrow.parquet")
+
+# Column name -> numpy dtype of the two tables. Strings are stored as unicode arrays.
+RESULT_COLUMNS = {
+    "run_id": "U", "case_id": "U", "prompt": "U", "object": "U", "mode": "U",
+    "generator": "U", "editor": "U", "analyzer": "U",
+    "target_count": "int64", "detected_count": "int64", "match": "bool",
+    "edits": "int64", "edits_to_match": "int64", "error": "bool",
+    "cost_usd": "float64", "elapsed_seconds": "float64", "time": "float64",
+}
+STEP_COLUMNS = {
+    "run_id": "U", "case_id": "U", "step": "int64", "action": "U", "model": "U",
+    "target_count": "int64", "count": "int64", "match": "bool", "cost_usd": "float64",
+}
+TABLES = {"results": RESULT_COLUMNS, "steps": STEP_COLUMNS}
+FORMATS = ("parquet", "npz")
+
+def edits_to_match(result: dict) -> int:
+    """Edit steps it took to reach the target: 0 if the first image matched, -1 if it never did."""
+    edits = 0
+    for step in result.get("steps", []):
+        if step.get("action") == "edit":
+            edits += 1
+        if step.get("count") == result.get("target_count"):
+            return edits
+    return -1
+
+def result_row(result: dict, **labels) -> dict:
+    """Flattens one EvaluationLoop/BatchRunner result into a results-table row.
+
+    labels fill run-level columns the result does not carry (run_id, generator, editor, analyzer).
+    """
+    steps = result.get("steps", [])
+    prompt = result.get("prompt") or ""
+    return {
+        "run_id": labels.get("run_id", ""),
+        "case_id": str(result.get("case_id") or ""),
+        "prompt": prompt,
+        # The object EvaluationLoop counts when none was given.
+        "object": result.get("object") or (prompt.split()[-1] if prompt else ""),
+        "mode": result.get("mode") or "",
+        "generator": labels.get("generator", ""),
+        "editor": labels.get("editor", ""),
+        "analyzer": labels.get("analyzer", ""),
+        "target_count": int(result.get("target_count", -1)),
+        "detected_count": int(result.get("detected_count", -1)),
+        "match": bool(result.get("match")),
+        "edits": sum(step.get("action") == "edit" for step in steps),
+        "edits_to_match": edits_to_match(result),
+        "error": "error" in result,
+        "cost_usd": float(result.get("cost_usd", 0.0)),
+        "elapsed_seconds": float(result.get("elapsed_seconds", 0.0)),
+        "time": labels.get("time", time.time()),
+    }
+
+def step_rows(result: dict, run_id: str = "") -> list[dict]:
+    target = int(result.get("target_count", -1))
+    return [
+        {
+            "run_id": run_id,
+            "case_id": str(result.get("case_id") or ""),
+            "step": index,
+            "action": step.get("action", ""),
+            "model": step.get("model") or "",
+            "target_count": target,
+            "count": int(step.get("count", -1)),
+            "match": step.get("count") == target,
+            "cost_usd": float(step.get("cost_usd", 0.0)),
+        }
+        for index, step in enumerate(result.get("steps", []))
+    ]
+
+class ResultsStore:
+    """Columnar store of evaluation results and their steps for analytics over many runs.
+
+    Rows are buffered per table and written as one part file per flush under <root>/<table>/, as
+    Parquet (needs pyarrow) or NumPy .npz. load() reads every part back as a dict of numpy columns.
+    """
+
+    def __init__(self, root: str = "output/results", format: Optional[str] = None, flush_rows: int = 10_000):
+        if format is None:
+            format = "parquet" if importlib.util.find_spec("pyarrow") else "npz"
+        if format not in FORMATS:
+            raise ValueError(f"Unknown format {format!r}, expected one of {list(FORMATS)}")
+        if importlib.util.find_spec("numpy") is None or (format == "parquet" and importlib.util.find_spec("pyarrow") is None):
+            raise ImportError("The results store needs numpy, and pyarrow for Parquet (uv sync --extra analytics)")
+        self.root = root
+        self.format = format
+        self.flush_rows = flush_rows
+        self._rows: dict[str, list[dict]] = {table: [] for table in TABLES}
+        self._lock = threading.Lock()
+
+    def append(self, result: dict, **labels):
+        """Adds a result and its steps; see result_row for labels."""
+        labels.setdefault("time", time.time())
+        with self._lock:
+            self._rows["results"].append(result_row(result, **labels))
+            self._rows["steps"].extend(step_rows(result, labels.get("run_id", "")))
+            full = len(self._rows["results"]) >= self.flush_rows
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            rows, self._rows = self._rows, {table: [] for table in TABLES}
+            for table, table_rows in rows.items():
+                if table_rows:
+                    self._write(table, to_columns(table_rows, TABLES[table]))
+
+    def close(self):
+        self.flush()
+
+    def load(self, table: str = "results", columns: Optional[list[str]] = None) -> dict:
+        """Every stored row of the table as {column: numpy array}, optionally only some columns."""
+        self.flush()
+        schema = TABLES[table]
+        names = columns or list(schema)
+        parts = []
+        for path in sorted(glob.glob(os.path.join(self.root, table, "*"))):
+            if path.endswith(".parquet"):
+                arrow = pq.read_table(path, columns=names)
+                parts.append({name: arrow.column(name).to_numpy(zero_copy_only=False) for name in names})
+            elif path.endswith(".npz"):
+                with np.load(path) as data:
+                    parts.append({name: data[name] for name in names})
+        if not parts:
+            return {name: np.array([], dtype=_dtype(schema[name])) for name in names}
+        return {name: np.concatenate([part[name] for part in parts]).astype(_dtype(schema[name]), copy=False) for name in names}
+
+    def _write(self, table: str, columns: dict):
+        directory = os.path.join(self.root, table)
+        os.makedirs(directory, exist_ok=True)
+        # Part names sort by creation time; the pid keeps concurrent writer processes apart.
+        name = f"part-{time.time_ns()}-{os.getpid()}"
+        path = os.path.join(directory, f"{name}.{self.format}")
+        tmp_path = os.path.join(directory, f".{name}.tmp")
+        if self.format == "parquet":
+            pq.write_table(pa.table(columns), tmp_path)
+        else:
+            with open(tmp_path, "wb") as f:
+                np.savez(f, **columns)
+        os.replace(tmp_path, path)
+
+def to_columns(rows: list[dict], schema: dict) -> dict:
+    return {name: np.array([row[name] for row in rows], dtype=_dtype(dtype)) for name, dtype in schema.items()}
+
+def _dtype(dtype: str):
+    # An empty unicode array still needs a width.
+    return np.str_ if dtype == "U" else np.dtype(dtype)
@@ -0,0 +1,224 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Fields an image can be labelled with in the ContentStore index.
+LABELS = ("prompt", "model", "case", "step")
+
+class ImageStore(ABC):
+    """Decides where image bytes live. ImageWriter asks place() for a path, writes the bytes there if told to,
+    then calls commit() on its writer thread.
+
+    Paths are ordinary files, so callers can keep opening ImageResult.image_path directly.
+    """
+
+    @abstractmethod
+    def place(self, prefix: str, data: bytes, extension: str = "png") -> tuple[str, bool]:
+        """Returns the path for the image and whether the bytes still need writing."""
+        pass
+
+    def commit(self, path: str, prefix: str, size: int, labels: dict):
+        """Called once the image at path is on disk."""
+
+    def abandon(self, path: str):
+        """Called instead of commit() when writing the image failed."""
+
+class FlatStore(ImageStore):
+    """The original layout: one directory of <prefix>_<timestamp>_<uuid>.<extension> files."""
+
+    def __init__(self, output_dir: str = "output"):
+        self.output_dir = output_dir
+        self._created: set[str] = set()
+
+    def place(self, prefix: str, data: bytes, extension: str = "png") -> tuple[str, bool]:
+        directory = os.path.abspath(self.output_dir)
+        if directory not in self._created:
+            os.makedirs(directory, exist_ok=True)
+            self._created.add(directory)
+        return os.path.join(self.output_dir, timestamped_name(prefix, extension)), True
+
+def timestamped_name(prefix: str, extension: str = "png") -> str:
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    unique_id = str(uuid.uuid4())[:8]
+    return f"{prefix}_{timestamp}_{unique_id}.{extension}"
+
+class ContentStore(ImageStore):
+    """Content-addressed images under <root>/images/ab/cd/<sha256>.<extension>, indexed in SQLite.
+
+    Identical bytes are stored once; every save still gets an index row with its prefix and labels
+    (prompt, model, case, step), so images can be looked up by what produced them. gc() applies
+    age- and size-based retention. Paths are relative to the working directory, like the flat layout.
+    """
+
+    def __init__(self, root: str = "output", shard_depth: int = 2):
+        self.root = root
+        self.shard_depth = shard_depth
+        self.dedup_hits = 0
+        self._lock = threading.Lock()
+        # Paths handed out whose bytes are still being written, so concurrent duplicates skip the write.
+        self._writing: set[str] = set()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_path: Optional[str] = None
+
+    @property
+    def directory(self) -> str:
+        return os.path.join(self.root, "images")
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.directory, "index.sqlite")
+
+    def path_for(self, digest: str, extension: str = "png") -> str:
+        shards = [digest[2 * i:2 * i + 2] for i in range(self.shard_depth)]
+        return os.path.join(self.directory, *shards, f"{digest}.{extension}")
+
+    def place(self, prefix: str, data: bytes, extension: str = "png") -> tuple[str, bool]:
+        path = self.path_for(hashlib.sha256(data).hexdigest(), extension)
+        with self._lock:
+            if path in self._writing or os.path.exists(path):
+                self.dedup_hits += 1
+                return path, False
+            self._writing.add(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path, True
+
+    def abandon(self, path: str):
+        with self._lock:
+            self._writing.discard(path)
+
+    def commit(self, path: str, prefix: str, size: int, labels: dict):
+        now = time.time()
+        digest = os.path.basename(path).split(".")[0]
+        with self._lock:
+            self._writing.discard(path)
+            conn = self._connection()
+            conn.execute(
+                "INSERT INTO blobs (path, hash, size, created_at, last_used) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (path) DO UPDATE SET last_used = excluded.last_used",
+                (path, digest, size, now, now),
+            )
+            conn.execute(
+                "INSERT INTO images (path, prefix, prompt, model, case_id, step, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (path, prefix, labels.get("prompt"), labels.get("model"), labels.get("case"), labels.get("step"), now),
+            )
+            conn.commit()
+
+    def find(self, **labels) -> list[dict]:
+        """Index rows matching every given label (prompt, model, case, step), oldest first."""
+        unknown = set(labels) - set(LABELS)
+        if unknown:
+            raise ValueError(f"Unknown labels {sorted(unknown)}, expected some of {list(LABELS)}")
+        columns = {"case": "case_id"}
+        where = " AND ".join(f"{columns.get(name, name)} = ?" for name in labels) or "1"
+        with self._lock:
+            rows = self._connection().execute(
+                f"SELECT path, prefix, prompt, model, case_id, step, created_at FROM images WHERE {where} ORDER BY id",
+                tuple(labels.values()),
+            ).fetchall()
+        return [
+            {"path": row[0], "prefix": row[1], "prompt": row[2], "model": row[3], "case": row[4], "step": row[5], "created_at": row[6]}
+            for row in rows
+        ]
+
+    def gc(self, max_bytes: Optional[int] = None, max_age: Optional[float] = None) -> dict:
+        """Applies retention and deletes files no index row refers to any more.
+
+        max_age (seconds) drops index rows older than that; max_bytes then drops the least recently
+        used files until the store fits. Returns counts of removed rows and files and the bytes freed.
+        """
+        removed_images = 0
+        doomed: list[tuple[str, int]] = []
+        with self._lock:
+            conn = self._connection()
+            if max_age is not None:
+                removed_images += conn.execute("DELETE FROM images WHERE created_at < ?", (time.time() - max_age,)).rowcount
+            doomed += conn.execute(
+                "SELECT path, size FROM blobs WHERE path NOT IN (SELECT path FROM images)"
+            ).fetchall()
+            if max_bytes is not None:
+                doomed_paths = {path for path, _ in doomed}
+                total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+                total -= sum(size for _, size in doomed)
+                for path, size in conn.execute("SELECT path, size FROM blobs ORDER BY last_used, created_at"):
+                    if total <= max_bytes:
+                        break
+                    if path in doomed_paths:
+                        continue
+                    doomed.append((path, size))
+                    total -= size
+            for path, _ in doomed:
+                removed_images += conn.execute("DELETE FROM images WHERE path = ?", (path,)).rowcount
+                conn.execute("DELETE FROM blobs WHERE path = ?", (path,))
+            conn.commit()
+
+        for path, _ in doomed:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        freed = sum(size for _, size in doomed)
+        logger.info(f"Image store gc removed {len(doomed)} files ({freed} bytes) and {removed_images} index rows")
+        return {"removed_images": removed_images, "removed_files": len(doomed), "freed_bytes": freed}
+
+    def link_view(self, directory: str, **labels) -> list[str]:
+        """Symlinks matching images into directory under the flat <prefix>_<timestamp>_<hash>.<extension> names,
+        for browsing the store like the old output/ layout. Returns the link paths.
+        """
+        os.makedirs(directory, exist_ok=True)
+        links = []
+        for row in self.find(**labels):
+            name, extension = os.path.basename(row["path"]).split(".", 1)
+            timestamp = datetime.fromtimestamp(row["created_at"]).strftime("%Y%m%d_%H%M%S")
+            link = os.path.join(directory, f"{row['prefix']}_{timestamp}_{name[:8]}.{extension}")
+            if not os.path.lexists(link):
+                os.symlink(os.path.relpath(row["path"], directory), link)
+            links.append(link)
+        return links
+
+    def stats(self) -> dict:
+        with self._lock:
+            conn = self._connection()
+            images = conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+            files, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        return {"images": images, "files": files, "bytes": size, "dedup_hits": self.dedup_hits}
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # The root is relative to the working directory, so reopen if that has moved on.
+        path = os.path.abspath(self.index_path)
+        if self._conn is None or self._conn_path != path:
+            if self._conn is not None:
+                self._conn.close()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS blobs ("
+                "path TEXT PRIMARY KEY, hash TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS images ("
+                "id INTEGER PRIMARY KEY, path TEXT NOT NULL, prefix TEXT NOT NULL, prompt TEXT, model TEXT, "
+                "case_id TEXT, step INTEGER, created_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS images_path ON images (path)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS images_created_at ON images (created_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS blobs_last_used ON blobs (last_used)")
+            self._conn.commit()
+            self._conn_path = path
+        return self._conn
@@ -0,0 +1,158 @@
+import asyncio
+import base64
+import functools
+import random
+import re
+import struct
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Optional
+from .models import ImageGenerator, ImageEditor, ImageAnalyzer, ImageResult, ImageInput, as_image_result
+from .utils import image_writer
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+@dataclass
+class Latency:
+    """Log-normal latency in seconds around a median; sigma=0 gives a fixed delay."""
+    median: float = 0.0
+    sigma: float = 0.0
+
+    def sample(self, rng: random.Random) -> float:
+        if self.median <= 0:
+            return 0.0
+        if self.sigma <= 0:
+            return self.median
+        return rng.lognormvariate(0.0, self.sigma) * self.median
+
+def _chunk(kind: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I", len(payload)) + kind + payload + struct.pack(">I", zlib.crc32(kind + payload))
+
+@functools.lru_cache(maxsize=8)
+def _noise_idat(width: int, height: int) -> bytes:
+    # Noise compresses poorly, so the encoded size tracks width * height like a real photo.
+    # It is built once per size so the stubs themselves cost almost no CPU.
+    rng = random.Random(width * 65536 + height)
+    raw = b"".join(b"\x00" + rng.randbytes(width * 3) for _ in range(height))
+    return _chunk(b"IDAT", zlib.compress(raw, 1))
+
+def make_png(count: int, width: int = 256, height: int = 256, rng: Optional[random.Random] = None) -> bytes:
+    """Builds a real RGB PNG of noise whose tEXt chunk records the true object count."""
+    rng = rng or random.Random()
+    return b"".join([
+        PNG_SIGNATURE,
+        _chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)),
+        _chunk(b"tEXt", b"count\x00" + str(count).encode()),
+        # A random nonce keeps every image's bytes (and content hash) unique.
+        _chunk(b"tEXt", b"nonce\x00" + rng.randbytes(8).hex().encode()),
+        _noise_idat(width, height),
+        _chunk(b"IEND", b""),
+    ])
+
+def read_png_count(data: bytes) -> int:
+    """Returns the count recorded by make_png, or -1 if the image has none."""
+    match = re.search(rb"tEXtcount\x00(\d+)", data)
+    return int(match.group(1)) if match else -1
+
+def png_size(data: bytes) -> tuple[int, int]:
+    """Returns (width, height) from a PNG's IHDR chunk."""
+    return struct.unpack(">II", data[16:24])
+
+def _miscount(count: int, rng: random.Random) -> int:
+    return max(0, count + rng.choice([-2, -1, 1, 2]))
+
+class _StubProvider:
+    def __init__(self, latency: Optional[Latency], failure_rate: float, accuracy: float, seed: Optional[int]):
+        self.latency = latency or Latency()
+        self.failure_rate = failure_rate
+        self.accuracy = accuracy
+        self.rng = random.Random(seed)
+        self.calls = 0
+
+    def _delay(self) -> float:
+        self.calls += 1
+        return self.latency.sample(self.rng)
+
+    def _fails(self) -> bool:
+        return self.rng.random() < self.failure_rate
+
+    def _count(self, intended: int) -> int:
+        return intended if self.rng.random() < self.accuracy else _miscount(intended, self.rng)
+
+class StubGenerator(_StubProvider, ImageGenerator):
+    """Offline generator that draws the first number in the prompt, usually correctly."""
+
+    def __init__(self, latency: Optional[Latency] = None, failure_rate: float = 0.0, accuracy: float = 0.7,
+                 width: int = 256, height: int = 256, seed: Optional[int] = None, model: str = "stub-generator"):
+        super().__init__(latency, failure_rate, accuracy, seed)
+        self.width = width
+        self.height = height
+        self.model = model
+
+    def generate(self, prompt: str) -> ImageResult:
+        time.sleep(self._delay())
+        return self._generate(prompt)
+
+    async def agenerate(self, prompt: str) -> ImageResult:
+        await asyncio.sleep(self._delay())
+        return self._generate(prompt)
+
+    def _generate(self, prompt: str) -> ImageResult:
+        if self._fails():
+            raise RuntimeError("Stub generation failed")
+        numbers = re.findall(r"\d+", prompt)
+        count = self._count(int(numbers[0]) if numbers else 1)
+        data = make_png(count, self.width, self.height, self.rng)
+        image_path = image_writer.save("generated_stub", data, model=self.model)
+        return ImageResult(image_path=image_path, metadata={"model": self.model}, data=data)
+
+class StubEditor(_StubProvider, ImageEditor):
+    """Offline editor that fixes the count requested by the edit prompt with probability accuracy."""
+
+    def __init__(self, latency: Optional[Latency] = None, failure_rate: float = 0.0, accuracy: float = 0.8,
+                 seed: Optional[int] = None, model: str = "stub-editor"):
+        super().__init__(latency, failure_rate, accuracy, seed)
+        self.model = model
+
+    def edit(self, image: ImageInput, prompt: str) -> ImageResult:
+        time.sleep(self._delay())
+        return self._edit(as_image_result(image), prompt)
+
+    async def aedit(self, image: ImageInput, prompt: str) -> ImageResult:
+        await asyncio.sleep(self._delay())
+        return self._edit(as_image_result(image), prompt)
+
+    def _edit(self, image: ImageResult, prompt: str) -> ImageResult:
+        if self._fails():
+            raise RuntimeError("Stub edit failed")
+        source = image.read_bytes()
+        match = re.search(r"exactly (\d+)", prompt)
+        count = self._count(int(match.group(1))) if match else read_png_count(source)
+        data = make_png(count, *png_size(source), rng=self.rng)
+        image_path = image_writer.save("edited_stub", data, model=self.model)
+        return ImageResult(image_path=image_path, metadata={"model": self.model}, data=data)
+
+class StubAnalyzer(_StubProvider, ImageAnalyzer):
+    """Offline analyzer that reads the true count from the image, miscounting with probability 1 - accuracy."""
+
+    def __init__(self, latency: Optional[Latency] = None, failure_rate: float = 0.0, accuracy: float = 0.95,
+                 seed: Optional[int] = None, model: str = "stub-analyzer"):
+        super().__init__(latency, failure_rate, accuracy, seed)
+        self.model = model
+
+    def analyze(self, image: ImageInput, prompt: str) -> int:
+        time.sleep(self._delay())
+        return self._analyze(as_image_result(image))
+
+    async def aanalyze(self, image: ImageInput, prompt: str) -> int:
+        await asyncio.sleep(self._delay())
+        return self._analyze(as_image_result(image))
+
+    def _analyze(self, image: ImageResult) -> int:
+        # Same encoding work as the real analyzers' upload payload.
+        base64.b64encode(image.read_bytes())
+        if self._fails():
+            return -1
+        count = read_png_count(image.read_bytes())
+        return self._count(count) if count >= 0 else -1
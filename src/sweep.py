@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import math
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from statistics import NormalDist
+from typing import AsyncIterator, Iterator, Optional
+from .batch import BatchCase, BatchRunner
+
+logger = logging.getLogger(__name__)
+
+def wilson_interval(matches: int, n: int, z: float = 1.96) -> tuple[float, float]:
+    """Wilson score interval for a match rate; (0, 1) before any samples."""
+    if n == 0:
+        return 0.0, 1.0
+    rate = matches / n
+    denominator = 1 + z * z / n
+    center = (rate + z * z / (2 * n)) / denominator
+    margin = z * math.sqrt(rate * (1 - rate) / n + z * z / (4 * n * n)) / denominator
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+@dataclass
+class Bucket:
+    """One (prompt, count) cell of a sweep and the samples taken from it so far."""
+    prompt: str
+    count: int
+    object_name: Optional[str] = None
+    mode: str = "direct"
+    n: int = 0
+    matches: int = 0
+    errors: int = 0
+    inflight: int = 0
+    started: int = 0
+
+    @property
+    def rate(self) -> Optional[float]:
+        return self.matches / self.n if self.n else None
+
+class AdaptiveSweep:
+    """Samples sweep buckets until each match rate is known to within tolerance, or the budget runs out.
+
+    Every bucket first gets min_samples cases. Once those have come back, each free slot goes to the bucket whose
+    Wilson interval would still be widest once its in-flight cases land, so calls flow to uncertain
+    buckets. A bucket is settled when its interval is narrower than tolerance or it reached
+    max_samples. budget caps the total cases started; errored cases use budget but are not samples, and a bucket
+    where most cases error is dropped.
+    """
+
+    def __init__(
+        self,
+        buckets: list[BatchCase],
+        tolerance: float = 0.1,
+        budget: int = 1000,
+        min_samples: int = 5,
+        max_samples: Optional[int] = None,
+        confidence: float = 0.95,
+    ):
+        self.buckets = [Bucket(case.prompt, case.count, case.object_name, case.mode) for case in buckets]
+        self.tolerance = tolerance
+        self.budget = budget
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        self.started = 0
+
+    def width(self, bucket: Bucket, extra: int = 0) -> float:
+        """Interval width now, or projected at the current rate once extra more samples are in."""
+        n = bucket.n + extra
+        if n == 0:
+            return 1.0
+        rate = 0.5 if bucket.rate is None else bucket.rate
+        low, high = wilson_interval(round(rate * n), n, self.z)
+        return high - low
+
+    def settled(self, bucket: Bucket) -> bool:
+        if self.max_samples is not None and bucket.n >= self.max_samples:
+            return True
+        return bucket.n >= self.min_samples and self.width(bucket) < self.tolerance
+
+    def failing(self, bucket: Bucket) -> bool:
+        """Most of the bucket's cases error out; it is dropped rather than sampled forever."""
+        return bucket.started >= self.min_samples and bucket.errors * 2 > bucket.started
+
+    def next_case(self) -> Optional[BatchCase]:
+        """Picks the bucket to sample next and marks the case in flight, or None if nothing is worth running now."""
+        if self.started >= self.budget:
+            return None
+        candidates = [
+            (index, bucket) for index, bucket in enumerate(self.buckets)
+            if not self.settled(bucket) and not self.failing(bucket)
+            and (self.max_samples is None or bucket.n + bucket.inflight < self.max_samples)
+        ]
+        if not candidates:
+            return None
+        warming = [(index, bucket) for index, bucket in candidates if bucket.started < self.min_samples]
+        if warming:
+            index, bucket = min(warming, key=lambda item: item[1].started)
+        else:
+            # Adaptive samples wait until a bucket's warm-up has landed, so failing() has seen its errors.
+            candidates = [(index, bucket) for index, bucket in candidates if bucket.n + bucket.errors >= self.min_samples]
+            if not candidates:
+                return None
+            index, bucket = max(candidates, key=lambda item: self.width(item[1], item[1].inflight))
+            if self.width(bucket, bucket.inflight) < self.tolerance:
+                # In-flight cases are expected to settle every bucket; wait for them before spending more.
+                return None
+        bucket.inflight += 1
+        bucket.started += 1
+        self.started += 1
+        return BatchCase(f"b{index}-s{bucket.started - 1}", bucket.prompt, bucket.count, bucket.object_name, bucket.mode)
+
+    def record(self, result: dict):
+        bucket = self.buckets[int(result["case_id"].split("-")[0][1:])]
+        bucket.inflight -= 1
+        if "error" in result:
+            bucket.errors += 1
+            return
+        bucket.n += 1
+        bucket.matches += bool(result.get("match"))
+        if self.settled(bucket) and bucket.inflight == 0:
+            logger.info(f"Bucket {bucket.count} x {bucket.prompt!r} settled at {bucket.matches}/{bucket.n}")
+
+    def run(self, runner: BatchRunner) -> Iterator[dict]:
+        """Runs cases on the runner's threads, choosing each next case as earlier ones finish."""
+        slots = runner.generate_concurrency + runner.analyze_concurrency + runner.edit_concurrency
+        with ThreadPoolExecutor(max_workers=slots) as executor:
+            running = set()
+            while True:
+                while len(running) < slots:
+                    case = self.next_case()
+                    if case is None:
+                        break
+                    running.add(executor.submit(runner.run_case, case))
+                if not running:
+                    return
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    self.record(result)
+                    yield result
+
+    async def arun(self, runner: BatchRunner) -> AsyncIterator[dict]:
+        slots = runner.generate_concurrency + runner.analyze_concurrency + runner.edit_concurrency
+        running = set()
+        try:
+            while True:
+                while len(running) < slots:
+                    case = self.next_case()
+                    if case is None:
+                        break
+                    running.add(asyncio.create_task(runner.arun_case(case)))
+                if not running:
+                    return
+                done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    self.record(result)
+                    yield result
+        finally:
+            for task in running:
+                task.cancel()
+
+    def report(self) -> list[dict]:
+        rows = []
+        for bucket in self.buckets:
+            low, high = wilson_interval(bucket.matches, bucket.n, self.z)
+            rows.append({
+                "prompt": bucket.prompt,
+                "count": bucket.count,
+                "samples": bucket.n,
+                "errors": bucket.errors,
+                "match_rate": round(bucket.rate, 4) if bucket.n else None,
+                "ci_low": round(low, 4),
+                "ci_high": round(high, 4),
+                "settled": self.settled(bucket),
+                "failing": self.failing(bucket),
+            })
+        return rows
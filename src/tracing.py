@@ -0,0 +1,264 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+# Upper bounds in seconds, spanning sub-millisecond encodes to multi-minute generations.
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# USD list prices: "input"/"output" per million tokens, "image" per image. Override with Tracer.set_prices.
+PRICES: dict[str, dict[str, float]] = {
+    "gpt-image-1": {"input": 5.0, "output": 40.0},
+    "gemini-3-pro-image-preview": {"input": 2.0, "output": 120.0},
+    "fal-ai/recraft-v3": {"image": 0.04},
+    "qwen/qwen3-vl-235b-a22b-instruct": {"input": 0.3, "output": 1.2},
+    "gemini-3-pro": {"input": 2.0, "output": 12.0},
+}
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the Prometheus layout."""
+
+    def __init__(self, buckets: tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Estimates the q-quantile (0..1) by interpolating inside the bucket that contains it."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.max
+                return min(self.max, lower + (upper - lower) * (rank - seen) / n)
+            seen += n
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else 0.0,
+            "max": round(self.max, 6),
+            "p50": round(self.quantile(0.5), 6),
+            "p95": round(self.quantile(0.95), 6),
+            "p99": round(self.quantile(0.99), 6),
+        }
+
+class StepTrace:
+    """Timing and usage accumulated for one evaluation step, possibly from several threads."""
+
+    def __init__(self):
+        self.timings: dict[str, float] = {}
+        self.usage = {"input_tokens": 0, "output_tokens": 0, "images": 0}
+        self.cost_usd = 0.0
+        self._lock = threading.Lock()
+
+    def add_time(self, stage: str, seconds: float):
+        with self._lock:
+            self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def add_usage(self, input_tokens: int, output_tokens: int, images: int, cost: float):
+        with self._lock:
+            self.usage["input_tokens"] += input_tokens
+            self.usage["output_tokens"] += output_tokens
+            self.usage["images"] += images
+            self.cost_usd += cost
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "timings": {stage: round(seconds, 4) for stage, seconds in self.timings.items()},
+                "usage": dict(self.usage),
+                "cost_usd": round(self.cost_usd, 6),
+            }
+
+_current_trace: ContextVar[Optional[StepTrace]] = ContextVar("current_trace", default=None)
+
+def _tokens(value) -> int:
+    # SDK usage fields may be missing or None (and are mocks in tests).
+    return value if isinstance(value, int) else 0
+
+def token_usage(response) -> tuple[int, int]:
+    """Returns (input_tokens, output_tokens) from an OpenAI or Gemini response, 0 where unreported."""
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        # Chat completions report prompt/completion tokens; the images API reports input/output tokens.
+        input_tokens = _tokens(getattr(usage, "prompt_tokens", None)) or _tokens(getattr(usage, "input_tokens", None))
+        output_tokens = _tokens(getattr(usage, "completion_tokens", None)) or _tokens(getattr(usage, "output_tokens", None))
+        return input_tokens, output_tokens
+    metadata = getattr(response, "usage_metadata", None)
+    if metadata is not None:
+        return _tokens(getattr(metadata, "prompt_token_count", None)), _tokens(getattr(metadata, "candidates_token_count", None))
+    return 0, 0
+
+def _labels(labels: dict) -> str:
+    return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+class Tracer:
+    """Collects stage latency histograms and token/image/cost counters for the whole process."""
+
+    def __init__(self, prices: Optional[dict[str, dict[str, float]]] = None):
+        self.prices = {model: dict(price) for model, price in (prices or PRICES).items()}
+        self._histograms: dict[tuple[str, str], Histogram] = {}
+        self._tokens: dict[tuple[str, str], int] = {}
+        self._images: dict[str, int] = {}
+        self._cost: dict[str, float] = {}
+        self._results = {True: 0, False: 0}
+        self._lock = threading.Lock()
+
+    def set_prices(self, prices: dict[str, dict[str, float]]):
+        """Overrides or adds per-model prices ({"model": {"input": ..., "output": ..., "image": ...}})."""
+        with self._lock:
+            for model, price in prices.items():
+                self.prices.setdefault(model, {}).update(price)
+
+    @contextmanager
+    def step(self, details: dict) -> Iterator[StepTrace]:
+        """Traces one evaluation step, adding its timings, usage and cost to details on exit."""
+        trace = StepTrace()
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            _current_trace.reset(token)
+            details.update(trace.to_dict())
+
+    @contextmanager
+    def span(self, stage: str, provider: str = "") -> Iterator[None]:
+        """Times the block into the stage histogram and the current step."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started, provider)
+
+    def observe(self, stage: str, seconds: float, provider: str = ""):
+        with self._lock:
+            histogram = self._histograms.get((stage, provider))
+            if histogram is None:
+                histogram = self._histograms[(stage, provider)] = Histogram()
+            histogram.observe(seconds)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_time(stage, seconds)
+
+    def usage(self, model: str, input_tokens: int = 0, output_tokens: int = 0, images: int = 0) -> float:
+        """Records what a provider call consumed and returns its cost in USD (0 for unpriced models)."""
+        price = self.prices.get(model, {})
+        cost = (
+            input_tokens * price.get("input", 0.0) / 1_000_000
+            + output_tokens * price.get("output", 0.0) / 1_000_000
+            + images * price.get("image", 0.0)
+        )
+        with self._lock:
+            for direction, n in (("input", input_tokens), ("output", output_tokens)):
+                self._tokens[(model, direction)] = self._tokens.get((model, direction), 0) + n
+            self._images[model] = self._images.get(model, 0) + images
+            self._cost[model] = self._cost.get(model, 0.0) + cost
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_usage(input_tokens, output_tokens, images, cost)
+        return cost
+
+    def result(self, match: bool):
+        """Counts a finished evaluation, for cost per correct image."""
+        with self._lock:
+            self._results[bool(match)] += 1
+
+    def to_json(self) -> dict:
+        with self._lock:
+            total_cost = sum(self._cost.values())
+            return {
+                "stages": [
+                    {"stage": stage, "provider": provider, **histogram.to_dict()}
+                    for (stage, provider), histogram in sorted(self._histograms.items())
+                ],
+                "models": [
+                    {
+                        "model": model,
+                        "input_tokens": self._tokens.get((model, "input"), 0),
+                        "output_tokens": self._tokens.get((model, "output"), 0),
+                        "images": self._images.get(model, 0),
+                        "cost_usd": round(cost, 6),
+                    }
+                    for model, cost in sorted(self._cost.items())
+                ],
+                "results": {"matched": self._results[True], "unmatched": self._results[False]},
+                "cost_usd": round(total_cost, 6),
+                "cost_per_correct_image_usd": round(total_cost / self._results[True], 6) if self._results[True] else None,
+            }
+
+    def to_prometheus(self) -> str:
+        """Renders every metric in the Prometheus text exposition format."""
+        with self._lock:
+            lines = [
+                "# HELP imgcount_stage_seconds Time spent in each pipeline stage and provider call.",
+                "# TYPE imgcount_stage_seconds histogram",
+            ]
+            for (stage, provider), histogram in sorted(self._histograms.items()):
+                labels = _labels({"stage": stage, "provider": provider})
+                cumulative = 0
+                for bound, n in zip(list(histogram.buckets) + ["+Inf"], histogram.counts):
+                    cumulative += n
+                    lines.append(f'imgcount_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"imgcount_stage_seconds_sum{{{labels}}} {histogram.sum}")
+                lines.append(f"imgcount_stage_seconds_count{{{labels}}} {histogram.count}")
+
+            lines += ["# HELP imgcount_tokens_total Tokens consumed per model.", "# TYPE imgcount_tokens_total counter"]
+            for (model, direction), n in sorted(self._tokens.items()):
+                lines.append(f"imgcount_tokens_total{{{_labels({'model': model, 'direction': direction})}}} {n}")
+            lines += ["# HELP imgcount_images_total Images produced per model.", "# TYPE imgcount_images_total counter"]
+            for model, n in sorted(self._images.items()):
+                lines.append(f"imgcount_images_total{{{_labels({'model': model})}}} {n}")
+            lines += ["# HELP imgcount_cost_usd_total Estimated spend per model in USD.", "# TYPE imgcount_cost_usd_total counter"]
+            for model, cost in sorted(self._cost.items()):
+                lines.append(f"imgcount_cost_usd_total{{{_labels({'model': model})}}} {cost}")
+            lines += ["# HELP imgcount_results_total Finished evaluations by outcome.", "# TYPE imgcount_results_total counter"]
+            for match, n in self._results.items():
+                lines.append(f'imgcount_results_total{{match="{str(match).lower()}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path: str):
+        self._write(path, json.dumps(self.to_json(), indent=2))
+
+    def write_prometheus(self, path: str):
+        """Writes a textfile for the node_exporter textfile collector."""
+        self._write(path, self.to_prometheus())
+
+    @staticmethod
+    def _write(path: str, text: str):
+        # Write then rename so a scraper never reads a half-written file.
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._tokens.clear()
+            self._images.clear()
+            self._cost.clear()
+            self._results = {True: 0, False: 0}
+
+# Shared by every provider, the limiters and the evaluation loop.
+tracer = Tracer()
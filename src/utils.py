@@ -1,12 +1,164 @@
 import os
-import uuid
-from datetime import datetime
+import re
+import json
+import sys
+import importlib
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from contextvars import ContextVar
+from types import ModuleType
+from typing import Iterator, Optional
+from .store import ContentStore, ImageStore, timestamped_name
+from .tracing import tracer
 
-def get_output_path(prefix: str, extension: str = "png", output_dir: str = "output") -> str:
-    """Generates a unique file path with timestamp and UUID."""
-    os.makedirs(output_dir, exist_ok=True)
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    unique_id = str(uuid.uuid4())[:8]
-    filename = f"{prefix}_{timestamp}_{unique_id}.{extension}"
-    return os.path.join(output_dir, filename)
+class LazyModule(ModuleType):
+    """Stands in for a module and imports it on first attribute access, keeping heavy SDKs off the startup path."""
 
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._module: Optional[ModuleType] = None
+
+    def __getattr__(self, attr: str):
+        # Only called for attributes not set on the proxy itself.
+        if self._module is None:
+            self._module = importlib.import_module(self.__name__)
+        return getattr(self._module, attr)
+
+def lazy_module(name: str) -> ModuleType:
+    """Returns the module if it is already imported, otherwise a LazyModule for it.
+
+    Provider modules bind their SDKs through this, so loading one does not pay for providers that are never called.
+    """
+    return sys.modules.get(name) or LazyModule(name)
+
+_image_labels: ContextVar[dict] = ContextVar("image_labels", default={})
+
+@contextmanager
+def image_labels(**labels) -> Iterator[None]:
+    """Labels images saved inside the block (prompt, model, case, step) in the image store index."""
+    token = _image_labels.set({**_image_labels.get(), **labels})
+    try:
+        yield
+    finally:
+        _image_labels.reset(token)
+
+class ImageWriter:
+    """Persists image bytes to disk on a background thread so the pipeline never waits on file I/O.
+
+    Where the bytes go is up to the store; by default a content-addressed ContentStore under ./output.
+    """
+
+    def __init__(self, enabled: bool = True, max_workers: int = 2, store: Optional[ImageStore] = None):
+        self.enabled = enabled
+        self.store = store or ContentStore()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-writer")
+        self._pending: set[Future] = set()
+        self._lock = threading.Lock()
+
+    def save(self, prefix: str, data: bytes, extension: str = "png", **labels) -> str:
+        """Reserves an output path for the image and schedules the write. Returns the path immediately.
+
+        Labels given here override the ones set with image_labels().
+        """
+        if not self.enabled:
+            # Nothing reaches disk, so do not touch the store either.
+            return os.path.join(getattr(self.store, "root", "output"), timestamped_name(prefix, extension))
+        path, write = self.store.place(prefix, data, extension)
+        future = self._executor.submit(self._write, path, data if write else None, prefix, len(data), {**_image_labels.get(), **labels})
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+        return path
+
+    def flush(self):
+        """Blocks until every scheduled write has finished, re-raising the first failure."""
+        with self._lock:
+            pending = list(self._pending)
+        for future in wait(pending).done:
+            future.result()
+
+    def _done(self, future: Future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def _write(self, path: str, data: Optional[bytes], prefix: str, size: int, labels: dict):
+        # data is None when the store already holds these bytes; only the index is updated.
+        if data is not None:
+            # Write then rename so a reader never sees a partially written image.
+            started = time.perf_counter()
+            tmp_path = f"{path}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                self.store.abandon(path)
+                raise
+            # Runs on the writer thread, outside any step, so it only feeds the histogram.
+            tracer.observe("disk_write", time.perf_counter() - started)
+        self.store.commit(path, prefix, size, labels)
+
+image_writer = ImageWriter()
+
+_current_step: ContextVar[Optional[dict]] = ContextVar("current_step", default=None)
+
+@contextmanager
+def step_details() -> Iterator[dict]:
+    """Collects extra fields that providers record for the evaluation step running inside the block.
+
+    On exit the step's timings, token/image usage and cost collected by tracing.tracer are added too.
+    """
+    details: dict = {}
+    token = _current_step.set(details)
+    try:
+        with tracer.step(details):
+            yield details
+    finally:
+        _current_step.reset(token)
+
+def record_step(**fields):
+    """Adds fields to the current evaluation step, if there is one."""
+    details = _current_step.get()
+    if details is not None:
+        details.update(fields)
+
+# The count field of a structured {"count": N} answer, once the number is terminated.
+_COUNT_FIELD = re.compile(r'"count"\s*:\s*(\d+)\s*[,}]')
+
+class CountStream:
+    """Accumulates a streamed analyzer answer and reports the count as soon as {"count": N} is complete."""
+
+    def __init__(self):
+        self.text = ""
+        self.chunks = 0
+
+    def feed(self, text: str) -> Optional[int]:
+        """Adds a chunk of text. Returns the count once it can no longer change, else None."""
+        self.text += text
+        self.chunks += 1
+        match = _COUNT_FIELD.search(self.text)
+        return int(match.group(1)) if match else None
+
+    def result(self) -> int:
+        """The count from the whole answer, for streams that ended without a complete count field."""
+        return parse_count(self.text)
+
+def parse_count(content: str) -> int:
+    """Extracts an object count from a VLM response, or -1 if none is found."""
+    # Check for JSON block
+    json_match = re.search(r'\{.*\}', content, re.DOTALL)
+    if json_match:
+        try:
+            data = json.loads(json_match.group(0))
+            if 'count' in data:
+                return int(data['count'])
+        except:
+            pass
+
+    # Fallback to simple number extraction
+    numbers = re.findall(r'\d+', content)
+    if numbers:
+        return int(numbers[0])
+    return -1 # Error code
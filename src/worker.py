@@ -0,0 +1,115 @@
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import asdict
+from typing import Iterable, Iterator, Optional
+from .batch import BatchCase, BatchRunner
+from .jobqueue import Job, JobQueue, QueueSlots
+from .ratelimit import limiters
+
+logger = logging.getLogger(__name__)
+
+def enqueue_cases(queue: JobQueue, cases: Iterable[BatchCase]) -> int:
+    """Adds cases to the queue keyed by BatchCase.key(), so enqueueing a suite twice adds nothing."""
+    return queue.enqueue([(case.key(), asdict(case)) for case in cases])
+
+class Worker:
+    """Pulls cases from a shared JobQueue and runs them on a BatchRunner until the queue is drained.
+
+    Up to the runner's total stage concurrency cases run at once. A heartbeat thread renews their
+    leases and the worker's global limiter slots; a case whose lease was lost (the worker stalled
+    past lease_seconds) is left to whoever claimed it next. Errored results are handed back with
+    fail() and retried until the queue's max_attempts.
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        runner: BatchRunner,
+        worker_id: Optional[str] = None,
+        heartbeat_interval: Optional[float] = None,
+        poll_interval: float = 1.0,
+    ):
+        self.queue = queue
+        self.runner = runner
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.heartbeat_interval = heartbeat_interval or queue.lease_seconds / 3
+        self.poll_interval = poll_interval
+        self.completed = 0
+        self.lost = 0
+        self.retried = 0
+        self._jobs: dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def use_global_limits(self):
+        """Routes global_max_inflight limiter settings through this worker's queue."""
+        limiters.use_slots(QueueSlots(self.queue, self.worker_id))
+
+    def run(self) -> Iterator[dict]:
+        """Runs claimed cases and yields each final result the queue accepted; attempts that will be retried are not yielded."""
+        slots = self.runner.generate_concurrency + self.runner.analyze_concurrency + self.runner.edit_concurrency
+        heartbeat = threading.Thread(target=self._heartbeat, name=f"heartbeat-{self.worker_id}", daemon=True)
+        heartbeat.start()
+        try:
+            with ThreadPoolExecutor(max_workers=slots) as executor:
+                running = {}
+                while True:
+                    while len(running) < slots:
+                        job = self.queue.claim(self.worker_id)
+                        if job is None:
+                            break
+                        with self._lock:
+                            self._jobs[job.id] = job
+                        running[executor.submit(self.runner.run_case, BatchCase(**job.payload))] = job
+                    if not running:
+                        if self._drained():
+                            return
+                        # Other workers hold leases that may still expire and come back.
+                        time.sleep(self.poll_interval)
+                        continue
+                    done, _ = wait(running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        job = running.pop(future)
+                        result = self._finish(job, future.result())
+                        if result is not None:
+                            yield result
+        finally:
+            self._stopped.set()
+            heartbeat.join()
+
+    def _drained(self) -> bool:
+        stats = self.queue.stats()
+        return stats["queued"] == 0 and stats["leased"] == 0
+
+    def _finish(self, job: Job, result: dict) -> Optional[dict]:
+        with self._lock:
+            self._jobs.pop(job.id, None)
+        result["attempt"] = job.attempts
+        if "error" in result:
+            accepted = self.queue.fail(job, result["error"], result)
+        else:
+            accepted = self.queue.complete(job, result)
+        if not accepted:
+            self.lost += 1
+            logger.warning(f"Lease on case {result.get('case_id')} expired before it finished; dropping this worker's result")
+            return None
+        if "error" in result and job.attempts < self.queue.max_attempts:
+            # Back in the queue for another attempt; only the final outcome is reported.
+            self.retried += 1
+            logger.info(f"Case {result.get('case_id')} failed on attempt {job.attempts}, requeued: {result['error']}")
+            return None
+        self.completed += 1
+        return result
+
+    def _heartbeat(self):
+        while not self._stopped.wait(self.heartbeat_interval):
+            with self._lock:
+                jobs = list(self._jobs.values())
+            for job in jobs:
+                if not self.queue.heartbeat(job):
+                    logger.warning(f"Lost the lease on job {job.id}")
+            self.queue.refresh_slots(self.worker_id)
@@ -0,0 +1,147 @@
+import asyncio
+import os
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+from src.analyzers import EnsembleAnalyzer, GeminiAnalyzer, QwenAnalyzer
+from src.evaluator import EvaluationLoop
+from src.models import ImageResult
+from src.ratelimit import RateLimitError
+from src.utils import CountStream
+
+def _analyzer(model, count, delay=0.0):
+    analyzer = MagicMock()
+    analyzer.model = model
+
+    def analyze(image, prompt):
+        time.sleep(delay)
+        return count
+
+    async def aanalyze(image, prompt):
+        await asyncio.sleep(delay)
+        return count
+
+    analyzer.analyze.side_effect = analyze
+    analyzer.aanalyze = AsyncMock(side_effect=aanalyze)
+    return analyzer
+
+class TestEnsembleAnalyzer(unittest.TestCase):
+    def setUp(self):
+        self.image = ImageResult(image_path="test.png", metadata={}, data=b"png")
+
+    def test_quorum_returns_without_waiting_for_stragglers(self):
+        ensemble = EnsembleAnalyzer([_analyzer("a", 3), _analyzer("b", 3), _analyzer("c", 5, delay=10)])
+
+        started = time.monotonic()
+        self.assertEqual(asyncio.run(ensemble.aanalyze(self.image, "count")), 3)
+        self.assertLess(time.monotonic() - started, 5)
+
+    def test_plurality_without_quorum(self):
+        ensemble = EnsembleAnalyzer([_analyzer("a", 3), _analyzer("b", 4, delay=0.01), _analyzer("c", -1)], quorum=2)
+        self.assertEqual(ensemble.analyze(self.image, "count"), 3)
+
+    def test_quorum_must_be_reachable(self):
+        members = [_analyzer("a", 3), _analyzer("b", 3)]
+        for quorum in (0, 3):
+            with self.assertRaises(ValueError):
+                EnsembleAnalyzer(members, quorum=quorum)
+        self.assertEqual(EnsembleAnalyzer(members, quorum=1).quorum, 1)
+
+    def test_votes_are_recorded_on_the_step(self):
+        generator = MagicMock()
+        generator.generate.return_value = self.image
+        ensemble = EnsembleAnalyzer([_analyzer("a", 3), _analyzer("b", 3, delay=0.01), _analyzer("c", 4, delay=0.02)], quorum=3)
+
+        result = EvaluationLoop(generator, ensemble).run("3 apples", 3)
+        step = result['steps'][0]
+
+        self.assertEqual(step['count'], 3)
+        self.assertEqual([vote['analyzer'] for vote in step['votes']], ["a", "b", "c"])
+        self.assertAlmostEqual(step['agreement'], 2 / 3)
+        self.assertFalse(step['quorum_reached'])
+
+    def test_all_members_throttled_raises(self):
+        throttled = MagicMock()
+        throttled.model = "throttled"
+        throttled.analyze.side_effect = RateLimitError("throttled")
+        ensemble = EnsembleAnalyzer([throttled, throttled])
+
+        with self.assertRaises(RateLimitError):
+            ensemble.analyze(self.image, "count")
+
+class _Stream:
+    """Stands in for an SDK stream, recording how much of it was read and whether it was closed."""
+
+    def __init__(self, pieces):
+        self.chunks = [SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))]) for piece in pieces]
+        self.read = 0
+        self.closed = False
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.read += 1
+            yield chunk
+
+    async def __aiter__(self):
+        for chunk in self:
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+    async def aclose(self):
+        self.closed = True
+
+class TestStructuredAnalysis(unittest.TestCase):
+    def setUp(self):
+        self.image = ImageResult(image_path="test.png", metadata={}, data=b"\x89PNG\r\n\x1a\npng")
+
+    def test_count_stream_waits_for_a_terminated_number(self):
+        parser = CountStream()
+        self.assertEqual([parser.feed(piece) for piece in ['{"cou', 'nt": 1', '2', ' }']], [None, None, None, 12])
+        self.assertEqual(CountStream().feed('There are 3 rows, so {"count": 9}'), 9)
+
+        unfinished = CountStream()
+        unfinished.feed('{"count": 7')
+        self.assertEqual(unfinished.result(), 7)
+
+    @patch.dict(os.environ, {"OPENROUTER_API_KEY": "test-key"})
+    def test_qwen_stops_streaming_once_count_is_parsed(self):
+        stream = _Stream(['{"count"', ': 4', '}', ' and then a long explanation', '...'])
+        analyzer = QwenAnalyzer(structured=True)
+        analyzer.client = MagicMock()
+        analyzer.client.chat.completions.create.return_value = stream
+
+        self.assertEqual(analyzer.analyze(self.image, "count"), 4)
+        self.assertEqual(stream.read, 3)
+        self.assertTrue(stream.closed)
+        arguments = analyzer.client.chat.completions.create.call_args.kwargs
+        self.assertTrue(arguments["stream"])
+        self.assertEqual(arguments["response_format"]["json_schema"]["schema"]["required"], ["count"])
+
+    @patch.dict(os.environ, {"OPENROUTER_API_KEY": "test-key"})
+    def test_qwen_async_stream(self):
+        stream = _Stream(['{"count": 2}', 'ignored'])
+        stream.close = AsyncMock()
+        analyzer = QwenAnalyzer(structured=True)
+        analyzer.async_client = MagicMock()
+        analyzer.async_client.chat.completions.create = AsyncMock(return_value=stream)
+
+        self.assertEqual(asyncio.run(analyzer.aanalyze(self.image, "count")), 2)
+        self.assertEqual(stream.read, 1)
+        stream.close.assert_awaited_once()
+
+    def test_gemini_stream_falls_back_to_full_text(self):
+        pieces = ["Sorry, ", "I count 6"]
+        chunks = [SimpleNamespace(text=piece, usage_metadata=None) for piece in pieces]
+        analyzer = GeminiAnalyzer(structured=True)
+        analyzer.client = MagicMock()
+        analyzer.client.models.generate_content_stream.return_value = (chunk for chunk in chunks)
+
+        self.assertEqual(analyzer.analyze(self.image, "count"), 6)
+        config = analyzer.client.models.generate_content_stream.call_args.kwargs["config"]
+        self.assertEqual(config.response_mime_type, "application/json")
+
+if __name__ == '__main__':
+    unittest.main()
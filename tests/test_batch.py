@@ -0,0 +1,96 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+from src.models import ImageResult
+from src.batch import BatchCase, BatchRunner, load_suite
+from src.cache import AnalysisCache, CachedAnalyzer
+
+class TestBatchRunner(unittest.TestCase):
+    def setUp(self):
+        self.mock_generator = MagicMock()
+        self.mock_analyzer = MagicMock()
+        self.mock_generator.generate.return_value = ImageResult(image_path="test.png", metadata={})
+        self.mock_analyzer.analyze.return_value = 3
+
+    def test_load_suite_jsonl(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "suite.jsonl")
+            with open(path, "w") as f:
+                f.write(json.dumps({"id": "a", "prompt": "3 apples", "count": 3}) + "\n")
+                f.write(json.dumps({"prompt": "5 cats", "count": "5", "object": "cats", "mode": "loop"}) + "\n")
+            cases = load_suite(path)
+
+        self.assertEqual(cases[0], BatchCase("a", "3 apples", 3))
+        self.assertEqual(cases[1], BatchCase("1", "5 cats", 5, "cats", "loop"))
+
+    def test_stage_concurrency_limit(self):
+        active = 0
+        peak = 0
+        lock = threading.Lock()
+
+        def slow_generate(prompt):
+            nonlocal active, peak
+            with lock:
+                active += 1
+                peak = max(peak, active)
+            time.sleep(0.02)
+            with lock:
+                active -= 1
+            return ImageResult(image_path="test.png", metadata={})
+
+        self.mock_generator.generate.side_effect = slow_generate
+        runner = BatchRunner(self.mock_generator, self.mock_analyzer, generate_concurrency=2, analyze_concurrency=4)
+        cases = [BatchCase(str(i), "3 apples", 3) for i in range(8)]
+        results = list(runner.run(cases))
+
+        self.assertEqual(len(results), 8)
+        self.assertEqual(sorted(r["case_id"] for r in results), sorted(c.case_id for c in cases))
+        self.assertTrue(all(r["match"] for r in results))
+        self.assertEqual(peak, 2)
+
+    def test_stopping_early_starts_no_more_cases(self):
+        def slow_generate(prompt):
+            time.sleep(0.01)
+            return ImageResult(image_path="test.png", metadata={})
+
+        self.mock_generator.generate.side_effect = slow_generate
+        runner = BatchRunner(self.mock_generator, self.mock_analyzer, generate_concurrency=1, analyze_concurrency=1, edit_concurrency=1)
+        results = runner.run([BatchCase(str(i), "3 apples", 3) for i in range(40)])
+        next(results)
+        results.close()
+
+        # Only the window of cases in flight when the consumer stopped was run.
+        self.assertLessEqual(self.mock_generator.generate.call_count, 4)
+
+    def test_cache_hits_skip_the_analyze_limit(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            image_path = os.path.join(tmp, "test.png")
+            with open(image_path, "wb") as f:
+                f.write(b"image-bytes")
+            self.mock_analyzer.model = "test-vlm"
+            cache = AnalysisCache(os.path.join(tmp, "cache.sqlite"))
+            runner = BatchRunner(self.mock_generator, CachedAnalyzer(self.mock_analyzer, cache), analyze_concurrency=1)
+            analyzer = runner.loop.analyzer
+            self.assertEqual(analyzer.analyze(image_path, "count apples"), 3)
+
+            # With the only analyze slot taken, a hit still returns at once.
+            analyzer.analyzer.limit.sync.acquire()
+            self.assertEqual(analyzer.analyze(image_path, "count apples"), 3)
+            self.mock_analyzer.analyze.assert_called_once()
+            cache.close()
+
+    def test_failed_case_is_reported(self):
+        self.mock_generator.generate.side_effect = RuntimeError("boom")
+        runner = BatchRunner(self.mock_generator, self.mock_analyzer)
+        results = list(runner.run([BatchCase("x", "3 apples", 3)]))
+
+        self.assertEqual(results[0]["case_id"], "x")
+        self.assertFalse(results[0]["match"])
+        self.assertIn("boom", results[0]["error"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import asyncio
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+from src.analyzers import EnsembleAnalyzer, QwenAnalyzer
+from src.cache import AnalysisCache, CachedAnalyzer
+from src.preprocess import ImagePreprocessor
+
+class TestAnalysisCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.image_path = os.path.join(self.tmp.name, "test.png")
+        with open(self.image_path, "wb") as f:
+            f.write(b"image-bytes")
+        self.mock_analyzer = MagicMock()
+        self.mock_analyzer.model = "test-vlm"
+        self.mock_analyzer.analyze.return_value = 3
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def cache(self, **kwargs):
+        return AnalysisCache(os.path.join(self.tmp.name, "cache.sqlite"), **kwargs)
+
+    def test_repeat_analysis_is_served_from_cache(self):
+        analyzer = CachedAnalyzer(self.mock_analyzer, self.cache())
+        self.assertEqual(analyzer.analyze(self.image_path, "count apples"), 3)
+        self.assertEqual(analyzer.analyze(self.image_path, "count apples"), 3)
+        self.assertEqual(analyzer.analyze(self.image_path, "count pears"), 3)
+
+        self.assertEqual(self.mock_analyzer.analyze.call_count, 2)
+        self.assertEqual(analyzer.cache.stats()["hits"], 1)
+        self.assertEqual(analyzer.cache.stats()["misses"], 2)
+
+    def test_cache_persists_across_instances(self):
+        CachedAnalyzer(self.mock_analyzer, self.cache()).analyze(self.image_path, "count apples")
+        analyzer = CachedAnalyzer(self.mock_analyzer, self.cache())
+        analyzer.analyze(self.image_path, "count apples")
+
+        self.mock_analyzer.analyze.assert_called_once()
+
+    def test_failures_are_not_cached(self):
+        self.mock_analyzer.analyze.side_effect = [-1, 3]
+        analyzer = CachedAnalyzer(self.mock_analyzer, self.cache())
+        analyzer.analyze(self.image_path, "count apples")
+
+        self.assertEqual(analyzer.analyze(self.image_path, "count apples"), 3)
+        self.assertEqual(self.mock_analyzer.analyze.call_count, 2)
+
+    def test_ensemble_preprocessing_is_part_of_the_key(self):
+        def ensemble(preprocessor):
+            members = [MagicMock(model=name, preprocessor=preprocessor, structured=False) for name in ("a", "b")]
+            return CachedAnalyzer(EnsembleAnalyzer(members), self.cache())
+
+        full, downscaled = ensemble(ImagePreprocessor()), ensemble(ImagePreprocessor(max_dimension=512))
+        self.assertEqual(full.cache_model, "ensemble(a,b)")
+        self.assertNotEqual(downscaled.cache_model, full.cache_model)
+        self.assertNotEqual(downscaled._key(self.image_path, "count apples"), full._key(self.image_path, "count apples"))
+
+    def test_structured_answers_are_part_of_the_key(self):
+        free_text, structured = (CachedAnalyzer(QwenAnalyzer(structured=flag), self.cache()) for flag in (False, True))
+        self.assertEqual(free_text.cache_model, free_text.model)
+        self.assertEqual(structured.cache_model, f"{structured.model}@structured")
+        self.assertNotEqual(structured._key(self.image_path, "count apples"), free_text._key(self.image_path, "count apples"))
+
+    def test_async_lookups_run_off_the_event_loop(self):
+        self.mock_analyzer.aanalyze = AsyncMock(return_value=3)
+        cache = self.cache()
+        threads = []
+        get, put = cache.get, cache.put
+        cache.get = lambda *args: (threads.append(threading.get_ident()), get(*args))[1]
+        cache.put = lambda *args: (threads.append(threading.get_ident()), put(*args))[1]
+        analyzer = CachedAnalyzer(self.mock_analyzer, cache)
+
+        async def analyze_twice():
+            counts = [await analyzer.aanalyze(self.image_path, "count apples") for _ in range(2)]
+            return threading.get_ident(), counts
+
+        loop_thread, counts = asyncio.run(analyze_twice())
+        self.assertEqual(counts, [3, 3])
+        self.mock_analyzer.aanalyze.assert_awaited_once()
+        self.assertEqual(len(threads), 3)
+        self.assertNotIn(loop_thread, threads)
+
+    def test_bypass_and_eviction(self):
+        cache = self.cache(max_entries=2, bypass=True)
+        for i in range(3):
+            cache.put(f"key{i}", i, "test-vlm")
+
+        self.assertIsNone(cache.get("key2"))
+        cache.bypass = False
+        self.assertIsNone(cache.get("key0"))
+        self.assertEqual(cache.get("key2"), 2)
+        self.assertEqual(cache.stats()["entries"], 2)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+if __name__ == '__main__':
+    unittest.main()
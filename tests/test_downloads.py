@@ -0,0 +1,47 @@
+import os
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from src.downloads import Downloader
+
+IMAGE = os.urandom(200 * 1024)
+
+class _ImageHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(IMAGE)))
+        self.end_headers()
+        self.wfile.write(IMAGE)
+
+    def log_message(self, *args):
+        pass
+
+class TestDownloader(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), _ImageHandler)
+        cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}/image.png"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_fetch(self):
+        downloader = Downloader(chunk_size=16 * 1024)
+        self.assertEqual(downloader.fetch(self.url), IMAGE)
+        self.assertEqual(downloader.fetch(self.url), IMAGE)
+        downloader.close()
+
+    def test_oversized_body_is_rejected(self):
+        downloader = Downloader(max_bytes=1024)
+        with self.assertRaises(ValueError):
+            downloader.fetch(self.url)
+        downloader.close()
+
+if __name__ == '__main__':
+    unittest.main()
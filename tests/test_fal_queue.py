@@ -0,0 +1,140 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+from src.editors import FalEditor
+from src.generators import FalGenerator
+from src.models import ImageResult
+
+class _Completed:
+    pass
+
+class _Queued:
+    pass
+
+class _Handle:
+    """Fake Fal request handle that completes after a number of status polls."""
+
+    def __init__(self, name: str, polls: int):
+        self.request_id = name
+        self.polls = polls
+        self.cancelled = False
+
+    def status(self):
+        self.polls -= 1
+        return _Completed() if self.polls <= 0 else _Queued()
+
+    def get(self):
+        return {"images": [{"url": f"https://fal.media/{self.request_id}.png"}]}
+
+    def cancel(self):
+        self.cancelled = True
+
+class _AsyncHandle(_Handle):
+    async def status(self):
+        return super().status()
+
+    async def get(self):
+        return super().get()
+
+    async def cancel(self):
+        super().cancel()
+
+def _fal(handles: dict) -> MagicMock:
+    fal = MagicMock()
+    fal.Completed = _Completed
+    fal.submit.side_effect = lambda model_id, arguments: handles[arguments["prompt"]]
+
+    async def submit_async(model_id, arguments):
+        return handles[arguments["prompt"]]
+    fal.submit_async.side_effect = submit_async
+    return fal
+
+@patch("src.generators.image_writer")
+@patch("src.generators.downloader")
+class TestFalBatch(unittest.TestCase):
+    def test_results_arrive_in_completion_order(self, mock_downloader, mock_writer):
+        handles = {"slow": _Handle("slow", 10), "fast": _Handle("fast", 1), "middle": _Handle("middle", 5)}
+        mock_downloader.fetch.side_effect = lambda url: url.encode()
+        with patch("src.fal_queue.fal_client", _fal(handles)) as fal:
+            results = list(FalGenerator().generate_many(["slow", "fast", "middle"], poll_interval=0.01))
+
+        # Every prompt is submitted before any result is fetched.
+        self.assertEqual(fal.submit.call_count, 3)
+        self.assertEqual([index for index, _ in results], [1, 2, 0])
+        self.assertEqual(results[0][1].metadata["url"], "https://fal.media/fast.png")
+
+    def test_stopping_early_cancels_queued_requests(self, mock_downloader, mock_writer):
+        handles = {"fast": _Handle("fast", 1), "queued": _Handle("queued", 10**9)}
+        mock_downloader.fetch.return_value = b"image"
+        with patch("src.fal_queue.fal_client", _fal(handles)):
+            results = FalGenerator().generate_many(["fast", "queued"], poll_interval=0)
+            self.assertEqual(next(results)[0], 0)
+            results.close()
+
+        self.assertTrue(handles["queued"].cancelled)
+        self.assertFalse(handles["fast"].cancelled)
+
+    def test_statuses_are_polled_concurrently(self, mock_downloader, mock_writer):
+        class SlowHandle(_Handle):
+            def status(self):
+                time.sleep(0.05)
+                return super().status()
+
+        prompts = [str(i) for i in range(8)]
+        handles = {prompt: SlowHandle(prompt, 1) for prompt in prompts}
+        mock_downloader.fetch.return_value = b"image"
+        with patch("src.fal_queue.fal_client", _fal(handles)):
+            started = time.monotonic()
+            results = list(FalGenerator().generate_many(prompts, poll_interval=0))
+
+        # One round trip per request in turn would take 0.4s.
+        self.assertEqual(sorted(index for index, _ in results), list(range(8)))
+        self.assertLess(time.monotonic() - started, 0.3)
+
+    def test_failures_are_reported_per_request(self, mock_downloader, mock_writer):
+        handles = {"ok": _Handle("ok", 1)}
+        mock_downloader.fetch.return_value = b"image"
+        with patch("src.fal_queue.fal_client", _fal(handles)):
+            results = dict(FalGenerator().generate_many(["missing", "ok"], poll_interval=0))
+
+        self.assertIsInstance(results[0], RuntimeError)
+        self.assertIsInstance(results[1], ImageResult)
+
+    def test_async_batch(self, mock_downloader, mock_writer):
+        handles = {"slow": _AsyncHandle("slow", 50), "fast": _AsyncHandle("fast", 1), "queued": _AsyncHandle("queued", 10**9)}
+        mock_downloader.fetch.return_value = b"image"
+
+        async def collect():
+            stream = FalGenerator().agenerate_many(["slow", "fast", "queued"], poll_interval=0)
+            results = [await anext(stream), await anext(stream)]
+            await stream.aclose()
+            return results
+
+        with patch("src.fal_queue.fal_client", _fal(handles)):
+            results = asyncio.run(collect())
+
+        self.assertEqual([index for index, _ in results], [1, 0])
+        self.assertTrue(handles["queued"].cancelled)
+
+    @patch("src.editors.image_writer")
+    @patch("src.editors.downloader")
+    @patch("src.editors.fal_client")
+    def test_edits_upload_then_submit(self, mock_editor_fal, mock_editor_downloader, mock_editor_writer, mock_downloader, mock_writer):
+        mock_editor_fal.upload.return_value = "https://fal.media/uploaded.png"
+        mock_editor_downloader.fetch.return_value = b"edited"
+        handles = {"3 apples": _Handle("edit", 1)}
+        edits = [
+            (ImageResult("a.png", {}, b"local"), "3 apples"),
+            (ImageResult("b.png", {"url": "https://fal.media/b.png"}, b"hosted"), "3 apples"),
+        ]
+        with patch("src.fal_queue.fal_client", _fal(handles)) as fal:
+            results = dict(FalEditor().edit_many(edits, poll_interval=0))
+
+        mock_editor_fal.upload.assert_called_once()
+        self.assertEqual([call.kwargs["arguments"]["image_url"] for call in fal.submit.call_args_list],
+                         ["https://fal.media/uploaded.png", "https://fal.media/b.png"])
+        self.assertEqual(sorted(results), [0, 1])
+
+if __name__ == '__main__':
+    unittest.main()
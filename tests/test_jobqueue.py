@@ -0,0 +1,191 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+from src.batch import BatchCase, BatchRunner
+from src.jobqueue import FileJobQueue, QueueSlots, SQLiteJobQueue, _read_json as read_json, open_queue
+from src.ratelimit import ProviderLimiter, RateLimiterRegistry
+from src.stubs import StubGenerator, StubAnalyzer
+from src.utils import image_writer
+from src.worker import Worker, enqueue_cases
+
+class _QueueTests:
+    """Shared by both backends; subclasses set make_queue."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_claim_complete_and_dedup(self):
+        queue = self.make_queue()
+        self.assertEqual(queue.enqueue([("a", {"n": 1}), ("b/c:1", {"n": 2})]), 2)
+        self.assertEqual(queue.enqueue([("a", {"n": 1})]), 0)
+
+        first, second = queue.claim("w1"), queue.claim("w2")
+        self.assertIsNone(queue.claim("w3"))
+        self.assertEqual((first.id, first.payload, first.attempts), ("a", {"n": 1}, 1))
+        self.assertEqual(second.id, "b/c:1")
+
+        self.assertTrue(queue.complete(first, {"case_id": "a", "match": True}))
+        self.assertFalse(queue.complete(first, {"case_id": "a", "match": False}))
+        self.assertEqual(queue.stats(), {"queued": 0, "leased": 1, "done": 1, "failed": 0})
+        self.assertEqual(list(queue.results()), [{"case_id": "a", "match": True}])
+
+    def test_expired_lease_is_retried_then_failed(self):
+        queue = self.make_queue(lease_seconds=0.05, max_attempts=2)
+        queue.enqueue([("a", {})])
+
+        stale = queue.claim("w1")
+        time.sleep(0.1)
+        # The stalled worker lost its lease: it can neither renew nor finish the job.
+        retry = queue.claim("w2")
+        self.assertEqual(retry.attempts, 2)
+        self.assertFalse(queue.heartbeat(stale))
+        self.assertFalse(queue.complete(stale, {"case_id": "a"}))
+        self.assertTrue(queue.heartbeat(retry))
+
+        time.sleep(0.1)
+        self.assertIsNone(queue.claim("w3"))
+        [result] = queue.results()
+        self.assertEqual(result["error"], "lease expired")
+
+    def test_fail_requeues_until_max_attempts(self):
+        queue = self.make_queue(max_attempts=2)
+        queue.enqueue([("a", {})])
+
+        self.assertTrue(queue.fail(queue.claim("w1"), "boom"))
+        self.assertTrue(queue.fail(queue.claim("w1"), "boom again", {"case_id": "a", "match": False, "error": "boom again"}))
+
+        self.assertEqual(queue.stats()["failed"], 1)
+        self.assertEqual([result["error"] for result in queue.results()], ["boom again"])
+
+    def test_slots_cap_and_expire(self):
+        queue = self.make_queue(slot_ttl=0.05)
+        tokens = [queue.try_acquire_slot("fal/model", 2, "w1") for _ in range(3)]
+        self.assertIsNone(tokens[2])
+        queue.release_slot("fal/model", tokens[0])
+        self.assertIsNotNone(queue.try_acquire_slot("fal/model", 2, "w2"))
+
+        # A dead holder's slots are freed after the TTL; live holders keep theirs by refreshing.
+        time.sleep(0.1)
+        queue.refresh_slots("w2")
+        self.assertIsNotNone(queue.try_acquire_slot("fal/model", 2, "w3"))
+        self.assertIsNone(queue.try_acquire_slot("fal/model", 2, "w3"))
+
+    def test_limiters_share_global_cap(self):
+        queue = self.make_queue()
+        registry = RateLimiterRegistry()
+        registry.configure("fal", global_max_inflight=2)
+        # Two "processes": separate limiters with their own local limits, one queue between them.
+        limiters = [ProviderLimiter("fal/model", global_max_inflight=2, global_key="fal", slots=QueueSlots(queue, f"w{i}")) for i in range(2)]
+        registry.use_slots(QueueSlots(queue, "w2"))
+        self.assertEqual(registry.get("fal", "other").global_key, "fal")
+
+        active, peak, lock = [0], [0], threading.Lock()
+
+        def work():
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+
+        threads = [threading.Thread(target=limiters[i % 2].call, args=(work,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(peak[0], 2)
+        self.assertIsNotNone(queue.try_acquire_slot("fal", 2, "w3"))
+
+    def test_workers_drain_queue(self):
+        queue = self.make_queue()
+        cases = [BatchCase(str(i), f"{i % 4 + 1} apples", i % 4 + 1) for i in range(12)]
+        self.assertEqual(enqueue_cases(queue, cases), 12)
+        self.assertEqual(enqueue_cases(queue, cases), 0)
+        cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        try:
+            workers = [
+                Worker(queue, BatchRunner(StubGenerator(accuracy=1.0, seed=i), StubAnalyzer(accuracy=1.0, seed=i), None,
+                                          generate_concurrency=1, analyze_concurrency=1, edit_concurrency=1), f"w{i}", poll_interval=0.05)
+                for i in range(2)
+            ]
+            outputs = [[], []]
+            threads = [threading.Thread(target=lambda i=i: outputs[i].extend(workers[i].run())) for i in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            image_writer.flush()
+        finally:
+            os.chdir(cwd)
+
+        self.assertEqual(sorted(result["case_id"] for output in outputs for result in output), sorted(case.case_id for case in cases))
+        self.assertEqual(queue.stats()["done"], 12)
+        self.assertTrue(all(result["match"] for result in queue.results()))
+
+    def test_worker_yields_only_final_outcomes(self):
+        queue = self.make_queue(max_attempts=3)
+        enqueue_cases(queue, [BatchCase("flaky", "3 apples", 3), BatchCase("broken", "4 apples", 4)])
+        runner = BatchRunner(StubGenerator(), StubAnalyzer(), None, generate_concurrency=1, analyze_concurrency=1, edit_concurrency=1)
+        attempts = {"flaky": 0, "broken": 0}
+
+        def run_case(case):
+            attempts[case.case_id] += 1
+            if case.case_id == "broken" or attempts["flaky"] == 1:
+                return {"case_id": case.case_id, "error": "boom", "match": False}
+            return {"case_id": case.case_id, "match": True}
+
+        runner.run_case = run_case
+        worker = Worker(queue, runner, "w1", poll_interval=0.01)
+        results = list(worker.run())
+
+        self.assertEqual(attempts, {"flaky": 2, "broken": 3})
+        self.assertEqual(sorted((result["case_id"], result["attempt"]) for result in results), [("broken", 3), ("flaky", 2)])
+        self.assertEqual((worker.completed, worker.retried), (2, 3))
+
+class TestSQLiteJobQueue(_QueueTests, unittest.TestCase):
+    def make_queue(self, **options):
+        return SQLiteJobQueue(os.path.join(self.tmp.name, "queue.sqlite"), **options)
+
+class TestFileJobQueue(_QueueTests, unittest.TestCase):
+    def make_queue(self, **options):
+        return FileJobQueue(os.path.join(self.tmp.name, "queue"), **options)
+
+    def test_finish_loses_to_a_reclaim(self):
+        queue = self.make_queue(lease_seconds=0.05)
+        queue.enqueue([("a", {})])
+        stale = queue.claim("w1")
+        stalled, claimed = threading.Event(), []
+
+        def stall_then_read(path):
+            if path.endswith(".finishing") and not stalled.is_set():
+                # The worker stalls mid-finish until its lease expires and another worker reclaims the job.
+                stalled.set()
+                time.sleep(0.1)
+                claimed.append(queue.claim("w2"))
+            return read_json(path)
+
+        with patch("src.jobqueue._read_json", stall_then_read):
+            self.assertFalse(queue.complete(stale, {"case_id": "a"}))
+
+        self.assertEqual(claimed[0].attempts, 2)
+        self.assertEqual(queue.stats(), {"queued": 0, "leased": 1, "done": 0, "failed": 0})
+        self.assertTrue(queue.complete(claimed[0], {"case_id": "a", "match": True}))
+        self.assertEqual(list(queue.results()), [{"case_id": "a", "match": True}])
+
+class TestOpenQueue(unittest.TestCase):
+    def test_specs(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.assertIsInstance(open_queue(f"sqlite:{tmp}/q.sqlite"), SQLiteJobQueue)
+            self.assertIsInstance(open_queue(f"file:{tmp}/q"), FileJobQueue)
+            self.assertIsInstance(open_queue(f"{tmp}/jobs.db"), SQLiteJobQueue)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import unittest
+from src.batch import BatchCase, BatchRunner
+from src.journal import Journal
+from src.stubs import StubGenerator, StubEditor, StubAnalyzer
+from src.utils import image_writer
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        # Images and the journal live under ./output, so run from a scratch directory.
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        self.path = os.path.join("output", "journal.jsonl")
+        self.cases = [BatchCase(str(i), f"{i % 4 + 1} apples", i % 4 + 1, mode="loop") for i in range(8)]
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def _run(self, resume: bool, use_async: bool = False):
+        providers = StubGenerator(accuracy=0.5, seed=1), StubAnalyzer(accuracy=1.0, seed=2), StubEditor(accuracy=1.0, seed=3)
+        journal = Journal(self.path, fsync=False)
+        if resume:
+            journal.load()
+        else:
+            journal.start()
+        generator, analyzer, editor = providers
+        runner = BatchRunner(generator, analyzer, editor, journal=journal)
+        if use_async:
+            async def collect():
+                return [result async for result in runner.arun(self.cases)]
+            results = asyncio.run(collect())
+        else:
+            results = list(runner.run(self.cases))
+        image_writer.flush()
+        journal.close()
+        return runner, results, providers
+
+    def _rewrite(self, keep):
+        with open(self.path) as f:
+            records = [json.loads(line) for line in f]
+        with open(self.path, "w") as f:
+            for record in records:
+                if keep(record):
+                    f.write(json.dumps(record) + "\n")
+            # A crash mid-append leaves a truncated line behind.
+            f.write('{"case": "0:')
+
+    def test_finished_cases_are_skipped(self):
+        _, first, _ = self._run(resume=False)
+        runner, results, (generator, analyzer, editor) = self._run(resume=True)
+
+        self.assertEqual(results, [])
+        self.assertEqual(len(runner.finished(self.cases)), len(first))
+        self.assertEqual(generator.calls + analyzer.calls + editor.calls, 0)
+
+    def test_interrupted_steps_are_replayed(self):
+        _, first, _ = self._run(resume=False)
+        self._rewrite(lambda record: record["stage"] != "result")
+
+        runner, results, (generator, analyzer, editor) = self._run(resume=True, use_async=True)
+
+        self.assertEqual(runner.finished(self.cases), [])
+        self.assertEqual(generator.calls + analyzer.calls + editor.calls, 0)
+        by_case = {result["case_id"]: result for result in first}
+        for result in results:
+            self.assertEqual(result["image_path"], by_case[result["case_id"]]["image_path"])
+            self.assertEqual(result["detected_count"], by_case[result["case_id"]]["detected_count"])
+
+    def test_missing_images_are_generated_again(self):
+        self._run(resume=False)
+        self._rewrite(lambda record: record["stage"] != "result")
+        with open(self.path) as f:
+            generated = next(json.loads(line) for line in f if '"generate"' in line)
+        os.remove(generated["image_path"])
+
+        _, results, (generator, _, _) = self._run(resume=True)
+
+        self.assertEqual(len(results), len(self.cases))
+        self.assertEqual(generator.calls, 1)
+
+    def test_start_discards_earlier_runs(self):
+        self._run(resume=False)
+        journal = Journal(self.path, fsync=False)
+        journal.start()
+        journal.close()
+
+        runner, results, (generator, _, _) = self._run(resume=True)
+        self.assertEqual(len(results), len(self.cases))
+        self.assertEqual(generator.calls, len(self.cases))
+
+    def test_async_appends_run_off_the_event_loop(self):
+        journal = Journal(self.path, fsync=False)
+        threads = []
+        append = journal._append
+        journal._append = lambda record: (threads.append(threading.get_ident()), append(record))
+        runner = BatchRunner(StubGenerator(seed=1), StubAnalyzer(seed=2), StubEditor(seed=3), journal=journal)
+
+        async def collect():
+            return threading.get_ident(), [result async for result in runner.arun(self.cases)]
+
+        loop_thread, results = asyncio.run(collect())
+        image_writer.flush()
+        journal.close()
+
+        self.assertEqual(len(results), len(self.cases))
+        self.assertTrue(threads)
+        self.assertNotIn(loop_thread, threads)
+
+if __name__ == '__main__':
+    unittest.main()
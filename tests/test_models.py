@@ -1,8 +1,15 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
 import unittest
-from unittest.mock import MagicMock, patch
-from src.models import ImageResult
+from unittest.mock import AsyncMock, MagicMock, patch
+from src.models import ImageResult, ImageAnalyzer, as_image_result
+from src.utils import ImageWriter
 from src.generators import GeminiGenerator
 from src.analyzers import QwenAnalyzer
+from src.editors import FalEditor
 from src.evaluator import EvaluationLoop
 
 class TestEvaluationLoop(unittest.TestCase):
@@ -36,5 +43,180 @@ class TestEvaluationLoop(unittest.TestCase):
         self.mock_editor.edit.assert_called_once()
         self.assertEqual(len(result['steps']), 2) # Generate, Edit
 
+    def test_async_loop_mode_retry(self):
+        self.mock_generator.agenerate = AsyncMock(return_value=ImageResult(image_path="test.png", metadata={}))
+        self.mock_analyzer.aanalyze = AsyncMock(side_effect=[2, 3])
+        self.mock_editor.aedit = AsyncMock(return_value=ImageResult(image_path="edited.png", metadata={}))
+
+        loop = EvaluationLoop(self.mock_generator, self.mock_analyzer, self.mock_editor)
+        result = asyncio.run(loop.arun("3 apples", 3, mode="loop"))
+
+        self.assertTrue(result['match'])
+        self.assertEqual(result['image_path'], "edited.png")
+        self.mock_editor.aedit.assert_awaited_once()
+        self.mock_generator.generate.assert_not_called()
+
+    def test_async_defaults_to_sync_implementation(self):
+        class SyncAnalyzer(ImageAnalyzer):
+            def analyze(self, image_path, prompt):
+                return 4
+
+        self.assertEqual(asyncio.run(SyncAnalyzer().aanalyze("test.png", "count")), 4)
+
+    def test_loop_mode_hands_images_over_in_memory(self):
+        generated = ImageResult(image_path="test.png", metadata={}, data=b"generated")
+        edited = ImageResult(image_path="edited.png", metadata={}, data=b"edited")
+        self.mock_generator.generate.return_value = generated
+        self.mock_editor.edit.return_value = edited
+        self.mock_analyzer.analyze.side_effect = [2, 3]
+
+        loop = EvaluationLoop(self.mock_generator, self.mock_analyzer, self.mock_editor)
+        loop.run("3 apples", 3, mode="loop")
+
+        self.mock_editor.edit.assert_called_once_with(generated, unittest.mock.ANY)
+        self.assertIs(self.mock_analyzer.analyze.call_args_list[1].args[0], edited)
+
+    def test_speculative_mode_returns_first_match(self):
+        candidates = iter([ImageResult(image_path=f"candidate{i}.png", metadata={}) for i in range(3)])
+        self.mock_generator.generate.side_effect = lambda prompt: next(candidates)
+        self.mock_analyzer.analyze.side_effect = lambda image, prompt: 3 if image.image_path == "candidate1.png" else 5
+
+        loop = EvaluationLoop(self.mock_generator, self.mock_analyzer, self.mock_editor, candidates=3)
+        result = loop.run("3 apples", 3, mode="speculative")
+
+        self.assertTrue(result['match'])
+        self.assertEqual(result['image_path'], "candidate1.png")
+        self.mock_editor.edit.assert_not_called()
+
+    def test_async_speculative_mode_cancels_stragglers(self):
+        cancelled = []
+
+        async def slow_generate(prompt):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(prompt)
+                raise
+
+        fast_generator = MagicMock()
+        fast_generator.agenerate = AsyncMock(return_value=ImageResult(image_path="fast.png", metadata={"model": "fast"}))
+        slow_generator = MagicMock()
+        slow_generator.agenerate = slow_generate
+        self.mock_analyzer.aanalyze = AsyncMock(return_value=3)
+
+        loop = EvaluationLoop(fast_generator, self.mock_analyzer, candidates=2, candidate_generators=[slow_generator, fast_generator])
+        result = asyncio.run(loop.arun("3 apples", 3, mode="speculative"))
+
+        self.assertEqual(result['image_path'], "fast.png")
+        self.assertEqual(len(result['steps']), 1)
+        self.assertEqual({key: result['steps'][0][key] for key in ("action", "count", "model")}, {"action": "candidate", "count": 3, "model": "fast"})
+        self.assertEqual(cancelled, ["3 apples"])
+
+    def test_speculative_mode_skips_analyzing_late_candidates(self):
+        release = threading.Event()
+
+        def slow_generate(prompt):
+            release.wait(5)
+            return ImageResult(image_path="slow.png", metadata={})
+
+        fast_generator = MagicMock()
+        fast_generator.generate.return_value = ImageResult(image_path="fast.png", metadata={})
+        slow_generator = MagicMock()
+        slow_generator.generate.side_effect = slow_generate
+
+        loop = EvaluationLoop(fast_generator, self.mock_analyzer, candidates=2, candidate_generators=[slow_generator, fast_generator])
+        result = loop.run("3 apples", 3, mode="speculative")
+        release.set()
+        time.sleep(0.05)
+
+        # The slow generate call still finished, but its image was never analyzed.
+        self.assertEqual(result['image_path'], "fast.png")
+        slow_generator.generate.assert_called_once()
+        self.mock_analyzer.analyze.assert_called_once()
+
+    def test_speculative_mode_falls_back_to_editing_closest_candidate(self):
+        candidates = iter([ImageResult(image_path="far.png", metadata={}), ImageResult(image_path="near.png", metadata={})])
+        self.mock_generator.generate.side_effect = lambda prompt: next(candidates)
+        counts = {"far.png": 9, "near.png": 4, "edited.png": 3}
+        self.mock_analyzer.analyze.side_effect = lambda image, prompt: counts[image.image_path]
+
+        loop = EvaluationLoop(self.mock_generator, self.mock_analyzer, self.mock_editor, candidates=2)
+        result = loop.run("3 apples", 3, mode="speculative")
+
+        self.assertTrue(result['match'])
+        self.assertEqual(self.mock_editor.edit.call_args.args[0].image_path, "near.png")
+        self.assertEqual([step['action'] for step in result['steps']], ["candidate", "candidate", "edit"])
+
+class TestImageHandoff(unittest.TestCase):
+    def setUp(self):
+        # ImageWriter writes under ./output, so run from a scratch directory.
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_writer_persists_in_background(self):
+        writer = ImageWriter()
+        path = writer.save("generated_test", b"png-bytes")
+        writer.flush()
+
+        self.assertEqual(as_image_result(path).read_bytes(), b"png-bytes")
+
+    def test_disabled_writer_keeps_bytes_in_memory(self):
+        writer = ImageWriter(enabled=False)
+        result = ImageResult(image_path=writer.save("generated_test", b"png-bytes"), metadata={}, data=b"png-bytes")
+        writer.flush()
+
+        self.assertFalse(os.path.exists(result.image_path))
+        self.assertEqual(result.read_bytes(), b"png-bytes")
+
+class TestFalEditor(unittest.TestCase):
+    def setUp(self):
+        self.editor = FalEditor()
+        self.edit_response = {"images": [{"url": "https://fal.media/edited.png"}]}
+
+    @patch("src.editors.image_writer")
+    @patch("src.editors.downloader")
+    @patch("src.editors.fal_client")
+    def test_reuses_hosted_url(self, mock_fal, mock_downloader, mock_writer):
+        mock_fal.submit.return_value.get.return_value = self.edit_response
+        mock_downloader.fetch.return_value = b"edited"
+        generated = ImageResult(image_path="test.png", metadata={"url": "https://fal.media/test.png"}, data=b"generated")
+
+        edited = self.editor.edit(generated, "exactly 3 apples")
+
+        mock_fal.upload.assert_not_called()
+        self.assertEqual(mock_fal.submit.call_args.kwargs["arguments"]["image_url"], "https://fal.media/test.png")
+        self.assertEqual(edited.metadata["url"], "https://fal.media/edited.png")
+
+    @patch("src.editors.image_writer")
+    @patch("src.editors.downloader")
+    @patch("src.editors.fal_client")
+    def test_uploads_each_image_once(self, mock_fal, mock_downloader, mock_writer):
+        mock_fal.submit.return_value.get.return_value = self.edit_response
+        mock_fal.upload.return_value = "https://fal.media/uploaded.png"
+        mock_downloader.fetch.return_value = b"edited"
+
+        self.editor.edit(ImageResult(image_path="a.png", metadata={}, data=b"local"), "exactly 3 apples")
+        self.editor.edit(ImageResult(image_path="b.png", metadata={}, data=b"local"), "exactly 3 apples")
+
+        mock_fal.upload.assert_called_once()
+
+    @patch("src.editors.image_writer")
+    @patch("src.editors.downloader")
+    @patch("src.editors.fal_client")
+    def test_upload_declares_detected_mime(self, mock_fal, mock_downloader, mock_writer):
+        mock_fal.submit.return_value.get.return_value = self.edit_response
+        mock_fal.upload.return_value = "https://fal.media/uploaded.jpg"
+        mock_downloader.fetch.return_value = b"edited"
+        jpeg = b"\xff\xd8\xff\xe0jpeg"
+
+        self.editor.edit(ImageResult(image_path="a.jpg", metadata={}, data=jpeg), "exactly 3 apples")
+
+        mock_fal.upload.assert_called_once_with(jpeg, "image/jpeg")
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,86 @@
+import io
+import os
+import random
+import unittest
+from unittest.mock import MagicMock, patch
+from src.analyzers import QwenAnalyzer
+from src.cache import CachedAnalyzer
+from src.models import ImageResult
+from src.preprocess import ImagePreprocessor, detect_mime, parse_setting, payload_report
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+def _png(width: int, height: int, mode: str = "RGB") -> bytes:
+    rng = random.Random(0)
+    image = Image.frombytes(mode, (width, height), rng.randbytes(width * height * len(mode)))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+class TestDetectMime(unittest.TestCase):
+    def test_magic_bytes(self):
+        self.assertEqual(detect_mime(b"\x89PNG\r\n\x1a\n...."), "image/png")
+        self.assertEqual(detect_mime(b"\xff\xd8\xff\xe0...."), "image/jpeg")
+        self.assertEqual(detect_mime(b"RIFF\x00\x00\x00\x00WEBPVP8 "), "image/webp")
+        self.assertEqual(detect_mime(b"unknown"), "image/png")
+
+    def test_passthrough_keeps_bytes(self):
+        jpeg = b"\xff\xd8\xff\xe0jpeg"
+        self.assertEqual(ImagePreprocessor().prepare(ImageResult("a.jpg", {}, jpeg)), (jpeg, "image/jpeg"))
+
+@unittest.skipIf(Image is None, "Pillow is not installed")
+class TestImagePreprocessor(unittest.TestCase):
+    def test_downscales_and_reencodes(self):
+        original = _png(1024, 768)
+        preprocessor = ImagePreprocessor(max_dimension=256, format="jpeg", quality=70)
+
+        payload, mime = preprocessor.prepare(ImageResult("a.png", {}, original))
+
+        self.assertEqual(mime, "image/jpeg")
+        self.assertEqual(Image.open(io.BytesIO(payload)).size, (256, 192))
+        self.assertLess(len(payload), len(original) / 10)
+
+    def test_derived_images_are_cached(self):
+        preprocessor = ImagePreprocessor(max_dimension=64, format="webp")
+        image = ImageResult("a.png", {}, _png(128, 128))
+        with patch.object(preprocessor, "_derive", wraps=preprocessor._derive) as derive:
+            first = preprocessor.prepare(image)
+            second = preprocessor.prepare(ImageResult("copy.png", {}, image.read_bytes()))
+
+        self.assertEqual(first, second)
+        derive.assert_called_once()
+
+    def test_flattens_alpha_for_jpeg(self):
+        payload, mime = ImagePreprocessor(max_dimension=32, format="jpeg").prepare(ImageResult("a.png", {}, _png(64, 64, "RGBA")))
+        self.assertEqual((mime, Image.open(io.BytesIO(payload)).mode), ("image/jpeg", "RGB"))
+
+    @patch.dict(os.environ, {"OPENROUTER_API_KEY": "test-key"})
+    def test_analyzer_uploads_preprocessed_image(self):
+        analyzer = QwenAnalyzer(ImagePreprocessor(max_dimension=64, format="jpeg"))
+        url = analyzer._messages(ImageResult("a.png", {}, _png(128, 128)), "count")[0]["content"][1]["image_url"]["url"]
+        self.assertTrue(url.startswith("data:image/jpeg;base64,"))
+
+        cached = CachedAnalyzer(analyzer, MagicMock())
+        self.assertEqual(cached.cache_model, f"{analyzer.model}@max=64,format=jpeg,quality=85")
+
+    def test_payload_report(self):
+        samples = [(ImageResult(f"{i}.png", {}, _png(256, 256)), i, "count") for i in range(4)]
+
+        def factory(preprocessor):
+            analyzer = MagicMock()
+            # Pretend the smallest setting loses accuracy.
+            analyzer.analyze.side_effect = lambda image, prompt: -1 if preprocessor.max_dimension == 32 else int(image.image_path[0])
+            return analyzer
+
+        rows = payload_report(factory, samples, ["original", "128:jpeg:80", "32:jpeg:50"])
+
+        self.assertEqual([row["accuracy"] for row in rows], [1.0, 1.0, 0.0])
+        self.assertEqual(rows[0]["payload_ratio"], 1.0)
+        self.assertLess(rows[1]["mean_upload_bytes"], rows[0]["mean_upload_bytes"])
+        self.assertEqual(parse_setting("768:webp").signature, "max=768,format=webp,quality=85")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import asyncio
+import os
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+from src.analyzers import QwenAnalyzer
+from src.models import ImageResult
+from src.ratelimit import ProviderLimiter, RateLimitError, RateLimiterRegistry, throttle_info
+
+class _Throttled(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after=None):
+        super().__init__("429 Too Many Requests")
+        self.response = MagicMock(headers={"retry-after": str(retry_after)} if retry_after is not None else {})
+
+class TestProviderLimiter(unittest.TestCase):
+    def test_throttle_info_reads_retry_after(self):
+        self.assertEqual(throttle_info(_Throttled(2)), (True, 2.0))
+        self.assertEqual(throttle_info(_Throttled()), (True, None))
+        self.assertEqual(throttle_info(ValueError("bad request")), (False, None))
+
+    def test_retries_throttled_call_and_halves_concurrency(self):
+        limiter = ProviderLimiter("test/model", max_concurrency=8, backoff=0.01)
+        fn = MagicMock(side_effect=[_Throttled(0.01), "ok"])
+
+        self.assertEqual(limiter.call(fn, "arg"), "ok")
+        self.assertEqual(fn.call_count, 2)
+        self.assertEqual(limiter.stats()["throttle_events"], 1)
+        self.assertEqual(limiter.stats()["concurrency_limit"], 4)
+        self.assertEqual(limiter.stats()["in_flight"], 0)
+
+    def test_gives_up_with_rate_limit_error(self):
+        limiter = ProviderLimiter("test/model", max_attempts=2, backoff=0.01)
+        with self.assertRaises(RateLimitError):
+            limiter.call(MagicMock(side_effect=_Throttled(0.01)))
+
+    def test_other_errors_are_not_retried(self):
+        limiter = ProviderLimiter("test/model")
+        fn = MagicMock(side_effect=ValueError("bad request"))
+        with self.assertRaises(ValueError):
+            limiter.call(fn)
+        fn.assert_called_once()
+
+    def test_concurrency_cap(self):
+        limiter = ProviderLimiter("test/model", max_concurrency=2)
+        active = 0
+        peak = 0
+        lock = threading.Lock()
+
+        def work():
+            nonlocal active, peak
+            with lock:
+                active += 1
+                peak = max(peak, active)
+            time.sleep(0.02)
+            with lock:
+                active -= 1
+
+        threads = [threading.Thread(target=limiter.call, args=(work,)) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(peak, 2)
+
+    def test_async_call(self):
+        limiter = ProviderLimiter("test/model", backoff=0.01)
+        attempts = 0
+
+        async def work():
+            nonlocal attempts
+            attempts += 1
+            if attempts == 1:
+                raise _Throttled()
+            return "ok"
+
+        self.assertEqual(asyncio.run(limiter.acall(work)), "ok")
+        self.assertEqual(attempts, 2)
+
+    def test_registry_applies_provider_and_model_settings(self):
+        registry = RateLimiterRegistry()
+        registry.configure("openai", max_concurrency=4)
+        registry.configure("openai/gpt-image-1", rate=2.0)
+        limiter = registry.get("openai", "gpt-image-1")
+
+        self.assertIs(registry.get("openai", "gpt-image-1"), limiter)
+        self.assertEqual(limiter.max_concurrency, 4)
+        self.assertEqual(limiter.rate, 2.0)
+
+class TestAnalyzerThrottling(unittest.TestCase):
+    @patch.dict(os.environ, {"OPENROUTER_API_KEY": "test-key"})
+    @patch("src.analyzers.limiters")
+    def test_throttled_analysis_is_not_reported_as_miscount(self, mock_limiters):
+        mock_limiters.get.return_value.call.side_effect = RateLimitError("throttled")
+        with self.assertRaises(RateLimitError):
+            QwenAnalyzer().analyze(ImageResult(image_path="test.png", metadata={}, data=b"png"), "count")
+
+if __name__ == '__main__':
+    unittest.main()
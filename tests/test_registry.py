@@ -0,0 +1,55 @@
+import os
+import subprocess
+import sys
+import unittest
+from src.registry import ProviderRegistry
+from src.stubs import StubAnalyzer, StubGenerator
+from src.utils import LazyModule, lazy_module
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class TestProviderRegistry(unittest.TestCase):
+    def test_creates_builtin_provider(self):
+        registry = ProviderRegistry()
+        self.assertIsInstance(registry.create("generator", "stub"), StubGenerator)
+        self.assertIn("fal", registry.names("generator"))
+
+    def test_unknown_name_lists_choices(self):
+        with self.assertRaisesRegex(ValueError, "expected one of"):
+            ProviderRegistry().load("analyzer", "nope")
+        with self.assertRaises(ValueError):
+            ProviderRegistry().load("upscaler", "stub")
+
+    def test_register_reference_or_class(self):
+        registry = ProviderRegistry()
+        registry.register("analyzer", "strict", ".stubs:StubAnalyzer")
+        registry.register("analyzer", "factory", lambda: StubAnalyzer(accuracy=1.0))
+
+        self.assertIs(registry.load("analyzer", "strict"), StubAnalyzer)
+        self.assertEqual(registry.create("analyzer", "factory").accuracy, 1.0)
+
+    def test_sdks_are_imported_on_first_use(self):
+        script = (
+            "import sys, main\n"
+            "from src.registry import providers\n"
+            "analyzer = providers.create('analyzer', 'qwen')\n"
+            "print('openai' in sys.modules, 'google.genai' in sys.modules, 'fal_client' in sys.modules, 'requests' in sys.modules)\n"
+            "analyzer.client\n"
+            "print('openai' in sys.modules)\n"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True, check=True,
+            env={**os.environ, "OPENROUTER_API_KEY": "test-key"},
+        ).stdout.split("\n")
+
+        self.assertEqual(output[0], "False False False False")
+        self.assertEqual(output[1], "True")
+
+class TestLazyModule(unittest.TestCase):
+    def test_imports_on_attribute_access(self):
+        self.assertIs(lazy_module("json"), sys.modules["json"])
+        module = LazyModule("colorsys")
+        self.assertEqual(module.rgb_to_hsv(1.0, 0.0, 0.0), (0.0, 1.0, 1.0))
+
+if __name__ == '__main__':
+    unittest.main()
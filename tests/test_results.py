@@ -0,0 +1,83 @@
+import importlib.util
+import tempfile
+import unittest
+from src.results import ResultsStore, edits_to_match
+
+HAS_NUMPY = importlib.util.find_spec("numpy") is not None
+HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None
+
+def _result(case_id, target, counts, actions=None, **extra):
+    actions = actions or ["generate"] + ["edit"] * (len(counts) - 1)
+    steps = [{"action": action, "count": count, "cost_usd": 0.01} for action, count in zip(actions, counts)]
+    return {
+        "case_id": case_id, "prompt": f"{target} apples", "object": None, "mode": "loop",
+        "target_count": target, "detected_count": counts[-1], "match": counts[-1] == target,
+        "cost_usd": 0.01 * len(counts), "steps": steps, **extra,
+    }
+
+class TestEditsToMatch(unittest.TestCase):
+    def test_counts_edits_until_first_match(self):
+        self.assertEqual(edits_to_match(_result("a", 3, [3])), 0)
+        self.assertEqual(edits_to_match(_result("a", 3, [2, 4, 3])), 2)
+        self.assertEqual(edits_to_match(_result("a", 3, [2, 4])), -1)
+        self.assertEqual(edits_to_match(_result("a", 3, [2, 3], ["candidate", "candidate"])), 0)
+
+@unittest.skipUnless(HAS_NUMPY, "numpy is not installed")
+class TestResultsStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.results = [
+            _result("1", 3, [3]),
+            _result("2", 3, [2, 3]),
+            _result("3", 5, [4, 4, 6]),
+            _result("4", 5, [-1]),
+            {"case_id": "5", "prompt": "5 pears", "error": "boom", "target_count": 5, "match": False, "steps": []},
+        ]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _store(self, format):
+        store = ResultsStore(self.tmp.name, format=format, flush_rows=2)
+        for i, result in enumerate(self.results):
+            store.append(result, run_id="r1", generator="gemini" if i % 2 else "fal", editor="fal", analyzer="qwen")
+        store.close()
+        return store
+
+    def test_round_trip_npz(self):
+        store = self._store("npz")
+        table = store.load()
+        self.assertEqual(table["case_id"].tolist(), ["1", "2", "3", "4", "5"])
+        self.assertEqual(table["object"].tolist(), ["apples", "apples", "apples", "apples", "pears"])
+        self.assertEqual(table["edits_to_match"].tolist(), [0, 1, -1, -1, -1])
+        self.assertEqual(table["error"].tolist(), [False, False, False, False, True])
+        self.assertEqual(store.load("steps", ["action"])["action"].tolist().count("edit"), 3)
+
+    @unittest.skipUnless(HAS_PYARROW, "pyarrow is not installed")
+    def test_round_trip_parquet(self):
+        table = self._store("parquet").load(columns=["case_id", "detected_count", "generator"])
+        self.assertEqual(sorted(table), ["case_id", "detected_count", "generator"])
+        self.assertEqual(table["detected_count"].tolist(), [3, 3, 6, -1, -1])
+        self.assertEqual(table["generator"].tolist(), ["fal", "gemini", "fal", "gemini", "fal"])
+
+    def test_accuracy_and_confusion(self):
+        from src.analytics import accuracy, confusion_matrices
+        table = self._store("npz").load()
+
+        rows = {row["target_count"]: row for row in accuracy(table, ["target_count"], max_edits=2)}
+        self.assertEqual(rows[3]["exact_match_rate"], 1.0)
+        self.assertEqual(rows[3]["edits_to_match"], {"0": 1, "1": 1, "2+": 0, "never": 0})
+        # The failed analysis and the errored case are left out of MAE and bias.
+        self.assertEqual((rows[5]["n"], rows[5]["failed"], rows[5]["mae"], rows[5]["bias"]), (3, 2, 1.0, 1.0))
+        self.assertIsNone(rows[5]["cost_per_match_usd"])
+
+        by_generator = accuracy(table, ["generator", "target_count"])
+        self.assertEqual([(row["generator"], row["target_count"], row["n"]) for row in by_generator],
+                         [("fal", 3, 1), ("fal", 5, 2), ("gemini", 3, 1), ("gemini", 5, 1)])
+
+        [matrix] = confusion_matrices(table)
+        self.assertEqual(matrix["labels"], [3, 5])
+        self.assertEqual(matrix["matrix"], [[2, 0, 0], [0, 0, 3]])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import tempfile
+import time
+import unittest
+from src.batch import BatchCase, BatchRunner
+from src.store import ContentStore, FlatStore
+from src.stubs import StubGenerator, StubAnalyzer
+from src.utils import ImageWriter, image_labels, image_writer
+
+class TestContentStore(unittest.TestCase):
+    def setUp(self):
+        # The store lives under ./output, so run from a scratch directory.
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        self.store = ContentStore()
+        self.writer = ImageWriter(store=self.store)
+
+    def tearDown(self):
+        self.store.close()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_identical_bytes_are_stored_once(self):
+        with image_labels(prompt="3 apples", case="a"):
+            first = self.writer.save("generated_test", b"png-bytes", model="m1")
+        second = self.writer.save("edited_test", b"png-bytes", model="m2")
+        other = self.writer.save("generated_test", b"other-bytes")
+        self.writer.flush()
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        digest = os.path.basename(first).split(".")[0]
+        self.assertEqual(first, os.path.join("output", "images", digest[:2], digest[2:4], f"{digest}.png"))
+        with open(first, "rb") as f:
+            self.assertEqual(f.read(), b"png-bytes")
+
+        stats = self.store.stats()
+        self.assertEqual((stats["images"], stats["files"], stats["dedup_hits"]), (3, 2, 1))
+        self.assertEqual([row["model"] for row in self.store.find(prompt="3 apples")], ["m1"])
+        self.assertEqual(self.store.find(case="a")[0]["path"], first)
+
+    def test_batch_labels_images_with_case_prompt_and_step(self):
+        # Stub providers save through the shared writer.
+        runner = BatchRunner(StubGenerator(seed=1), StubAnalyzer(seed=2), None)
+        previous, image_writer.store = image_writer.store, self.store
+        try:
+            results = list(runner.run([BatchCase("c1", "3 apples", 3), BatchCase("c2", "5 pears", 5)]))
+            image_writer.flush()
+        finally:
+            image_writer.store = previous
+
+        rows = {row["case"]: row for row in self.store.find()}
+        self.assertEqual(set(rows), {"c1", "c2"})
+        self.assertEqual((rows["c1"]["prompt"], rows["c1"]["model"], rows["c1"]["step"]), ("3 apples", "stub-generator", 0))
+        self.assertEqual(rows["c2"]["path"], next(r["image_path"] for r in results if r["case_id"] == "c2"))
+
+    def test_gc_by_age_keeps_shared_files(self):
+        old = self.writer.save("generated_test", b"shared")
+        self.writer.save("generated_test", b"old-only")
+        self.writer.flush()
+        conn = self.store._connection()
+        conn.execute("UPDATE images SET created_at = ?", (time.time() - 3600,))
+        conn.commit()
+        self.writer.save("generated_test", b"shared")
+        self.writer.flush()
+
+        removed = self.store.gc(max_age=60)
+
+        self.assertEqual((removed["removed_images"], removed["removed_files"]), (2, 1))
+        self.assertTrue(os.path.exists(old))
+        self.assertEqual(self.store.stats()["files"], 1)
+
+    def test_gc_by_size_evicts_least_recently_used(self):
+        paths = []
+        for i in range(3):
+            paths.append(self.writer.save("generated_test", bytes([i]) * 100))
+            self.writer.flush()
+            time.sleep(0.01)
+        # Saving the first image again makes it the most recently used.
+        self.writer.save("generated_test", bytes([0]) * 100)
+        self.writer.flush()
+
+        removed = self.store.gc(max_bytes=200)
+
+        self.assertEqual(removed["freed_bytes"], 100)
+        self.assertEqual([os.path.exists(path) for path in paths], [True, False, True])
+
+    def test_link_view_uses_flat_names(self):
+        path = self.writer.save("generated_test", b"png-bytes", model="m1")
+        self.writer.flush()
+
+        links = self.store.link_view("view", model="m1")
+
+        self.assertEqual(len(links), 1)
+        self.assertTrue(os.path.basename(links[0]).startswith("generated_test_"))
+        self.assertEqual(os.path.realpath(links[0]), os.path.realpath(path))
+
+    def test_flat_store_keeps_the_old_layout(self):
+        writer = ImageWriter(store=FlatStore())
+        path = writer.save("generated_test", b"png-bytes")
+        writer.flush()
+
+        self.assertEqual(os.path.dirname(path), "output")
+        self.assertTrue(os.path.basename(path).startswith("generated_test_"))
+
+if __name__ == '__main__':
+    unittest.main()
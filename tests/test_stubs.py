@@ -0,0 +1,82 @@
+import asyncio
+import os
+import tempfile
+import unittest
+import zlib
+from src.benchmark import BenchmarkConfig, percentile, run_benchmark
+from src.evaluator import EvaluationLoop
+from src.stubs import Latency, StubGenerator, StubEditor, StubAnalyzer, make_png, png_size, read_png_count
+from src.utils import image_writer
+
+class TestStubs(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        image_writer.enabled = False
+
+    def tearDown(self):
+        image_writer.enabled = True
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_png_is_real_and_records_count(self):
+        data = make_png(7, 64, 32)
+
+        self.assertTrue(data.startswith(b"\x89PNG\r\n\x1a\n"))
+        self.assertEqual(png_size(data), (64, 32))
+        self.assertEqual(read_png_count(data), 7)
+        idat = data[data.index(b"IDAT") + 4:data.index(b"IEND") - 8]
+        self.assertEqual(len(zlib.decompress(idat)), 32 * (1 + 64 * 3))
+        self.assertNotEqual(make_png(7, 64, 32), data)
+
+    def test_loop_through_stubs(self):
+        loop = EvaluationLoop(
+            StubGenerator(accuracy=0.0, seed=1),
+            StubAnalyzer(accuracy=1.0, seed=2),
+            StubEditor(accuracy=1.0, seed=3),
+        )
+        result = asyncio.run(loop.arun("4 apples", 4, mode="loop"))
+
+        self.assertTrue(result['match'])
+        self.assertEqual([step['action'] for step in result['steps']], ["generate", "edit"])
+
+    def test_failures(self):
+        with self.assertRaises(RuntimeError):
+            StubGenerator(failure_rate=1.0).generate("3 apples")
+        image = StubGenerator().generate("3 apples")
+        self.assertEqual(StubAnalyzer(failure_rate=1.0).analyze(image, "count"), -1)
+
+    def test_latency_distribution(self):
+        import random
+        rng = random.Random(0)
+        self.assertEqual(Latency(0.5).sample(rng), 0.5)
+        samples = [Latency(0.5, 0.5).sample(rng) for _ in range(1000)]
+        self.assertAlmostEqual(percentile(samples, 50), 0.5, delta=0.05)
+
+class TestBenchmark(unittest.TestCase):
+    def setUp(self):
+        # The benchmark saves images under ./output, so run from a scratch directory.
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+
+    def tearDown(self):
+        image_writer.flush()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_report(self):
+        zero = Latency()
+        for scenario in ("sequential", "batch", "async"):
+            report = run_benchmark(BenchmarkConfig(
+                scenario=scenario, cases=5, width=16, height=16,
+                generate_latency=zero, edit_latency=zero, analyze_latency=zero,
+            ))
+            self.assertEqual(report["cases"], 5)
+            self.assertEqual(report["provider_calls"]["generate"], 5)
+            for key in ("throughput_cases_per_second", "latency_p50", "latency_p95", "latency_p99", "peak_memory_mb"):
+                self.assertIn(key, report)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import asyncio
+import os
+import random
+import tempfile
+import threading
+import unittest
+from src.batch import BatchCase, BatchRunner
+from src.stubs import StubGenerator, StubAnalyzer
+from src.sweep import AdaptiveSweep, wilson_interval
+from src.utils import image_writer
+
+class _FakeRunner:
+    """Matches each bucket's cases at a fixed rate, keyed by prompt."""
+
+    generate_concurrency = analyze_concurrency = edit_concurrency = 2
+
+    def __init__(self, rates: dict):
+        self.rates = rates
+        self.rng = random.Random(0)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def run_case(self, case: BatchCase) -> dict:
+        with self._lock:
+            self.calls += 1
+            match = self.rng.random() < self.rates[case.prompt]
+        return {"case_id": case.case_id, "match": match}
+
+class TestWilsonInterval(unittest.TestCase):
+    def test_interval(self):
+        self.assertEqual(wilson_interval(0, 0), (0.0, 1.0))
+        low, high = wilson_interval(50, 100)
+        self.assertAlmostEqual(low, 0.4038, places=3)
+        self.assertAlmostEqual(high, 0.5962, places=3)
+        # Never collapses to zero width at the edges.
+        self.assertGreater(wilson_interval(10, 10)[1] - wilson_interval(10, 10)[0], 0.2)
+
+class TestAdaptiveSweep(unittest.TestCase):
+    def test_budget_goes_to_uncertain_buckets(self):
+        buckets = [BatchCase("0", "easy", 1), BatchCase("1", "hard", 5)]
+        runner = _FakeRunner({"easy": 1.0, "hard": 0.5})
+        sweep = AdaptiveSweep(buckets, tolerance=0.2, budget=400, min_samples=5)
+
+        results = list(sweep.run(runner))
+
+        easy, hard = sweep.report()
+        self.assertEqual(len(results), runner.calls)
+        self.assertTrue(easy["settled"] and hard["settled"])
+        self.assertLess(easy["ci_high"] - easy["ci_low"], 0.2)
+        self.assertLess(easy["samples"], hard["samples"] / 3)
+        # A fixed design giving every bucket the hard bucket's sample size would cost far more.
+        self.assertLess(runner.calls, 2 * hard["samples"] * 0.7)
+
+    def test_budget_is_a_hard_cap(self):
+        runner = _FakeRunner({"a": 0.5, "b": 0.5})
+        sweep = AdaptiveSweep([BatchCase("0", "a", 1), BatchCase("1", "b", 2)], tolerance=0.01, budget=30)
+
+        list(sweep.run(runner))
+
+        self.assertEqual(runner.calls, 30)
+        self.assertFalse(any(row["settled"] for row in sweep.report()))
+
+    def test_max_samples_and_errors(self):
+        runner = _FakeRunner({"a": 0.5})
+        failing = BatchCase("1", "b", 2)
+        run_case = runner.run_case
+        runner.run_case = lambda case: {"case_id": case.case_id, "error": "boom"} if case.prompt == "b" else run_case(case)
+        sweep = AdaptiveSweep([BatchCase("0", "a", 1), failing], tolerance=0.01, budget=50, max_samples=10)
+
+        list(sweep.run(runner))
+
+        a, b = sweep.report()
+        self.assertEqual((a["samples"], a["settled"]), (10, True))
+        self.assertEqual((b["samples"], b["errors"], b["failing"]), (0, 5, True))
+
+    def test_async_sweep_with_stub_providers(self):
+        tmp = tempfile.TemporaryDirectory()
+        cwd = os.getcwd()
+        os.chdir(tmp.name)
+        try:
+            runner = BatchRunner(StubGenerator(accuracy=1.0, seed=1), StubAnalyzer(accuracy=1.0, seed=2), None)
+            sweep = AdaptiveSweep([BatchCase("0", "3 apples", 3), BatchCase("1", "4 pears", 4)], tolerance=0.3, budget=100, min_samples=3)
+
+            async def collect():
+                return [result async for result in sweep.arun(runner)]
+
+            results = asyncio.run(collect())
+            image_writer.flush()
+        finally:
+            os.chdir(cwd)
+            tmp.cleanup()
+
+        self.assertTrue(all(result["match"] for result in results))
+        self.assertTrue(all(row["settled"] for row in sweep.report()))
+        self.assertEqual(len({result["case_id"] for result in results}), len(results))
+
+if __name__ == '__main__':
+    unittest.main()
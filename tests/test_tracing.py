@@ -0,0 +1,92 @@
+import json
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+from src.analyzers import QwenAnalyzer
+from src.evaluator import EvaluationLoop
+from src.models import ImageResult
+from src.tracing import Histogram, Tracer, token_usage, tracer
+
+class TestHistogram(unittest.TestCase):
+    def test_quantiles_interpolate_within_buckets(self):
+        histogram = Histogram(buckets=(1.0, 2.0, 4.0))
+        for value in (0.5, 1.5, 1.5, 3.0):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.counts, [1, 2, 1, 0])
+        self.assertEqual(histogram.quantile(0.5), 1.5)
+        self.assertLessEqual(histogram.quantile(0.99), 3.0)
+        self.assertEqual(histogram.to_dict()["count"], 4)
+
+class TestTracer(unittest.TestCase):
+    def setUp(self):
+        tracer.reset()
+
+    def test_token_usage_reads_openai_and_gemini_shapes(self):
+        chat = SimpleNamespace(usage=SimpleNamespace(prompt_tokens=1200, completion_tokens=8))
+        images = SimpleNamespace(usage=SimpleNamespace(input_tokens=40, output_tokens=1056))
+        gemini = SimpleNamespace(usage_metadata=SimpleNamespace(prompt_token_count=300, candidates_token_count=5))
+
+        self.assertEqual(token_usage(chat), (1200, 8))
+        self.assertEqual(token_usage(images), (40, 1056))
+        self.assertEqual(token_usage(gemini), (300, 5))
+        self.assertEqual(token_usage(MagicMock(spec=[])), (0, 0))
+
+    @patch.dict(os.environ, {"OPENROUTER_API_KEY": "test-key"})
+    def test_step_carries_timings_usage_and_cost(self):
+        analyzer = QwenAnalyzer()
+        analyzer.client = MagicMock()
+        analyzer.client.chat.completions.create.return_value = SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content='{"count": 3}'))],
+            usage=SimpleNamespace(prompt_tokens=1_000_000, completion_tokens=0),
+        )
+        generator = MagicMock()
+
+        def generate(prompt):
+            tracer.usage("fal-ai/recraft-v3", images=1)
+            return ImageResult(image_path="test.png", metadata={}, data=b"png")
+
+        generator.generate.side_effect = generate
+
+        result = EvaluationLoop(generator, analyzer).run("3 apples", 3)
+        step = result['steps'][0]
+
+        self.assertEqual(step['usage'], {"input_tokens": 1_000_000, "output_tokens": 0, "images": 1})
+        self.assertAlmostEqual(step['cost_usd'], 0.04 + 0.3)
+        self.assertAlmostEqual(result['cost_usd'], 0.34)
+        for stage in ("generate", "analyze", "encode", "queue_wait", "network"):
+            self.assertIn(stage, step['timings'])
+
+        metrics = tracer.to_json()
+        self.assertEqual(metrics["results"], {"matched": 1, "unmatched": 0})
+        self.assertAlmostEqual(metrics["cost_per_correct_image_usd"], 0.34)
+        providers = {(row["stage"], row["provider"]) for row in metrics["stages"]}
+        self.assertIn(("network", f"openrouter/{analyzer.model}"), providers)
+
+    def test_exports(self):
+        local = Tracer(prices={"model": {"image": 0.5}})
+        with local.span("generate"):
+            pass
+        local.usage("model", input_tokens=10, images=2)
+        local.result(True)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            json_path = os.path.join(tmp, "metrics", "run.json")
+            prom_path = os.path.join(tmp, "run.prom")
+            local.write_json(json_path)
+            local.write_prometheus(prom_path)
+            with open(json_path) as f:
+                metrics = json.load(f)
+            with open(prom_path) as f:
+                text = f.read()
+
+        self.assertEqual(metrics["cost_per_correct_image_usd"], 1.0)
+        self.assertIn('imgcount_stage_seconds_bucket{stage="generate",provider="",le="+Inf"} 1', text)
+        self.assertIn('imgcount_tokens_total{model="model",direction="input"} 10', text)
+        self.assertIn('imgcount_cost_usd_total{model="model"} 1.0', text)
+        self.assertIn('imgcount_results_total{match="true"} 1', text)
+
+if __name__ == '__main__':
+    unittest.main()